@@ -60,10 +60,13 @@ setup(
     install_requires=[
         "numpy",
         "opencv-python",
-        "sklearn",
         "scipy",
         "webcolors"
     ],
+    extras_require={
+        # alternative backend to cluster the colors
+        "sklearn": ["scikit-learn"]
+    },
     description="White Brush is a tool for enhancing hand-written notes.",
     license="MIT",
     classifiers=[
@@ -1,6 +1,13 @@
+import pytest
+
 from white_brush.colors import calc_colors
 import numpy as np
 
+from tests.resources import get_test_images
+from white_brush.colors.color_balance import balance_color
+from white_brush.colors.color_extraction import adaptive_threshold
+from white_brush.colors.utils import _generate_bitmask
+
 
 class TestCalcColors:
     def test_choose_representative_colors_only_black(self):
@@ -21,3 +28,72 @@ class TestCalcColors:
         (colors, assigned) = calc_colors.choose_representative_colors(input)
         colors_cmp = np.sort(colors, axis=0)
         assert np.allclose(expected, colors_cmp), "Wrong representative colors are returned."
+
+    def test_choose_representative_colors_matches_clustering_all_colors(self):
+        """
+        Clustering the distinct colors weighted by their counts should
+        result in representative colors as good as clustering every
+        single color, measured by the sum of squared distances of the
+        colors to their representative
+        """
+        cluster = pytest.importorskip("sklearn.cluster")
+        for name, img in get_test_images():
+            if name not in ("01.png", "07_multi_color.png"):
+                continue
+            img = balance_color(img)
+            colors = img[adaptive_threshold(img, 31, 10)] & _generate_bitmask(2, 8)
+
+            _, assigned = calc_colors.choose_representative_colors(colors)
+            centers = np.array([colors[assigned == i].mean(axis=0) for i in np.unique(assigned)])
+            squared_distances = ((colors[:, None, :] - centers[None]) ** 2).sum(axis=2).min(axis=1)
+
+            model = cluster.KMeans(n_clusters=8, n_init=3, random_state=0).fit(colors)
+            assert squared_distances.sum() <= model.inertia_ * 1.05
+
+    def test_choose_representative_colors_few_colors(self):
+        """
+        If there are less distinct colors than representative colors,
+        each color should be assigned to itself
+        """
+        colors = np.array([[0, 0, 0], [200, 200, 200], [0, 0, 0], [100, 100, 100]], np.uint8)
+        (palette, assigned) = calc_colors.choose_representative_colors(colors, n=4)
+        assert palette.shape == (4, 3)
+        assert (palette[assigned][:, 0] == [0, 255, 0, 128]).all()
+
+        palette, assigned = calc_colors.choose_representative_colors(np.zeros((0, 3), np.uint8))
+        assert palette.shape == (8, 3)
+        assert len(assigned) == 0
+
+    def test_palette_assigns_nearest_color(self):
+        """
+        Colors should be assigned to the nearest center of a palette
+        """
+        palette = calc_colors.Palette([[0, 0, 0], [200, 0, 0], [0, 0, 200]],
+                                      [[0, 0, 0], [255, 0, 0], [0, 0, 255]])
+        colors = np.array([[10, 10, 10], [180, 20, 0], [0, 0, 240], [90, 0, 0]], np.uint8)
+        assert (palette.assign(colors) == [0, 1, 2, 0]).all()
+
+        # a fitted palette should assign the colors it was fitted on
+        # like choose_representative_colors does
+        colors = np.repeat(colors, 10, axis=0)
+        palette = calc_colors.Palette.fit(colors, n=4)
+        representative_colors, assigned = calc_colors.choose_representative_colors(colors, n=4)
+        assert (palette.colors[palette.assign(colors)] == representative_colors[assigned]).all()
+
+    def test_choose_representative_colors_backends_match(self):
+        """
+        The built-in k-means should choose representative colors as
+        good as scikit-learn does
+        """
+        pytest.importorskip("sklearn")
+        for name, img in get_test_images():
+            img = balance_color(img)
+            colors = img[adaptive_threshold(img, 31, 10)] & _generate_bitmask(2, 8)
+
+            inertias = {}
+            for backend in calc_colors.KMEANS_BACKENDS:
+                centers, assigned = calc_colors._fit_representative_colors(colors, backend=backend)
+                assert centers.shape == (8, 3)
+                assert assigned.shape == (len(colors),)
+                inertias[backend] = ((colors - centers[assigned]) ** 2).sum()
+            assert inertias["numpy"] <= inertias["sklearn"] * 1.01, name
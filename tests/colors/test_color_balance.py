@@ -1,6 +1,6 @@
 import cv2
 import numpy as np
-from hypothesis import given, assume
+from hypothesis import given, assume, strategies as st
 from hypothesis.extra.numpy import arrays
 
 from tests.resources import get_test_images
@@ -61,3 +61,54 @@ class TestColorBalance:
                 "Maximum of each channel should be 255"
             assert channel.min() == 0, \
                 "Minimum of each channel should be 0"
+
+    def test_color_balance_lookup_table_matches_float_calculation(self):
+        """
+        Given the test images located in the test_images directory
+
+        Performing color balancing on the uint8 image, which is done with
+        a histogram and a lookup table, and on a float copy of it
+
+        Should result in exactly the same image
+        """
+        for name, img in get_test_images():
+            for percentile in (0, 0.5, 1):
+                assert (balance_color(img, percentile) ==
+                        balance_color(img.astype(np.float64), percentile)).all()
+                assert (balance_color(img, percentile, False) ==
+                        balance_color(img.astype(np.float64), percentile,
+                                      False)).all()
+
+    @given(arrays(shape=(10, 10), dtype=np.int16,
+                  elements=st.integers(-255, 255)),
+           st.sampled_from([0, 0.5, 1, 2.5, 30]))
+    def test_color_balance_integer_lookup_table_random_images(self, img,
+                                                              percentile):
+        """
+        Given random integer images, e.g. differences of two images
+
+        Performing color balancing on them and on a float copy
+
+        Should result in exactly the same image
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            expected = balance_color(img.astype(np.float64), percentile,
+                                     separate_channels=False)
+        balanced_img = balance_color(img, percentile, separate_channels=False)
+        assert (balanced_img == expected).all()
+
+    def test_color_balance_integer_image_with_wide_range(self):
+        """
+        Given integer images whose values span a range too wide for a
+        histogram
+
+        Performing color balancing on them and on a float copy
+
+        Should result in exactly the same image
+        """
+        for img in (np.array([[0, 2 ** 40]]),
+                    np.array([[-30000, 0, 30000], [5, 6, 7]], np.int16)):
+            expected = balance_color(img.astype(np.float64), 0.5,
+                                     separate_channels=False)
+            assert (balance_color(img, 0.5, separate_channels=False) ==
+                    expected).all()
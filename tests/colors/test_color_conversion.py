@@ -93,3 +93,22 @@ class TestColorExtraction:
         assert out_img.shape == img.shape
         assert np.all(out_img[~mask] == 255)
 
+    def test_colorspace_conversion_mask_to_indexed(self):
+        """
+        The indexed images should have the same colors as the RGB
+        images, with the background color as first palette color
+        """
+        img_name, img = get_test_image()
+        mask = np.zeros(img.shape[:2], dtype=np.bool)
+        mask[50:100, 100:150] = True
+
+        indexed = mask_to_indexed(mask, (255, 255, 255), (255, 0, 0))
+        assert indexed.labels.shape == mask.shape
+        assert (indexed.palette == [[255, 255, 255], [255, 0, 0]]).all()
+        assert (indexed.to_rgb() == mask_to_rgb(mask, (255, 255, 255), (255, 0, 0))).all()
+
+        indexed = mask_to_indexed_with_fg_colors_from_image(mask, (255, 255, 255), img)
+        assert len(indexed.palette) == 9
+        assert (indexed.labels[~mask] == 0).all()
+        assert (indexed.labels[mask] > 0).all()
+        assert (indexed.to_rgb() == mask_to_rgb_with_fg_colors_from_image(mask, (255, 255, 255), img)).all()
@@ -1,8 +1,10 @@
+import cv2
 from numpy.testing import assert_allclose
 
 import white_brush.colors.color_extraction as ce
 from tests.resources import *
 from white_brush.colors.color_balance import balance_color
+from white_brush.colors.morphology import dilate, erode
 
 
 class TestColorExtraction:
@@ -23,7 +25,7 @@ class TestColorExtraction:
             if name in expected_masked_pixels:
                 img = balance_color(img)
                 bg_colors = ce.extract_background_colors(img, thresh=0.4)
-                mask = ce.hsv_distance_threshold(img, bg_colors)
+                mask = ce.hsv_distance_threshold(img, bg_colors, exact=True)
                 assert mask.sum() == expected_masked_pixels[name]
 
         # if no bg_colors are specified, they should be calculated from
@@ -32,6 +34,23 @@ class TestColorExtraction:
         mask_auto = ce.hsv_distance_threshold(img)
         assert mask_auto.shape == (img.shape[0], img.shape[1])
 
+    def test_hsv_thresholding_lookup_table(self):
+        """
+        Looking up the reduced colors in a table should give nearly the
+        same mask as calculating the HSV distance of the exact colors
+        """
+        for name, img in get_test_images():
+            img = balance_color(img)
+            bg_colors = ce.extract_background_colors(img, thresh=0.4)
+            exact = ce.hsv_distance_threshold(img, bg_colors, exact=True)
+            mask = ce.hsv_distance_threshold(img, bg_colors)
+            assert mask.shape == exact.shape
+            assert (mask == exact).mean() > 0.98
+
+        # a single color is accepted as well
+        mask = ce.hsv_distance_threshold(img, np.array([255, 255, 255]))
+        assert mask.shape == exact.shape
+
     def test_adaptive_thresholding_with_example_images(self):
         expected_masked_pixels = {
             "01.png": 138641,
@@ -71,3 +90,58 @@ class TestColorExtraction:
             assert backgrounds.ndim == 2
             assert backgrounds.shape[1] == 3
 
+    def test_extract_background_colors_from_all_pixels(self):
+        """
+        Counting the colors of all pixels should find the same colors
+        as counting them directly
+        """
+        name, img = get_test_image()
+        reduced = img.reshape(-1, 3) & 0b11111100
+        colors, counts = np.unique(reduced, axis=0, return_counts=True)
+        expected = colors[counts / counts.max() >= 0.4]
+
+        backgrounds = ce.extract_background_colors(img, sample_fraction=1)
+        assert backgrounds.dtype == np.uint8
+        assert_allclose(backgrounds, expected)
+
+    def test_estimate_background_exact(self):
+        """Without downscaling, the background is blurred and eroded
+        at the resolution of the image"""
+        name, img = get_test_image()
+        gray = 255 - ce.rgb_to_gray(img)
+        expected = erode(cv2.medianBlur(gray, 7), 21)
+        assert (ce.estimate_background(gray, 21, 7, downscale=1)
+                == expected).all()
+
+    def test_background_difference_image_downscaled(self):
+        """Estimating the background at a lower resolution should give
+        nearly the same foreground as the exact estimation"""
+        for name, img in get_test_images():
+            img = balance_color(img)
+            exact = ce.otsu_threshold(
+                ce.background_difference_image(img, downscale=1))
+            downscaled = ce.otsu_threshold(
+                ce.background_difference_image(img, downscale=4))
+            assert downscaled.shape == exact.shape
+            assert (downscaled == exact).mean() > 0.98
+
+    def test_background_difference_image_matches_int64_reference(self):
+        """The int16 difference should give the same images and masks
+        as calculating the difference with int64"""
+        def reference(img):
+            gray = ce.rgb_to_gray(img)
+            if np.median(gray) > 80:
+                gray = 255 - gray
+            background = ce.estimate_background(gray)
+            diff = gray.astype(np.int64) - background.astype(np.int64)
+            diff = balance_color(diff, percentile=1, separate_channels=False)
+            return 255 - dilate(erode(diff, 3), 3)
+
+        for name, img in get_test_images():
+            img = balance_color(img)
+            expected = reference(img)
+            bg_diff = ce.background_difference_image(img)
+            assert bg_diff.dtype == np.uint8
+            assert (bg_diff == expected).all()
+            assert (ce.otsu_threshold(bg_diff)
+                    == ce.otsu_threshold(expected)).all()
@@ -151,3 +151,16 @@ class TestColorExtraction(unittest.TestCase):
         r, g, b = utils._unpack_rgb_values(rgb)
         rgb_back = np.stack([r, g, b], axis=1)
         assert_allclose(rgb_arr, rgb_back)
+
+    @given(arrays(np.uint8, (10, 20, 3)))
+    def test_pack_rgb_6bit(self, img):
+        """
+        Test converting colors to packed 6 bit values and back, which
+        should only lose the lowest two bits of each channel
+        """
+        packed = utils._pack_rgb_6bit(img)
+        assert packed.shape == (10, 20)
+        assert packed.max() < utils._RGB_6BIT_SIZE
+        unpacked = utils._unpack_rgb_6bit(packed)
+        assert unpacked.dtype == np.uint8
+        assert_allclose(unpacked >> 2, img >> 2)
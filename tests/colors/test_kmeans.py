@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from white_brush.colors import kmeans
+
+
+class TestKMeans:
+
+    def test_kmeans_separated_clusters(self):
+        """Clearly separated clusters should be found exactly"""
+        random = np.random.RandomState(0)
+        expected_centers = np.array([[0, 0, 0], [100, 0, 0], [0, 100, 0], [0, 0, 100]], float)
+        points = np.concatenate([center + random.uniform(-5, 5, (50, 3)) for center in expected_centers])
+
+        centers, labels, inertia = kmeans.kmeans(points, 4)
+        assert centers.shape == (4, 3)
+        assert labels.shape == (200,)
+        # every cluster of points gets a label of its own
+        assert len(np.unique(labels)) == 4
+        assert (labels.reshape(4, 50) == labels[::50, None]).all()
+        np.testing.assert_allclose(centers[labels[::50]], expected_centers, atol=2)
+        assert inertia == pytest.approx(((points - centers[labels]) ** 2).sum())
+
+    def test_kmeans_deterministic(self):
+        """The same random state should result in the same clusters"""
+        points = np.random.RandomState(1).uniform(0, 255, (500, 3))
+        first = kmeans.kmeans(points, 8, random_state=3)
+        second = kmeans.kmeans(points, 8, random_state=3)
+        assert (first[0] == second[0]).all()
+        assert (first[1] == second[1]).all()
+        assert first[2] == second[2]
+
+    def test_kmeans_weights(self):
+        """Weighting points should be the same as repeating them"""
+        random = np.random.RandomState(2)
+        points = random.randint(0, 64, (300, 3)) * 4
+        weights = random.randint(1, 5, 300)
+        repeated = np.repeat(points, weights, axis=0)
+
+        _, _, weighted_inertia = kmeans.kmeans(points, 5, weights)
+        _, _, repeated_inertia = kmeans.kmeans(repeated, 5)
+        assert weighted_inertia == pytest.approx(repeated_inertia, rel=0.05)
+
+    def test_kmeans_matches_sklearn(self):
+        """
+        The clusters should be as good as the ones of scikit-learn,
+        measured by the sum of squared distances to the centers
+        """
+        cluster = pytest.importorskip("sklearn.cluster")
+        random = np.random.RandomState(4)
+        for _ in range(5):
+            points = random.randint(0, 64, (2000, 3)) * 4
+            weights = random.randint(1, 100, 2000)
+            _, _, inertia = kmeans.kmeans(points, 8, weights)
+            model = cluster.KMeans(n_clusters=8, n_init=3, random_state=0).fit(points, sample_weight=weights)
+            assert inertia <= model.inertia_ * 1.01
+
+    def test_kmeans_duplicate_points(self):
+        """Less distinct points than clusters should not fail"""
+        points = np.array([[0, 0, 0]] * 5 + [[10, 10, 10]] * 5)
+        centers, labels, inertia = kmeans.kmeans(points, 4)
+        assert centers.shape == (4, 3)
+        assert (centers[labels] == points).all()
+        assert inertia == 0
+
+    def test_nearest_centers(self):
+        centers = np.array([[0, 0, 0], [100, 100, 100], [0, 0, 0]])
+        points = np.array([[10, 0, 0], [60, 60, 60], [40, 40, 40], [0, 0, 0]])
+        # the first of equally near centers is chosen
+        assert (kmeans.nearest_centers(points, centers) == [0, 1, 0, 0]).all()
@@ -1,7 +1,8 @@
 import numpy as np
 from numpy.testing import assert_allclose
 
-from white_brush.colors.morphology import erode, dilate, smooth
+from white_brush.colors.morphology import erode, dilate, smooth, opening, \
+    closing
 
 
 class TestMorphology:
@@ -109,6 +110,37 @@ class TestMorphology:
 
         assert_allclose(smoothed, expected_mask)
 
+    def test_opening_and_closing(self):
+        """Opening and closing should equal the chained erosion and
+        dilation, for boolean masks as well as for grayscale images"""
+        random = np.random.RandomState(0)
+        mask = random.rand(60, 80) > 0.6
+        gray = random.randint(0, 256, (60, 80)).astype(np.uint8)
+        for img in (mask, gray):
+            for kernel_shape in ("rect", "ellipse", "cross"):
+                assert (opening(img, 5, kernel_shape) ==
+                        dilate(erode(img, 5, kernel_shape), 5,
+                               kernel_shape)).all()
+                assert (closing(img, 5, kernel_shape) ==
+                        erode(dilate(img, 5, kernel_shape), 5,
+                              kernel_shape)).all()
+            expected = erode(dilate(dilate(erode(img, 3), 3), 3), 3)
+            original = img.copy()
+            assert (smooth(img, 3) == expected).all()
+            # the input must not be modified
+            assert (img == original).all()
+
+    def test_output_buffers_and_iterations(self):
+        random = np.random.RandomState(1)
+        for img in (random.rand(40, 30) > 0.5,
+                    random.randint(0, 256, (40, 30)).astype(np.uint8)):
+            dst = np.empty_like(img)
+            result = dilate(img, 3, dst=dst)
+            assert result is dst
+            assert (dst == dilate(img, 3)).all()
+            assert (erode(img, 3, iterations=2) ==
+                    erode(erode(img, 3), 3)).all()
+
     def _generate_mask_from_str(self, str_mask):
         """
         Parse a boolean mask from a given string
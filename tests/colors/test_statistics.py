@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+from hypothesis import given, strategies as st
+from hypothesis.extra.numpy import arrays
+
+from tests.resources import get_test_images
+from white_brush.colors.color_extraction import adaptive_threshold, \
+    otsu_threshold, background_difference_image
+from white_brush.colors.conversion import rgb_to_gray
+from white_brush.colors.statistics import ImageStatistics
+
+
+class TestImageStatistics:
+
+    def test_statistics_with_test_images(self):
+        """
+        The statistics calculated from the histogram should be the same
+        as the ones calculated by numpy and OpenCV from the pixels
+        """
+        for name, img in get_test_images():
+            gray = rgb_to_gray(img)
+            stats = ImageStatistics.of(gray)
+
+            assert stats.median == np.median(gray)
+            for q in (0.5, 1, 25, 99):
+                assert stats.percentile(q) == np.percentile(gray, q)
+            otsu, _ = cv2.threshold(gray, 0, 255,
+                                    cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            assert stats.otsu_threshold == otsu
+
+    @given(arrays(np.uint8, st.tuples(st.integers(1, 30),
+                                       st.integers(1, 30))))
+    def test_statistics_with_random_images(self, gray):
+        """
+        The statistics should be exact for images with an even or odd
+        number of pixels and any distribution of values
+        """
+        stats = ImageStatistics.of(gray)
+        assert stats.median == np.median(gray)
+        assert stats.percentile(10) == np.percentile(gray, 10)
+        otsu, _ = cv2.threshold(gray, 0, 255,
+                                cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        assert stats.otsu_threshold == otsu
+
+    def test_thresholds_with_shared_statistics(self):
+        """
+        Passing precomputed statistics should not change the results
+        of the functions using them
+        """
+        for name, img in get_test_images():
+            stats = ImageStatistics.of(rgb_to_gray(img))
+            assert (adaptive_threshold(img, 31, 10, stats=stats)
+                    == adaptive_threshold(img, 31, 10)).all()
+            assert (otsu_threshold(img, stats=stats)
+                    == otsu_threshold(img)).all()
+            assert (background_difference_image(img, stats=stats)
+                    == background_difference_image(img)).all()
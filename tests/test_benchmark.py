@@ -0,0 +1,45 @@
+import json
+
+import cv2
+
+from tests.resources import get_test_image
+from white_brush import benchmark
+
+
+class TestBenchmark:
+    def test_run_benchmark(self, tmp_path):
+        name, img = get_test_image()
+        cv2.imwrite(str(tmp_path / "small.png"), cv2.resize(img, (200, 150)))
+
+        images = benchmark.load_images(str(tmp_path), scales=(1, 2))
+        results = benchmark.run_benchmark(images, ["enhance", "dilate"], repeat=2)
+
+        assert set(results["cases"]) == {"enhance@1x", "enhance@2x", "dilate@1x", "dilate@2x"}
+        for result in results["cases"].values():
+            assert result["calls"] == 2
+            assert result["throughput"] > 0
+            assert 0 < result["latency"]["p50"] <= result["latency"]["p99"]
+        assert "extract_foreground" in results["cases"]["enhance@1x"]["stages"]
+        json.dumps(results)
+
+    def test_compare_with_baseline(self):
+        def results(latency, rss):
+            return {"cases": {"enhance@1x": {"latency": {"p50": latency}}}, "peak_rss": rss}
+
+        assert benchmark.compare(results(1.1, 100), results(1.0, 100), tolerance=0.2) == []
+        assert len(benchmark.compare(results(1.5, 100), results(1.0, 100), tolerance=0.2)) == 1
+        assert len(benchmark.compare(results(1.0, 200), results(1.0, 100), tolerance=0.2)) == 1
+        # cases which are not in the baseline are not compared
+        assert benchmark.compare(results(1.5, 100), {"cases": {}, "peak_rss": None}) == []
+
+    def test_main_fails_on_regression(self, tmp_path):
+        name, img = get_test_image()
+        cv2.imwrite(str(tmp_path / "small.png"), cv2.resize(img, (200, 150)))
+        output, baseline = tmp_path / "results.json", tmp_path / "baseline.json"
+        baseline.write_text(json.dumps({"cases": {"dilate@1x": {"latency": {"p50": 0}}}}))
+
+        args = ["--images", str(tmp_path), "--scales", "1", "--cases", "dilate", "--repeat", "1",
+                "--output", str(output)]
+        assert benchmark.main(args) == 0
+        assert "dilate@1x" in json.loads(output.read_text())["cases"]
+        assert benchmark.main(args + ["--baseline", str(baseline)]) == 1
@@ -0,0 +1,73 @@
+import os
+
+from white_brush.cache import ResultCache
+
+
+class TestResultCache:
+    def test_key(self, tmp_path):
+        """
+        Keys should only depend on the content of the input, the
+        fingerprint and the extension
+        """
+        (tmp_path / "a.png").write_bytes(b"image")
+        (tmp_path / "copy of a.png").write_bytes(b"image")
+        (tmp_path / "b.png").write_bytes(b"other image")
+        cache = ResultCache(str(tmp_path / "cache"))
+
+        key = cache.key(str(tmp_path / "a.png"), "config", ".png")
+        assert key == cache.key(str(tmp_path / "copy of a.png"), "config", ".PNG")
+        assert key != cache.key(str(tmp_path / "b.png"), "config", ".png")
+        assert key != cache.key(str(tmp_path / "a.png"), "other config", ".png")
+        assert key != cache.key(str(tmp_path / "a.png"), "config", ".jpg")
+        # the content in memory has the same key as the file
+        assert key == cache.data_key(memoryview(b"image"), "config", ".png")
+
+    def test_put_and_get(self, tmp_path):
+        """
+        A stored result should be copied to the output file
+        """
+        (tmp_path / "result.png").write_bytes(b"result")
+        cache = ResultCache(str(tmp_path / "cache"))
+
+        assert not cache.get("abc.png", str(tmp_path / "out" / "a.png"))
+        cache.put("abc.png", str(tmp_path / "result.png"))
+        assert cache.get("abc.png", str(tmp_path / "out" / "a.png"))
+        assert (tmp_path / "out" / "a.png").read_bytes() == b"result"
+
+    def test_put_same_key_twice(self, tmp_path):
+        """
+        Storing a result with the same key again should replace it,
+        without counting the replaced result
+        """
+        (tmp_path / "result.png").write_bytes(b"result")
+        (tmp_path / "other.png").write_bytes(b"other")
+        cache = ResultCache(str(tmp_path / "cache"))
+
+        cache.put("abc.png", str(tmp_path / "result.png"))
+        cache.put("def.png", str(tmp_path / "other.png"))
+        for _ in range(3):
+            cache.put("abc.png", str(tmp_path / "result.png"))
+        assert cache.__size__ == len(b"result") + len(b"other")
+        assert cache.get("abc.png", str(tmp_path / "out.png"))
+        assert (tmp_path / "out.png").read_bytes() == b"result"
+
+    def test_least_recently_used_results_are_evicted(self, tmp_path):
+        """
+        Storing a result in a full cache should evict the results which
+        were used the longest time ago
+        """
+        (tmp_path / "result.png").write_bytes(b"x" * 100)
+        cache = ResultCache(str(tmp_path / "cache"), max_size=300)
+        for i, key in enumerate(["a1.png", "b1.png", "c1.png"]):
+            cache.put(key, str(tmp_path / "result.png"))
+            # make the order of usage independent of the timer resolution
+            os.utime(os.path.join(str(tmp_path / "cache"), key[:2], key), (i, i))
+        assert cache.get("a1.png", str(tmp_path / "out.png"))
+
+        cache.put("d1.png", str(tmp_path / "result.png"))
+
+        out = str(tmp_path / "out.png")
+        assert not cache.get("b1.png", out)
+        assert cache.get("a1.png", out)
+        assert cache.get("c1.png", out)
+        assert cache.get("d1.png", out)
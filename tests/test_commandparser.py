@@ -1,3 +1,4 @@
+import os
 import sys
 import unittest
 
@@ -185,6 +186,191 @@ class TestCommandParser(unittest.TestCase):
         self.assertEqual(expected, mocked_enhance_command.used_configuration.foreground_color)
         self.assertEqual(1, mocked_enhance_command.amount_of_processed_files)
 
+    def test_parse_args_given_files_with_palette_tags_should_call_FileEnhanceCommand(self):
+        """
+             Given
+                 valid file command parameters and multiple --palette tags
+             When
+                 CommandParser.parse_args() is called
+             Then
+                 FileEnhanceCommand with all palette colors should be called.
+             """
+        # Arrange
+        mocked_enhance_command = MockedFileEnhanceCommand()
+        mocked_template_command = MockedTemplateCommand()
+        mocked_rotation_command = MockedRotationCommand()
+        class_under_test = CommandParser(mocked_enhance_command, mocked_template_command, mocked_rotation_command)
+        args = "whitebrush -p black --palette #0000FF -p 255,0,0 cookie.png".split(' ')
+
+        # Act
+        sys.argv = args
+        class_under_test.parse_args()
+
+        # Assert
+        self.assertTrue(mocked_enhance_command.called)
+        self.assertEqual(["black", "#0000FF", "255,0,0"],
+                         mocked_enhance_command.used_configuration.foreground_palette)
+        self.assertEqual(1, mocked_enhance_command.amount_of_processed_files)
+
+    def test_parse_args_given_files_with_jobs_tag_should_call_FileEnhanceCommand(self):
+        """
+             Given
+                 valid file command parameters and --jobs
+             When
+                 CommandParser.parse_args() is called
+             Then
+                 FileEnhanceCommand with the number of jobs should be called.
+             """
+        # Arrange
+        mocked_enhance_command = MockedFileEnhanceCommand()
+        mocked_template_command = MockedTemplateCommand()
+        mocked_rotation_command = MockedRotationCommand()
+        class_under_test = CommandParser(mocked_enhance_command, mocked_template_command, mocked_rotation_command)
+        args = "whitebrush --jobs 4 cookie.png strange_image.png".split(' ')
+
+        # Act
+        sys.argv = args
+        class_under_test.parse_args()
+
+        # Assert
+        self.assertTrue(mocked_enhance_command.called)
+        self.assertEqual(4, mocked_enhance_command.used_configuration.jobs)
+        self.assertEqual(2, mocked_enhance_command.amount_of_processed_files)
+
+    def test_parse_args_given_files_with_shared_palette_tag_should_call_FileEnhanceCommand(self):
+        """
+             Given
+                 valid file command parameters and --shared-palette
+             When
+                 CommandParser.parse_args() is called
+             Then
+                 FileEnhanceCommand with the number of files of the shared palette should be called.
+             """
+        # Arrange
+        mocked_enhance_command = MockedFileEnhanceCommand()
+        mocked_template_command = MockedTemplateCommand()
+        mocked_rotation_command = MockedRotationCommand()
+        class_under_test = CommandParser(mocked_enhance_command, mocked_template_command, mocked_rotation_command)
+        args = "whitebrush --shared-palette 3 cookie.png strange_image.png".split(' ')
+
+        # Act
+        sys.argv = args
+        class_under_test.parse_args()
+
+        # Assert
+        self.assertTrue(mocked_enhance_command.called)
+        self.assertEqual(3, mocked_enhance_command.used_configuration.shared_palette)
+        self.assertEqual(2, mocked_enhance_command.amount_of_processed_files)
+
+    def test_parse_args_given_files_with_indexed_tag_should_call_FileEnhanceCommand(self):
+        """
+             Given
+                 valid file command parameters and --indexed
+             When
+                 CommandParser.parse_args() is called
+             Then
+                 FileEnhanceCommand with indexed images should be called.
+             """
+        # Arrange
+        mocked_enhance_command = MockedFileEnhanceCommand()
+        mocked_template_command = MockedTemplateCommand()
+        mocked_rotation_command = MockedRotationCommand()
+        class_under_test = CommandParser(mocked_enhance_command, mocked_template_command, mocked_rotation_command)
+        args = "whitebrush --indexed cookie.png strange_image.png".split(' ')
+
+        # Act
+        sys.argv = args
+        class_under_test.parse_args()
+
+        # Assert
+        self.assertTrue(mocked_enhance_command.called)
+        self.assertTrue(mocked_enhance_command.used_configuration.indexed)
+        self.assertEqual(2, mocked_enhance_command.amount_of_processed_files)
+
+    def test_parse_args_given_files_with_kmeans_backend_tag_should_call_FileEnhanceCommand(self):
+        """
+             Given
+                 valid file command parameters and --kmeans-backend sklearn
+             When
+                 CommandParser.parse_args() is called
+             Then
+                 FileEnhanceCommand with the sklearn k-means backend should be called.
+             """
+        # Arrange
+        mocked_enhance_command = MockedFileEnhanceCommand()
+        mocked_template_command = MockedTemplateCommand()
+        mocked_rotation_command = MockedRotationCommand()
+        class_under_test = CommandParser(mocked_enhance_command, mocked_template_command, mocked_rotation_command)
+        args = "whitebrush --kmeans-backend sklearn cookie.png strange_image.png".split(' ')
+
+        # Act
+        sys.argv = args
+        class_under_test.parse_args()
+
+        # Assert
+        self.assertTrue(mocked_enhance_command.called)
+        self.assertEqual("sklearn", mocked_enhance_command.used_configuration.kmeans_backend)
+        self.assertEqual(2, mocked_enhance_command.amount_of_processed_files)
+
+    def test_parse_args_given_files_with_encoder_tags_should_call_FileEnhanceCommand(self):
+        """
+             Given
+                 valid file command parameters, encoder parameters and --write-threads
+             When
+                 CommandParser.parse_args() is called
+             Then
+                 FileEnhanceCommand with the encoder parameters and write threads should be called.
+             """
+        # Arrange
+        mocked_enhance_command = MockedFileEnhanceCommand()
+        mocked_template_command = MockedTemplateCommand()
+        mocked_rotation_command = MockedRotationCommand()
+        class_under_test = CommandParser(mocked_enhance_command, mocked_template_command, mocked_rotation_command)
+        args = "whitebrush --png-compression 1 --png-strategy rle --jpeg-quality 90 --write-threads 2 cookie.png strange_image.png".split(' ')
+
+        # Act
+        sys.argv = args
+        class_under_test.parse_args()
+
+        # Assert
+        self.assertTrue(mocked_enhance_command.called)
+        self.assertEqual({"png_compression": 1, "png_strategy": 3, "jpeg_quality": 90},
+                         mocked_enhance_command.used_configuration.encoder_params)
+        self.assertEqual(2, mocked_enhance_command.used_configuration.write_threads)
+        self.assertEqual(2, mocked_enhance_command.amount_of_processed_files)
+
+    def test_parse_args_given_files_with_incremental_tag_should_call_FileEnhanceCommand(self):
+        """
+             Given
+                 valid file command parameters and --incremental or --manifest
+             When
+                 CommandParser.parse_args() is called
+             Then
+                 FileEnhanceCommand with the manifest file should be called.
+             """
+        test_cases = [
+            # the default manifest lies next to the input files
+            ("whitebrush --incremental cookie.png", os.path.join(os.getcwd(), ".whitebrush_manifest.jsonl"), 1),
+            ("whitebrush --incremental images/cookie.png images/nested/strange_image.png",
+             os.path.join(os.getcwd(), "images", ".whitebrush_manifest.jsonl"), 2),
+            ("whitebrush --manifest runs.jsonl cookie.png", "runs.jsonl", 1),
+            ("whitebrush cookie.png", None, 1)
+        ]
+        for args, expected, amount_of_files in test_cases:
+            # Arrange
+            mocked_enhance_command = MockedFileEnhanceCommand()
+            mocked_template_command = MockedTemplateCommand()
+            mocked_rotation_command = MockedRotationCommand()
+            class_under_test = CommandParser(mocked_enhance_command, mocked_template_command, mocked_rotation_command)
+
+            # Act
+            sys.argv = args.split(' ')
+            class_under_test.parse_args()
+
+            # Assert
+            self.assertEqual(expected, mocked_enhance_command.used_configuration.manifest_file)
+            self.assertEqual(amount_of_files, mocked_enhance_command.amount_of_processed_files)
+
     def test_parse_args_given_files_with_template_tag_should_call_TemplateCommand(self):
         """
              Given
@@ -0,0 +1,50 @@
+import os
+
+from white_brush import discovery
+
+PNG_CONTENT = b"\x89PNG\r\n\x1a\n" + bytes(16)
+JPEG_CONTENT = b"\xff\xd8\xff\xe0" + bytes(16)
+
+
+class TestDiscovery:
+    def test_is_image_file(self, tmp_path):
+        """
+        Only files with an image extension and matching leading bytes
+        should be recognized as images
+        """
+        files = {
+            "image.png": (PNG_CONTENT, True),
+            "image.JPG": (JPEG_CONTENT, True),
+            "image.webp": (b"RIFF\x00\x00\x00\x00WEBPVP8 ", True),
+            "notes.txt": (b"Hello World", False),
+            "video.mp4": (b"\x00\x00\x00\x18ftypmp42", False),
+            "fake.png": (b"Hello World", False),
+            "mislabeled.txt": (PNG_CONTENT, False),
+            "empty.jpg": (b"", False)
+        }
+        for name, (content, _) in files.items():
+            (tmp_path / name).write_bytes(content)
+
+        for name, (_, expected) in files.items():
+            assert discovery.is_image_file(str(tmp_path / name)) == expected
+
+    def test_iter_image_files(self, tmp_path):
+        """
+        Iterating a directory should yield all images in it, and
+        only with the recursive flag also the ones in sub directories
+        """
+        (tmp_path / "sub" / "subsub").mkdir(parents=True)
+        (tmp_path / "a.png").write_bytes(PNG_CONTENT)
+        (tmp_path / "notes.txt").write_bytes(b"Hello World")
+        (tmp_path / "sub" / "b.jpg").write_bytes(JPEG_CONTENT)
+        (tmp_path / "sub" / "subsub" / "c.png").write_bytes(PNG_CONTENT)
+
+        def relative(files):
+            return {os.path.relpath(file, str(tmp_path)) for file in files}
+
+        files = discovery.iter_image_files(str(tmp_path))
+        assert relative(files) == {"a.png"}
+
+        files = discovery.iter_image_files(str(tmp_path), recursive=True)
+        assert relative(files) == {"a.png", os.path.join("sub", "b.jpg"),
+                                   os.path.join("sub", "subsub", "c.png")}
@@ -1,9 +1,26 @@
+import itertools
+import json
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+import pytest
 from pytest_mock import MockFixture
 
-from tests.resources import get_test_image
-from white_brush.enhance import enhance
+from tests.resources import get_test_image, get_test_images
+from white_brush import io
+from white_brush.cache import ResultCache
+from white_brush.colors import conversion
+from white_brush.colors.calc_colors import Palette
+from white_brush.enhance import enhance, ImageEnhancer, _stretch_background_difference
 from white_brush.entities.color_configuration import ColorConfiguration
+from white_brush.entities.indexed_image import IndexedImage
+from white_brush.io import ImageWriter, map_file
+from white_brush.profiling import TimingLog
 from white_brush.services import enhance_service
+from white_brush.workspace import Workspace
 
 
 class TestEnhance:
@@ -47,6 +64,146 @@ class TestEnhance:
         assert img.shape == enhanced.shape
 
 
+    def test_enhancing_a_large_image_at_full_resolution(self):
+        """
+        Enhancing a large Image at full resolution should keep its size
+        and result in the same image as enhancing at working resolution,
+        apart from the finer edges
+        """
+        img_name, img = get_test_image()
+        img = cv2.resize(img, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+        for config in (ColorConfiguration(), ColorConfiguration(foreground_color="black")):
+            enhanced = enhance(img, config)
+            full_enhanced = enhance(img, config, full_resolution=True)
+            assert full_enhanced.shape == img.shape
+
+            downsampled = cv2.resize(full_enhanced, enhanced.shape[1::-1],
+                                     interpolation=cv2.INTER_AREA)
+            difference = np.abs(downsampled.astype(np.int16) - enhanced).max(axis=2)
+            assert (difference < 60).mean() > 0.98
+
+    def test_enhancing_a_small_image_at_full_resolution(self):
+        """
+        Enhancing an image which is not downscaled anyway at full
+        resolution should give the same result
+        """
+        img_name, img = get_test_image()
+        config = ColorConfiguration(foreground_color="black")
+        assert (enhance(img, config, full_resolution=True) == enhance(img, config)).all()
+
+    def test_enhancing_with_a_stage_hook(self):
+        """
+        A stage hook should receive the timing of every stage and should
+        not change the enhanced image
+        """
+        img_name, img = get_test_image()
+        timings = []
+        enhanced = enhance(img, ColorConfiguration(), stage_hook=timings.append)
+
+        stages = [timing.stage for timing in timings]
+        for stage in ("transform", "preprocess", "extract_foreground", "apply_colors",
+                      "extract_foreground.otsu_threshold"):
+            assert stage in stages
+        assert all(timing.wall_time >= 0 for timing in timings)
+        assert timings[-1].shape == list(enhanced.shape)
+        assert (enhanced == enhance(img, ColorConfiguration())).all()
+
+    def test_enhancing_with_a_workspace(self):
+        """
+        Reusing the buffers of a workspace should not change the
+        enhanced images, which are never part of the workspace
+        """
+        workspace = Workspace()
+        config = ColorConfiguration()
+        img_name, img = get_test_image()
+        first = enhance(img, config, workspace=workspace)
+        peak_nbytes = workspace.peak_nbytes
+        assert peak_nbytes > 0
+
+        second = enhance(img, config, workspace=workspace)
+        assert second is not first
+        assert (first == second).all()
+        assert (first == enhance(img, config)).all()
+        # the same buffers are used for the second image
+        assert workspace.peak_nbytes == peak_nbytes
+
+    def test_disabled_stages_are_skipped(self):
+        """
+        Intermediates which are only needed by a disabled stage should
+        not be computed
+        """
+        img_name, img = get_test_image()
+        timings = []
+        enhanced = enhance(img, ColorConfiguration(), stage_hook=timings.append,
+                           foreground_stages=("adaptive_threshold",), smooth_kernel_size=3)
+        assert enhanced.shape == img.shape
+
+        stages = [timing.stage for timing in timings]
+        assert "extract_foreground.adaptive_threshold" in stages
+        assert "extract_foreground.background" not in stages
+        assert "extract_foreground.otsu_threshold" not in stages
+        # every intermediate is computed only once
+        assert len(stages) == len(set(stages))
+
+    def test_enhancing_with_a_shared_palette(self):
+        """
+        A shared palette should color the foreground like a palette
+        fitted to the image itself, without fitting one
+        """
+        img_name, img = get_test_image()
+        config = ColorConfiguration()
+        enhancer = ImageEnhancer(config, 0)
+        palette = Palette.fit(enhancer.foreground_colors(img))
+        shared = enhance(img, config, palette=palette)
+        assert shared.shape == img.shape
+        # the palette was fitted to this image alone, so only the
+        # colors of the foreground pixels can differ
+        assert (shared == enhance(img, config)).all(axis=2).mean() > 0.95
+        assert set(map(tuple, shared.reshape(-1, 3))) <= \
+            set(map(tuple, palette.colors)) | {(255, 255, 255)}
+
+    def test_enhancing_with_a_foreground_palette(self):
+        """
+        Every foreground pixel should be snapped to one of the colors of
+        a fixed palette, invalid colors should be reported
+        """
+        img_name, img = get_test_image()
+        palette = ["black", "#0000FF", "255,0,0"]
+        enhanced = enhance(img, ColorConfiguration(foreground_palette=palette))
+        assert enhanced.shape == img.shape
+        colors = set(map(tuple, enhanced.reshape(-1, 3)))
+        assert colors <= {(0, 0, 0), (0, 0, 255), (255, 0, 0), (255, 255, 255)}
+
+        # the foreground color takes precedence over the palette
+        config = ColorConfiguration(foreground_color="green", foreground_palette=palette)
+        assert (enhance(img, config) == enhance(img, ColorConfiguration(foreground_color="green"))).all()
+
+        with pytest.raises(ValueError):
+            enhance(img, ColorConfiguration(foreground_palette=["black", "no color"]))
+
+    def test_enhancing_to_an_indexed_image(self):
+        """
+        The indexed image should have the colors of the RGB image, for
+        the working and for the full resolution
+        """
+        img_name, img = get_test_image()
+        for config in (ColorConfiguration(), ColorConfiguration(foreground_color="black")):
+            for full_resolution in (False, True):
+                indexed = enhance(img, config, full_resolution=full_resolution, indexed=True)
+                assert indexed.labels.dtype == np.uint8
+                assert len(indexed.palette) <= 9
+                assert (indexed.to_rgb() == enhance(img, config, full_resolution=full_resolution)).all()
+
+    def test_stretch_background_difference(self):
+        """
+        The saturating uint8 arithmetic should give the same result as
+        the calculation with a wider integer type, for every value
+        """
+        bg_diff = np.arange(256, dtype=np.uint8).reshape(16, 16)
+        expected = 255 - np.clip((255 - bg_diff.astype(np.int64)) * 2, 0, 255)
+        assert (_stretch_background_difference(bg_diff) == expected).all()
+
+
 class TestEnhanceService:
     def test_enhance_service(self, mocker: MockFixture):
         # mock the io module
@@ -58,5 +215,238 @@ class TestEnhanceService:
         service = enhance_service.EnhanceService()
         service.enhance_file("input.jpg", "output.jpg", 0, ColorConfiguration())
 
-        mock_io.read_image.assert_called_with("input.jpg")
+        mock_io.read_image.assert_called_with("input.jpg", target_size=1501)
         mock_io.write_image.assert_called_once()
+
+    def test_enhance_service_with_cache(self, mocker: MockFixture, tmp_path):
+        # mock the io module, writing the output file like the real one
+        name, img = get_test_image()
+        mock_io = mocker.patch("white_brush.io")()
+        mock_io.map_file.side_effect = map_file
+        decoded = []
+        mock_io.decode_image.side_effect = lambda data, target_size: decoded.append(bytes(data)) or img
+        mock_io.write_image.side_effect = lambda file, out, params: open(file, "wb").write(b"enhanced")
+        enhance_service.io = mock_io
+        (tmp_path / "input.png").write_bytes(b"image")
+        (tmp_path / "copy.png").write_bytes(b"image")
+
+        # the input must not be mapped while the result is copied from the cache, it may be the output
+        mapped = []
+
+        @contextmanager
+        def tracked_map_file(file):
+            with map_file(file) as data:
+                mapped.append(file)
+                yield data
+                mapped.remove(file)
+        mock_io.map_file.side_effect = tracked_map_file
+        cache = ResultCache(str(tmp_path / "cache"))
+        cache_get = cache.get
+        cache.get = lambda key, output: not mapped and cache_get(key, output)
+
+        service = enhance_service.EnhanceService(cache)
+        service.enhance_file(str(tmp_path / "input.png"), str(tmp_path / "output.png"), 0, ColorConfiguration())
+        service.enhance_file(str(tmp_path / "copy.png"), str(tmp_path / "output2.png"), 0, ColorConfiguration())
+
+        # the copy has the same content, so it should be taken from the cache
+        assert mock_io.decode_image.call_count == 1
+        assert not mapped
+        assert (tmp_path / "output2.png").read_bytes() == b"enhanced"
+        # the file is decoded from the mapped content which was hashed, it is not read again
+        assert decoded == [b"image"]
+        mock_io.read_image.assert_not_called()
+
+        service.enhance_file(str(tmp_path / "copy.png"), str(tmp_path / "output3.png"), 90, ColorConfiguration())
+        assert mock_io.decode_image.call_count == 2
+
+    def test_enhance_service_with_shared_palette(self, mocker: MockFixture):
+        # mock the io module
+        name, img = get_test_image()
+        mock_io = mocker.patch("white_brush.io")()
+        mock_io.read_image.return_value = img
+        enhance_service.io = mock_io
+
+        service = enhance_service.EnhanceService()
+        fingerprint = service.fingerprint(0, ColorConfiguration())
+        palette = service.fit_palette(["input.jpg", "input2.jpg"], 0, ColorConfiguration())
+        assert mock_io.read_image.call_count == 2
+        assert service.palette is palette
+        # the palette changes the enhanced images
+        assert service.fingerprint(0, ColorConfiguration()) != fingerprint
+
+        service.enhance_file("input3.jpg", "output.jpg", 0, ColorConfiguration())
+        out = mock_io.write_image.call_args[0][1]
+        assert set(map(tuple, out.reshape(-1, 3))) <= set(map(tuple, palette.colors)) | {(255, 255, 255)}
+
+    def test_enhance_service_indexed(self, mocker: MockFixture):
+        # mock the io module
+        name, img = get_test_image()
+        mock_io = mocker.patch("white_brush.io")()
+        mock_io.read_image.return_value = img
+        enhance_service.io = mock_io
+
+        service = enhance_service.EnhanceService()
+        fingerprint = service.fingerprint(0, ColorConfiguration())
+        service.indexed = True
+        # the files of indexed images differ
+        assert service.fingerprint(0, ColorConfiguration()) != fingerprint
+
+        service.enhance_file("input.jpg", "output.png", 0, ColorConfiguration())
+        out = mock_io.write_image.call_args[0][1]
+        assert isinstance(out, IndexedImage)
+
+    def test_enhance_service_kmeans_backend(self, mocker: MockFixture):
+        # mock the io module
+        name, img = get_test_image()
+        mock_io = mocker.patch("white_brush.io")()
+        mock_io.read_image.return_value = img
+        enhance_service.io = mock_io
+        choose_representative_colors = mocker.spy(conversion, "choose_representative_colors")
+
+        service = enhance_service.EnhanceService()
+        fingerprint = service.fingerprint(0, ColorConfiguration())
+        service.kmeans_backend = "sklearn"
+        # the backends may fit slightly different palettes
+        assert service.fingerprint(0, ColorConfiguration()) != fingerprint
+
+        service.enhance_file("input.jpg", "output.png", 0, ColorConfiguration())
+        assert choose_representative_colors.call_args[1]["backend"] == "sklearn"
+
+    def test_enhance_service_with_timing_log(self, mocker: MockFixture, tmp_path):
+        # mock the io module
+        name, img = get_test_image()
+        mock_io = mocker.patch("white_brush.io")()
+        mock_io.read_image.return_value = img
+        enhance_service.io = mock_io
+
+        service = enhance_service.EnhanceService(timing_log=TimingLog(str(tmp_path / "timings.jsonl")))
+        service.enhance_file("input.jpg", "output.jpg", 0, ColorConfiguration())
+        service.enhance_file("input2.jpg", "output2.jpg", 0, ColorConfiguration())
+
+        lines = [json.loads(line) for line in (tmp_path / "timings.jsonl").read_text().splitlines()]
+        assert [line["image"] for line in lines] == ["input.jpg", "input2.jpg"]
+        stages = [stage["stage"] for stage in lines[0]["stages"]]
+        assert stages[0] == "read" and stages[-1] == "write"
+        assert "extract_foreground" in stages
+
+    def test_enhance_service_with_writer(self, mocker: MockFixture, tmp_path):
+        # mock reading the image, the writer writes the enhanced image
+        name, img = get_test_image()
+        mock_io = mocker.patch("white_brush.io")()
+        mock_io.map_file.side_effect = map_file
+        mock_io.decode_image.return_value = img
+        enhance_service.io = mock_io
+        (tmp_path / "input.png").write_bytes(b"image")
+
+        service = enhance_service.EnhanceService(ResultCache(str(tmp_path / "cache")),
+                                                 timing_log=TimingLog(str(tmp_path / "timings.jsonl")))
+        fingerprint = service.fingerprint(0, ColorConfiguration())
+        service.encoder_params = {"png_compression": 1}
+        # the encoder parameters change the files
+        assert service.fingerprint(0, ColorConfiguration()) != fingerprint
+
+        with ImageWriter() as writer:
+            service.writer = writer
+            write = service.enhance_file(str(tmp_path / "input.png"), str(tmp_path / "output.png"), 0,
+                                         ColorConfiguration())
+        assert write.done() and write.exception() is None
+        assert (tmp_path / "output.png").exists()
+        mock_io.write_image.assert_not_called()
+
+        # the output is cached and its timings are logged once it is written
+        assert service.cache.get(service.cache.key(str(tmp_path / "input.png"), service.fingerprint(
+            0, ColorConfiguration()), ".png"), str(tmp_path / "copy.png"))
+        lines = [json.loads(line) for line in (tmp_path / "timings.jsonl").read_text().splitlines()]
+        assert lines[0]["stages"][-1]["stage"] == "write"
+
+    def test_enhance_service_with_several_writing_threads(self, mocker: MockFixture, tmp_path):
+        # mock reading the image, the writer writes the enhanced images
+        name, img = get_test_image()
+        mock_io = mocker.patch("white_brush.io")()
+        mock_io.map_file.side_effect = map_file
+        mock_io.decode_image.return_value = img[:100, :100]
+        enhance_service.io = mock_io
+        service = enhance_service.EnhanceService(ResultCache(str(tmp_path / "cache")),
+                                                 timing_log=TimingLog(str(tmp_path / "timings.jsonl")))
+        # the service is still sent to worker processes
+        assert pickle.loads(pickle.dumps(service)).cache.directory == service.cache.directory
+
+        with ImageWriter(max_workers=4) as writer:
+            service.writer = writer
+            writes = []
+            for i in range(8):
+                (tmp_path / f"input{i}.png").write_bytes(f"image {i}".encode())
+                writes.append(service.enhance_file(str(tmp_path / f"input{i}.png"), str(tmp_path / f"{i}.png"), 0,
+                                                   ColorConfiguration()))
+        assert all(write.exception() is None for write in writes)
+
+        # every output is cached and logged exactly once
+        cached_files = [entry for directory in (tmp_path / "cache").iterdir() for entry in directory.iterdir()]
+        assert len(cached_files) == 8
+        assert service.cache.__size__ == sum(file.stat().st_size for file in cached_files)
+        assert len((tmp_path / "timings.jsonl").read_text().splitlines()) == 8
+
+    def test_enhance_service_with_writer_failing_to_cache(self, mocker: MockFixture, tmp_path):
+        # mock reading the image, the writer writes the enhanced image
+        name, img = get_test_image()
+        mock_io = mocker.patch("white_brush.io")()
+        mock_io.decode_image.return_value = img
+        enhance_service.io = mock_io
+        service = enhance_service.EnhanceService()
+        service.cache = mocker.Mock()
+        service.cache.get.return_value = False
+        service.cache.put.side_effect = OSError("disk full")
+
+        with ImageWriter() as writer:
+            service.writer = writer
+            write = service.enhance_file("input.png", str(tmp_path / "output.png"), 0, ColorConfiguration())
+        # the error is not swallowed, like without a writer
+        assert isinstance(write.exception(), OSError)
+
+    def test_enhance_bytes(self):
+        # the real io module, nothing is written to disk
+        enhance_service.io = io
+        name, img = get_test_image()
+        data = cv2.imencode(".png", cv2.cvtColor(img, cv2.COLOR_RGB2BGR))[1].tobytes()
+
+        service = enhance_service.EnhanceService()
+        out = service.enhance_bytes(memoryview(data), ColorConfiguration(), format=".png")
+        assert out[:8] == b"\x89PNG\r\n\x1a\n"
+        enhanced = io.decode_image(out)
+        assert (enhanced == enhance(img, ColorConfiguration())).all()
+
+        out = service.enhance_bytes(data, ColorConfiguration(), rotation=90, format=".jpg")
+        assert io.decode_image(out).shape == (img.shape[1], img.shape[0], 3)
+
+    def test_enhance_service_reduced_read(self, tmp_path):
+        """
+        Decoding large images at a reduced size should not change the
+        size of the enhanced images
+        """
+        enhance_service.io = io
+        name, img = get_test_image()
+        for width in (2400, 3000, 4000):
+            file_name = str(tmp_path / f"{width}.jpg")
+            io.write_image(file_name, cv2.resize(img, (width, width * img.shape[0] // img.shape[1])))
+            expected = enhance(io.read_image(file_name), ColorConfiguration()).shape
+
+            enhance_service.EnhanceService().enhance_file(file_name, str(tmp_path / "output.png"), 0,
+                                                          ColorConfiguration())
+            assert io.read_image(str(tmp_path / "output.png")).shape == expected
+            service = enhance_service.EnhanceService(ResultCache(str(tmp_path / "cache")))
+            service.enhance_file(file_name, str(tmp_path / "cached.png"), 0, ColorConfiguration())
+            assert io.read_image(str(tmp_path / "cached.png")).shape == expected
+
+    def test_enhance_bytes_from_several_threads(self):
+        """
+        Enhancing bytes from several threads at once should give the same images as one after the other
+        """
+        enhance_service.io = io
+        data = [cv2.imencode(".png", cv2.cvtColor(img, cv2.COLOR_RGB2BGR))[1].tobytes()
+                for _, img in itertools.islice(get_test_images(), 4)]
+        service = enhance_service.EnhanceService()
+        expected = [service.enhance_bytes(d, ColorConfiguration()) for d in data]
+
+        with ThreadPoolExecutor(4) as executor:
+            assert list(executor.map(lambda d: service.enhance_bytes(d, ColorConfiguration()), data * 2)) == \
+                expected * 2
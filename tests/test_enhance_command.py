@@ -1,9 +1,17 @@
+import os
 import pathlib
+import tempfile
 import unittest
 
+import numpy as np
+
 from white_brush.commands.enhance_command import EnhanceCommand
 from white_brush.entities.color_configuration import ColorConfiguration
 from white_brush.entities.enhancement_configuration import EnhancementConfiguration
+from white_brush.manifest import Manifest
+
+# start of a jpeg file, enough to be discovered as image in directories
+JPEG_CONTENT = b"\xff\xd8\xff\xe0Hello World"
 
 
 class TestEnhanceCommand(unittest.TestCase):
@@ -82,8 +90,8 @@ class TestEnhanceCommand(unittest.TestCase):
         # Act
         pathlib.Path("../.pytest_cache").mkdir(parents=True, exist_ok=True)
         pathlib.Path(files[1]).mkdir(parents=True, exist_ok=True)
-        f = open(files[1] + "/sample.jpg", "w+")
-        f.write("Hello World")
+        f = open(files[1] + "/sample.jpg", "wb+")
+        f.write(JPEG_CONTENT)
         f.close()
 
         class_under_test.execute(files, enhance_configuration)
@@ -116,12 +124,12 @@ class TestEnhanceCommand(unittest.TestCase):
         # Act
         pathlib.Path("../.pytest_cache").mkdir(parents=True, exist_ok=True)
         pathlib.Path(files[1]).mkdir(parents=True, exist_ok=True)
-        f = open(files[1] + "/sample.jpg", "w+")
-        f.write("Hello World")
+        f = open(files[1] + "/sample.jpg", "wb+")
+        f.write(JPEG_CONTENT)
         f.close()
         pathlib.Path(files[1] + "/subtestdirectory").mkdir(parents=True, exist_ok=True)
-        f = open(files[1] + "/subtestdirectory/subsample.jpg", "w+")
-        f.write("Hello World")
+        f = open(files[1] + "/subtestdirectory/subsample.jpg", "wb+")
+        f.write(JPEG_CONTENT)
         f.close()
 
         class_under_test.execute(files, enhance_configuration)
@@ -132,6 +140,30 @@ class TestEnhanceCommand(unittest.TestCase):
         self.assertEqual(expected_foreground, mocked_enhance_service.called_color_configuration.foreground_color)
         self.assertEqual(expected_background, mocked_enhance_service.called_color_configuration.background_color)
 
+    def test_execute_given_directory_with_non_image_files_should_skip_them(self):
+        """
+            Given
+                  a directory containing images and other files
+            When
+                  EnhanceCommand.execute() is called
+            Then
+                  Enhance service should only be called for the images.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            for name, content in (("a.jpg", JPEG_CONTENT), ("notes.txt", b"Hello World"),
+                                  ("video.mp4", b"Hello World"), ("fake.jpg", b"Hello World")):
+                with open(os.path.join(directory, name), "wb") as f:
+                    f.write(content)
+            mocked_enhance_service = MockedEnhanceService()
+            class_under_test = EnhanceCommand(mocked_enhance_service)
+
+            # Act
+            class_under_test.execute([directory], EnhancementConfiguration())
+
+            # Assert
+            self.assertEqual(1, mocked_enhance_service.called_counter)
+
     def test_execute_given_files_and_convert_should_call_service(self):
         """
              Given
@@ -238,6 +270,320 @@ class TestEnhanceCommand(unittest.TestCase):
         self.assertTrue(mocked_enhance_service.called)
         self.assertEqual(expected_rotation, mocked_enhance_service.rotation)
 
+    def test_execute_given_jobs_should_enhance_all_files_in_parallel(self):
+        """
+        Given
+            valid files and more than one job
+        When
+            EnhanceCommand.execute() is called
+        Then
+            every file should be enhanced into its own target file.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            files = [os.path.join(directory, f"testfile{i}.png") for i in range(8)]
+            for file in files:
+                with open(file, "w") as f:
+                    f.write("Hello World")
+            class_under_test = EnhanceCommand(WritingEnhanceService())
+            enhance_configuration = EnhancementConfiguration(jobs=3)
+
+            # Act
+            class_under_test.execute(files, enhance_configuration)
+
+            # Assert
+            for i in range(8):
+                with open(os.path.join(directory, f"testfile{i}_brushed.png")) as f:
+                    self.assertEqual(f"testfile{i}.png", f.read())
+
+    def test_execute_given_jobs_and_same_target_name_should_reserve_distinct_targets(self):
+        """
+        Given
+            several files mapping to the same target file name and more than one job
+        When
+            EnhanceCommand.execute() is called
+        Then
+            every file should be written to a distinct numbered target file.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            files = []
+            for i in range(4):
+                file = os.path.join(directory, f"sub{i}", "img.png")
+                pathlib.Path(file).parent.mkdir()
+                with open(file, "w") as f:
+                    f.write("Hello World")
+                files.append(file)
+            class_under_test = EnhanceCommand(WritingEnhanceService())
+            enhance_configuration = EnhancementConfiguration(jobs=4)
+            enhance_configuration.target_file_mask = "../out/{name}_brushed{extension}"
+
+            # Act
+            class_under_test.execute(files, enhance_configuration)
+
+            # Assert
+            expected = {"img_brushed.png", "img_brushed(1).png", "img_brushed(2).png", "img_brushed(3).png"}
+            self.assertEqual(expected, set(os.listdir(os.path.join(directory, "out"))))
+
+    def test_execute_given_failing_file_should_enhance_remaining_files(self):
+        """
+        Given
+            a file which fails to enhance among valid files
+        When
+            EnhanceCommand.execute() is called, with and without jobs
+        Then
+            the remaining files should be enhanced and no target file should be written for the failed one.
+        """
+        for jobs in (1, 2):
+            with tempfile.TemporaryDirectory() as directory:
+                # Arrange
+                files = [os.path.join(directory, name) for name in ("a.png", "broken.png", "c.png")]
+                for file in files:
+                    with open(file, "w") as f:
+                        f.write("Hello World")
+                class_under_test = EnhanceCommand(WritingEnhanceService())
+
+                # Act
+                class_under_test.execute(files, EnhancementConfiguration(jobs=jobs))
+
+                # Assert
+                self.assertTrue(os.path.exists(os.path.join(directory, "a_brushed.png")))
+                self.assertTrue(os.path.exists(os.path.join(directory, "c_brushed.png")))
+                self.assertFalse(os.path.exists(os.path.join(directory, "broken_brushed.png")))
+
+    def test_execute_given_file_killing_its_worker_should_enhance_remaining_files(self):
+        """
+        Given
+            a file which kills the worker process enhancing it among valid files and more than one job
+        When
+            EnhanceCommand.execute() is called
+        Then
+            all other files should be enhanced, the files in flight with the killing one included.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            files = [os.path.join(directory, f"testfile{i}.png") for i in range(8)]
+            files.insert(2, os.path.join(directory, "crash.png"))
+            for file in files:
+                with open(file, "w") as f:
+                    f.write("Hello World")
+            class_under_test = EnhanceCommand(CrashingEnhanceService())
+
+            # Act
+            class_under_test.execute(files, EnhancementConfiguration(jobs=2))
+
+            # Assert
+            for i in range(8):
+                self.assertTrue(os.path.exists(os.path.join(directory, f"testfile{i}_brushed.png")))
+            self.assertFalse(os.path.exists(os.path.join(directory, "crash_brushed.png")))
+
+    def test_execute_given_manifest_should_skip_up_to_date_files(self):
+        """
+        Given
+            files which got enhanced by a previous execution with a manifest
+        When
+            EnhanceCommand.execute() is called again with the same manifest
+        Then
+            only the changed file should be enhanced again, into its previous target file.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            for name in ("a.jpg", "b.jpg"):
+                with open(os.path.join(directory, name), "wb") as f:
+                    f.write(JPEG_CONTENT)
+            enhance_configuration = EnhancementConfiguration(
+                manifest_file=os.path.join(directory, "manifest.jsonl"))
+            EnhanceCommand(WritingEnhanceService()).execute([directory], enhance_configuration)
+            with open(os.path.join(directory, "b.jpg"), "ab") as f:
+                f.write(b"changed")
+            mocked_enhance_service = MockedEnhanceService()
+            class_under_test = EnhanceCommand(mocked_enhance_service)
+
+            # Act
+            class_under_test.execute([directory], enhance_configuration)
+
+            # Assert
+            self.assertEqual(1, mocked_enhance_service.called_counter)
+            self.assertEqual(os.path.join(directory, "b_brushed.jpg"), mocked_enhance_service.output_file_name)
+            self.assertEqual({"a.jpg", "a_brushed.jpg", "b.jpg", "b_brushed.jpg", "manifest.jsonl"},
+                             set(os.listdir(directory)))
+
+    def test_execute_given_manifest_and_replaced_files_should_enhance_changed_files(self):
+        """
+        Given
+            files in a directory which replaced themselves in a previous execution with a manifest
+        When
+            EnhanceCommand.execute() is called again on the directory after one file was replaced
+        Then
+            only the replaced file should be enhanced again.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            for name in ("a.jpg", "b.jpg"):
+                with open(os.path.join(directory, name), "wb") as f:
+                    f.write(JPEG_CONTENT)
+            enhance_configuration = EnhancementConfiguration(
+                manifest_file=os.path.join(directory, "manifest.jsonl"))
+            enhance_configuration.replace_files = True
+            EnhanceCommand(MockedEnhanceService()).execute([directory], enhance_configuration)
+            with open(os.path.join(directory, "a.jpg"), "wb") as f:
+                f.write(JPEG_CONTENT + b" new photo")
+            mocked_enhance_service = MockedEnhanceService()
+            class_under_test = EnhanceCommand(mocked_enhance_service)
+
+            # Act
+            class_under_test.execute([directory], enhance_configuration)
+
+            # Assert
+            self.assertEqual(1, mocked_enhance_service.called_counter)
+            self.assertEqual(os.path.join(directory, "a.jpg"), mocked_enhance_service.output_file_name)
+
+    def test_execute_given_manifest_and_changed_configuration_should_enhance_again(self):
+        """
+        Given
+            files which got enhanced by a previous execution with a manifest
+        When
+            EnhanceCommand.execute() is called again with a different configuration
+        Then
+            all files should be enhanced again.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            for name in ("a.jpg", "b.jpg"):
+                with open(os.path.join(directory, name), "wb") as f:
+                    f.write(JPEG_CONTENT)
+            manifest_file = os.path.join(directory, "manifest.jsonl")
+            EnhanceCommand(WritingEnhanceService()).execute(
+                [directory], EnhancementConfiguration(jobs=2, manifest_file=manifest_file))
+            mocked_enhance_service = MockedEnhanceService()
+            class_under_test = EnhanceCommand(mocked_enhance_service)
+
+            # Act
+            class_under_test.execute([directory], EnhancementConfiguration(rotation=90, manifest_file=manifest_file))
+
+            # Assert
+            self.assertEqual(2, mocked_enhance_service.called_counter)
+
+    def test_execute_given_shared_palette_should_fit_it_to_the_first_files(self):
+        """
+        Given
+            valid files and a shared palette of two files
+        When
+            EnhanceCommand.execute() is called
+        Then
+            the palette should be fitted to the first two files before all files are enhanced.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            files = [os.path.join(directory, name) for name in ("a.png", "b.png", "c.png")]
+            for file in files:
+                with open(file, "w") as f:
+                    f.write("Hello World")
+            mocked_enhance_service = MockedEnhanceService()
+            class_under_test = EnhanceCommand(mocked_enhance_service)
+
+            # Act
+            class_under_test.execute(files, EnhancementConfiguration(shared_palette=2))
+
+            # Assert
+            self.assertEqual(files[:2], mocked_enhance_service.palette_files)
+            self.assertEqual(3, mocked_enhance_service.called_counter)
+            self.assertEqual(2, mocked_enhance_service.shared_palette)
+
+    def test_execute_twice_should_not_keep_cache_and_timing_log(self):
+        """
+        Given
+            an enhance service executed with a cache and a timing log
+        When
+            EnhanceCommand.execute() is called again without them
+        Then
+            the enhance service should be executed without cache and timing log.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            file = os.path.join(directory, "a.jpg")
+            with open(file, "wb") as f:
+                f.write(JPEG_CONTENT)
+            mocked_enhance_service = MockedEnhanceService()
+            class_under_test = EnhanceCommand(mocked_enhance_service)
+            class_under_test.execute([file], EnhancementConfiguration(
+                cache_directory=os.path.join(directory, "cache"), timings_file=os.path.join(directory, "timings"),
+                replace_files=True))
+            self.assertIsNotNone(mocked_enhance_service.cache)
+            self.assertIsNotNone(mocked_enhance_service.timing_log)
+
+            # Act
+            class_under_test.execute([file], EnhancementConfiguration(replace_files=True))
+
+            # Assert
+            self.assertEqual(2, mocked_enhance_service.called_counter)
+            self.assertIsNone(mocked_enhance_service.cache)
+            self.assertIsNone(mocked_enhance_service.timing_log)
+
+    def test_execute_given_manifest_and_shared_palette_should_enhance_again_if_palette_changed(self):
+        """
+        Given
+            files which got enhanced by a previous execution with a manifest and a shared palette of two files
+        When
+            EnhanceCommand.execute() is called again, before and after one of the first two files changed
+        Then
+            no file should be enhanced before, all files should be enhanced again with the changed palette after.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            files = [os.path.join(directory, name) for name in ("a.jpg", "b.jpg", "c.jpg")]
+            for file in files:
+                with open(file, "wb") as f:
+                    f.write(JPEG_CONTENT)
+            enhance_configuration = EnhancementConfiguration(
+                shared_palette=2, manifest_file=os.path.join(directory, "manifest.jsonl"))
+            EnhanceCommand(PaletteEnhanceService()).execute(files, enhance_configuration)
+            unchanged_enhance_service = PaletteEnhanceService()
+            changed_enhance_service = PaletteEnhanceService()
+
+            # Act
+            EnhanceCommand(unchanged_enhance_service).execute(files, enhance_configuration)
+            with open(files[0], "ab") as f:
+                f.write(b"changed")
+            EnhanceCommand(changed_enhance_service).execute(files, enhance_configuration)
+
+            # Assert
+            self.assertEqual([], unchanged_enhance_service.enhanced_files)
+            self.assertEqual(files, sorted(changed_enhance_service.enhanced_files))
+
+    def test_execute_given_write_threads_should_record_files_once_written(self):
+        """
+        Given
+            valid files, one which fails to be written, a manifest and write threads
+        When
+            EnhanceCommand.execute() is called
+        Then
+            all images should be written in the background and only the written ones recorded.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            files = [os.path.join(directory, name) for name in ("a.png", "b.png", "unwritable.png")]
+            for file in files:
+                with open(file, "w") as f:
+                    f.write("Hello World")
+            enhance_service = BackgroundWritingEnhanceService()
+            class_under_test = EnhanceCommand(enhance_service)
+            manifest_file = os.path.join(directory, "manifest.jsonl")
+
+            # Act
+            class_under_test.execute(files, EnhancementConfiguration(write_threads=2, manifest_file=manifest_file))
+
+            # Assert
+            self.assertEqual(3, len(enhance_service.writes))
+            self.assertTrue(all(write.done() for write in enhance_service.writes))
+            self.assertIsNone(enhance_service.writer)
+            self.assertTrue(os.path.exists(os.path.join(directory, "a_brushed.png")))
+            self.assertTrue(os.path.exists(os.path.join(directory, "b_brushed.png")))
+            manifest = Manifest(manifest_file)
+            self.assertTrue(manifest.is_up_to_date(files[0], class_under_test.fingerprint))
+            self.assertTrue(manifest.is_up_to_date(files[1], class_under_test.fingerprint))
+            self.assertFalse(manifest.is_up_to_date(files[2], class_under_test.fingerprint))
+
     # endregion
 
 
@@ -250,15 +596,93 @@ class MockedEnhanceService:
         self.rotation = 0
         self.called_color_configuration = ColorConfiguration()
         self.same_file_name_amount = 0
+        self.palette_files = None
 
     def enhance_file(self, input_file_name, output_file_name, rotation, color_configuration):
         self.called = True
+        self.output_file_name = output_file_name
         self.rotation = rotation
         self.called_counter += 1
         self.called_color_configuration = color_configuration
         if input_file_name == output_file_name:
             self.same_file_name_amount += 1
 
+    def fit_palette(self, input_file_names, rotation, color_configuration):
+        self.palette_files = input_file_names
+
+    def fingerprint(self, rotation, color_configuration):
+        return WritingEnhanceService().fingerprint(rotation, color_configuration)
+
+
+class WritingEnhanceService:
+    """
+    Writes the name of the input file into the output file, fails for inputs named broken.
+    Defined on module level so it can be sent to worker processes.
+    """
+
+    def enhance_file(self, input_file_name, output_file_name, rotation, color_configuration):
+        if os.path.basename(input_file_name).startswith("broken"):
+            raise OSError(f'"{input_file_name}" is not a valid image file.')
+        os.makedirs(os.path.dirname(output_file_name), exist_ok=True)
+        with open(output_file_name, "w") as f:
+            f.write(os.path.basename(input_file_name))
+
+    def fingerprint(self, rotation, color_configuration):
+        return f"{rotation};{color_configuration.foreground_color};{color_configuration.background_color}"
+
+
+class PaletteEnhanceService(WritingEnhanceService):
+    """
+    Fits the shared palette to the content of the input files, the palette is part of the fingerprint.
+    """
+
+    def __init__(self):
+        self.palette = None
+        self.enhanced_files = []
+
+    def fit_palette(self, input_file_names, rotation, color_configuration):
+        contents = []
+        for input_file_name in input_file_names:
+            with open(input_file_name, "rb") as f:
+                contents.append(f.read())
+        self.palette = str(hash(tuple(contents)))
+
+    def enhance_file(self, input_file_name, output_file_name, rotation, color_configuration):
+        self.enhanced_files.append(input_file_name)
+        super().enhance_file(input_file_name, output_file_name, rotation, color_configuration)
+
+    def fingerprint(self, rotation, color_configuration):
+        return super().fingerprint(rotation, color_configuration) + ";" + str(self.palette)
+
+
+class CrashingEnhanceService(WritingEnhanceService):
+    """
+    Kills the process for inputs named crash, like a worker running out of memory.
+    """
+
+    def enhance_file(self, input_file_name, output_file_name, rotation, color_configuration):
+        if os.path.basename(input_file_name).startswith("crash"):
+            os._exit(1)
+        super().enhance_file(input_file_name, output_file_name, rotation, color_configuration)
+
+
+class BackgroundWritingEnhanceService(WritingEnhanceService):
+    """
+    Writes a small image with the writer of the service, fails to write outputs of inputs named unwritable.
+    """
+
+    def __init__(self):
+        self.writer = None
+        self.writes = []
+
+    def enhance_file(self, input_file_name, output_file_name, rotation, color_configuration):
+        if os.path.basename(input_file_name).startswith("unwritable"):
+            # a file name without a valid extension can't be written
+            output_file_name += ".unknown"
+        write = self.writer.write(output_file_name, np.zeros((4, 4, 3), np.uint8))
+        self.writes.append(write)
+        return write
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,8 +1,14 @@
+import os
+import struct
+import zlib
+
+import cv2
 import numpy as np
 import shutil
 import pytest
 
 from white_brush import io
+from white_brush.entities.indexed_image import IndexedImage
 from tests.resources import get_test_images
 
 
@@ -52,6 +58,105 @@ class TestIO:
             io.read_image(nonimage_file)
         assert "not a valid image file" in str(error)
 
+    def test_read_image_reduced(self, tmp_path):
+        """
+        Reading an image with a target size should decode it at the
+        smallest size which is still at least the target size
+        """
+        name, img = next(get_test_images())
+        file_name = str(tmp_path / "large.jpg")
+        # 2757 x 1887 pixels
+        io.write_image(file_name, cv2.resize(img, None, fx=3, fy=3))
+
+        assert io.read_image(file_name).shape == (1887, 2757, 3)
+        assert io.read_image(file_name, target_size=1000).shape == (944, 1379, 3)
+        assert io.read_image(file_name, target_size=600).shape == (472, 690, 3)
+        assert io.read_image(file_name, target_size=300).shape == (236, 345, 3)
+        assert io.read_image(file_name, target_size=2000).shape == (1887, 2757, 3)
+
+        reduced = io.read_image(file_name, target_size=1000).astype(np.int16)
+        resized = cv2.resize(io.read_image(file_name), reduced.shape[1::-1],
+                             interpolation=cv2.INTER_AREA)
+        assert np.abs(reduced - resized).mean() < 3
+
+    def test_read_png_with_thin_strokes_is_not_reduced(self, tmp_path):
+        """
+        PNG images should always be decoded at full size, reducing them
+        while decoding loses thin strokes
+        """
+        # 1 pixel wide strokes, every 7th column
+        img = np.full((1500, 4000, 3), 255, np.uint8)
+        img[:, ::7] = 0
+        for extension in (".png", ".bmp"):
+            file_name = str(tmp_path / f"strokes{extension}")
+            io.write_image(file_name, img)
+            assert (io.read_image(file_name, target_size=1000) == img).all()
+            with open(file_name, "rb") as f:
+                assert (io.decode_image(f.read(), target_size=1000) == img).all()
+
+    def test_image_size(self):
+        """
+        The size of an image should be read from its header
+        """
+        directory = "test_images" if os.path.exists("test_images") else "../test_images"
+        for img_name in os.listdir(directory):
+            size = io._image_size(os.path.join(directory, img_name))
+            img = io.read_image(os.path.join(directory, img_name))
+            # the orientation of jpeg images is only applied when decoding
+            assert sorted(size) == sorted(img.shape[:2])
+        assert io._image_size(__file__) is None
+
+    def test_decode_image(self, tmp_path):
+        """
+        Images in memory and memory-mapped files should be decoded like
+        the files, invalid data should be reported
+        """
+        directory = "test_images" if os.path.exists("test_images") else "../test_images"
+        for img_name in os.listdir(directory)[:3]:
+            file_name = os.path.join(directory, img_name)
+            with open(file_name, "rb") as f:
+                data = f.read()
+            img = io.read_image(file_name)
+            assert (io.decode_image(data) == img).all()
+            assert (io.decode_image(memoryview(data)) == img).all()
+            with io.map_file(file_name) as mapped:
+                assert (io.decode_image(mapped) == img).all()
+                assert io.decode_image(mapped, target_size=300).shape == \
+                    io.read_image(file_name, target_size=300).shape
+
+        (tmp_path / "empty.png").write_bytes(b"")
+        with io.map_file(str(tmp_path / "empty.png")) as mapped:
+            assert mapped == b""
+            with pytest.raises(ValueError):
+                io.decode_image(mapped)
+        with pytest.raises(ValueError):
+            io.decode_image(b"no image")
+
+        # a header of an image too large to decode, the map can still be
+        # closed after the decoder failed
+        header = struct.pack(">IIBBBBB", 100000, 100000, 8, 2, 0, 0, 0)
+        (tmp_path / "corrupt.png").write_bytes(
+            io._PNG_SIGNATURE + io._png_chunk(b"IHDR", header) +
+            io._png_chunk(b"IDAT", zlib.compress(b"\0" * 100)) + io._png_chunk(b"IEND", b""))
+        with pytest.raises(ValueError):
+            with io.map_file(str(tmp_path / "corrupt.png")) as mapped:
+                io.decode_image(mapped)
+
+    def test_encode_image(self):
+        """
+        Encoded images should be decoded to the same image
+        """
+        img = np.random.RandomState(0).randint(0, 255, (30, 40, 3)).astype(np.uint8)
+        data = io.encode_image(img, ".png", {"png_compression": 1})
+        assert isinstance(data, bytes)
+        assert (io.decode_image(data) == img).all()
+
+        indexed = IndexedImage(np.arange(30 * 40).reshape(30, 40) % 3, [[0, 0, 0], [255, 0, 0], [0, 0, 255]])
+        assert (io.decode_image(io.encode_image(indexed, ".png")) == indexed.to_rgb()).all()
+        assert (io.decode_image(io.encode_image(indexed, ".bmp")) == indexed.to_rgb()).all()
+
+        with pytest.raises(ValueError):
+            io.encode_image(img, ".unknown")
 
     def test_writing_random_image(self):
         """
@@ -63,3 +168,73 @@ class TestIO:
 
         io.write_image(file_name, random_img)
         shutil.rmtree(img_out_dir)
+
+    def test_writing_indexed_image(self, tmp_path):
+        """
+        Indexed images should be written as palette PNG with the
+        smallest bit depth, which is read back as the same RGB image
+        """
+        random = np.random.RandomState(0)
+        for n_colors, bit_depth in ((2, 1), (3, 2), (4, 2), (9, 4), (16, 4), (17, 8), (256, 8)):
+            # odd widths, so the rows are padded to whole bytes
+            labels = random.randint(0, n_colors, (23, 37)).astype(np.uint8)
+            palette = random.randint(0, 256, (n_colors, 3))
+            img = IndexedImage(labels, palette)
+            file_name = str(tmp_path / "indexed.png")
+
+            io.write_image(file_name, img)
+            with open(file_name, "rb") as f:
+                header = f.read(26)
+            assert header[24:26] == bytes([bit_depth, 3])
+            assert (io.read_image(file_name) == img.to_rgb()).all()
+
+        # other formats are written as RGB image
+        io.write_image(str(tmp_path / "indexed.bmp"), img)
+        assert (io.read_image(str(tmp_path / "indexed.bmp")) == img.to_rgb()).all()
+
+    def test_writing_with_encoder_params(self, tmp_path):
+        """
+        The encoder parameters should be passed to the encoder of the
+        format of the file, unknown parameters should be reported
+        """
+        img = np.random.RandomState(0).randint(0, 255, (100, 100, 3)).astype(np.uint8)
+        sizes = {}
+        for quality in (10, 95):
+            file_name = str(tmp_path / f"quality_{quality}.jpg")
+            # the PNG parameters are ignored for JPEG files
+            io.write_image(file_name, img, {"jpeg_quality": quality, "png_compression": 9})
+            sizes[quality] = os.path.getsize(file_name)
+        assert sizes[10] < sizes[95]
+
+        file_name = str(tmp_path / "strategy.png")
+        io.write_image(file_name, img, {"png_compression": 1, "png_strategy": io.PNG_STRATEGIES["rle"]})
+        assert (io.read_image(file_name) == img).all()
+
+        indexed = IndexedImage(np.arange(100 * 100).reshape(100, 100) % 3, [[0, 0, 0], [255, 0, 0], [0, 0, 255]])
+        io.write_image(file_name, indexed, {"png_compression": 0, "png_strategy": io.PNG_STRATEGIES["fixed"]})
+        assert (io.read_image(file_name) == indexed.to_rgb()).all()
+
+        with pytest.raises(ValueError):
+            io.write_image(str(tmp_path / "invalid.png"), img, {"png_quality": 1})
+        with pytest.raises(ValueError):
+            io.write_image(str(tmp_path / "invalid.png"), indexed, {"png_quality": 1})
+
+    def test_image_writer(self, tmp_path):
+        """
+        The image writer should write the images in the background and
+        report the result of each write to its callback
+        """
+        images = [np.full((10, 10, 3), i, np.uint8) for i in range(5)]
+        written = []
+        with io.ImageWriter(max_workers=2, max_pending=2) as writer:
+            futures = [writer.write(str(tmp_path / f"{i}.png"), img, callback=written.append)
+                       for i, img in enumerate(images)]
+            failed = writer.write(str(tmp_path / "invalid.unknown"), images[0], callback=written.append)
+
+        assert all(future.done() for future in futures + [failed])
+        assert len(written) == 6
+        for i, img in enumerate(images):
+            assert futures[i].exception() is None
+            assert (io.read_image(str(tmp_path / f"{i}.png")) == img).all()
+        assert failed.exception() is not None
+
@@ -0,0 +1,105 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from white_brush.manifest import DEFAULT_MANIFEST_FILE, Manifest, default_manifest_file
+
+
+class TestManifest:
+    def test_recorded_file_is_up_to_date(self, tmp_path):
+        """
+        A recorded file should be up to date until the file, its output
+        or the fingerprint changes
+        """
+        source_file = tmp_path / "img.png"
+        target_file = tmp_path / "img_brushed.png"
+        source_file.write_bytes(b"input")
+        target_file.write_bytes(b"output")
+
+        manifest = Manifest(str(tmp_path / "manifest.jsonl"))
+        assert not manifest.is_up_to_date(str(source_file), "a")
+
+        manifest.record(str(source_file), str(target_file), "a")
+        assert manifest.is_up_to_date(str(source_file), "a")
+        assert not manifest.is_up_to_date(str(source_file), "b")
+        assert manifest.is_output(str(target_file))
+        assert manifest.previous_target(str(source_file)) == str(target_file)
+
+        source_file.write_bytes(b"changed input")
+        assert not manifest.is_up_to_date(str(source_file), "a")
+
+        manifest.record(str(source_file), str(target_file), "a")
+        os.remove(str(target_file))
+        assert not manifest.is_up_to_date(str(source_file), "a")
+        assert manifest.previous_target(str(source_file)) is None
+        manifest.close()
+
+    def test_manifest_is_loaded_from_journal(self, tmp_path):
+        """
+        A new manifest should continue with the entries recorded by a
+        previous one, even if the journal of that one got interrupted
+        """
+        manifest_file = str(tmp_path / "manifest.jsonl")
+        files = []
+        for i in range(3):
+            source_file = tmp_path / f"img{i}.png"
+            target_file = tmp_path / f"img{i}_brushed.png"
+            source_file.write_bytes(b"input")
+            target_file.write_bytes(b"output")
+            files.append((str(source_file), str(target_file)))
+
+        manifest = Manifest(manifest_file)
+        manifest.record(*files[0], "a")
+        manifest.record(*files[1], "a")
+        manifest.close()
+        # simulate an interruption while writing the last line
+        with open(manifest_file, "r+") as f:
+            content = f.read()
+            f.seek(0)
+            f.truncate()
+            f.write(content[:-20])
+
+        manifest = Manifest(manifest_file)
+        assert manifest.is_up_to_date(files[0][0], "a")
+        assert not manifest.is_up_to_date(files[1][0], "a")
+        manifest.record(*files[2], "a")
+        manifest.close()
+
+        manifest = Manifest(manifest_file)
+        assert manifest.is_up_to_date(files[0][0], "a")
+        assert manifest.is_up_to_date(files[2][0], "a")
+
+    def test_files_are_recorded_from_several_threads(self, tmp_path):
+        """
+        Files recorded from several threads at once should all be
+        journaled on lines of their own
+        """
+        manifest_file = str(tmp_path / "manifest.jsonl")
+        source_files = []
+        for i in range(50):
+            source_file = tmp_path / f"{i}.png"
+            source_file.write_bytes(b"input")
+            (tmp_path / f"{i}_brushed.png").write_bytes(b"output")
+            source_files.append(str(source_file))
+
+        manifest = Manifest(manifest_file)
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda file: manifest.record(file, file.replace(".png", "_brushed.png"), "a"),
+                              source_files))
+        manifest.close()
+
+        manifest = Manifest(manifest_file)
+        assert all(manifest.is_up_to_date(file, "a") for file in source_files)
+
+    def test_default_manifest_file_is_next_to_the_inputs(self, tmp_path):
+        """
+        The default manifest should lie in the directory which contains
+        all input files and directories
+        """
+        (tmp_path / "a" / "nested").mkdir(parents=True)
+        (tmp_path / "b").mkdir()
+
+        assert default_manifest_file([str(tmp_path / "a")]) == str(tmp_path / "a" / DEFAULT_MANIFEST_FILE)
+        assert default_manifest_file([str(tmp_path / "a" / "img.png")]) == str(tmp_path / "a" / DEFAULT_MANIFEST_FILE)
+        assert default_manifest_file([str(tmp_path / "a" / "nested"), str(tmp_path / "a" / "img.png")]) == \
+            str(tmp_path / "a" / DEFAULT_MANIFEST_FILE)
+        assert default_manifest_file([str(tmp_path / "a"), str(tmp_path / "b")]) == str(tmp_path / DEFAULT_MANIFEST_FILE)
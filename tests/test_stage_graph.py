@@ -0,0 +1,43 @@
+import time
+
+from white_brush.stage_graph import StageGraph
+
+
+class TestStageGraph:
+    def test_intermediates_are_computed_lazily_and_once(self):
+        calls = []
+
+        def stage(name, func):
+            def compute(graph):
+                calls.append(name)
+                return func(graph)
+            return compute
+
+        graph = StageGraph({
+            "double": stage("double", lambda g: g["input"] * 2),
+            "quadruple": stage("quadruple", lambda g: g["double"] * 2),
+            "sum": stage("sum", lambda g: g["double"] + g["quadruple"]),
+            "unused": stage("unused", lambda g: g["input"] - 1)
+        }, {"input": 3})
+
+        assert graph["sum"] == 18
+        assert graph["quadruple"] == 12
+        assert sorted(calls) == ["double", "quadruple", "sum"]
+        assert "double" in graph and "unused" not in graph
+
+    def test_timings_exclude_nested_intermediates(self):
+        timings = []
+
+        def slow(graph):
+            time.sleep(0.05)
+            return 1
+
+        graph = StageGraph({
+            "slow": slow,
+            "fast": lambda g: g["slow"] + 1
+        }, stage_hook=timings.append, prefix="test.")
+
+        assert graph["fast"] == 2
+        assert [timing.stage for timing in timings] == ["test.slow", "test.fast"]
+        assert timings[0].wall_time >= 0.05
+        assert timings[1].wall_time < 0.05
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# maximum time importing white_brush may take when the CLI starts, in seconds. The import takes less than 0.2s
+# without the lazy dependencies, importing them takes longer than this. It can be relaxed with the environment
+# variable for slow CI runners
+IMPORT_TIME_BUDGET = float(os.environ.get("WHITE_BRUSH_IMPORT_TIME_BUDGET", 0.5))
+# dependencies which are only needed by some stages of the enhancement
+LAZY_MODULES = ("sklearn", "scipy", "webcolors")
+
+# python -X importtime is only available since Python 3.7
+requires_importtime = pytest.mark.skipif(sys.version_info < (3, 7), reason="python -X importtime needs Python 3.7")
+
+
+def import_times(*args):
+    """
+    Runs the whitebrush CLI with the given arguments and returns the cumulative import time of every imported
+    module in seconds, see python -X importtime. The names of nested imports are indented.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.run([sys.executable, "-X", "importtime", "-m", "white_brush", *args],
+                             cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name[1:]] = int(cumulative) / 1e6
+    return times
+
+
+def imported_modules(statement):
+    """
+    Executes the statement in a new interpreter and returns the names of all modules imported afterwards
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.run([sys.executable, "-c", statement + "\nimport sys\nprint('\\n'.join(sys.modules))"],
+                             cwd=root, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return process.stdout.splitlines()
+
+
+class TestImports:
+    def test_import_does_not_import_lazy_dependencies(self):
+        """
+        Importing white_brush and its CLI should not import the dependencies only needed by some stages
+        """
+        modules = imported_modules("import white_brush\nimport white_brush.__main__")
+        assert "white_brush.__main__" in modules
+        assert not any(name.split(".")[0] in LAZY_MODULES for name in modules)
+
+
+@requires_importtime
+class TestStartup:
+    def test_help_does_not_import_lazy_dependencies(self):
+        """
+        Printing the help should not import the dependencies only needed by some stages
+        """
+        times = import_times("--help")
+        assert not any(name.strip().split(".")[0] in LAZY_MODULES for name in times)
+
+    def test_help_imports_within_time_budget(self):
+        """
+        Importing white_brush for printing the help should not take longer than the import time budget
+        """
+        times = import_times("--help")
+        # only top level imports, the time of the nested ones is part of them
+        white_brush_time = sum(time for name, time in times.items() if name.startswith("white_brush"))
+        assert white_brush_time < IMPORT_TIME_BUDGET
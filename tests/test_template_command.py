@@ -67,6 +67,31 @@ class TestTemplateCommand(unittest.TestCase):
         self.assertEqual(expected_background,
                          enhance_configuration.background_color)
 
+    def test_execute_given_markers_template_should_set_palette(self):
+        """
+        Given
+            the markers template
+        When
+            TemplateCommand.execute() is called
+        Then
+            the configuration should have no foreground color, but a palette of marker colors.
+        """
+        # Arrange
+        class_under_test = TemplateCommand()
+        enhance_configuration = EnhancementConfiguration(foreground_color="#000000")
+
+        # Act
+        class_under_test.execute("markers", enhance_configuration)
+
+        # Assert
+        self.assertIsNone(enhance_configuration.foreground_color)
+        self.assertEqual("#FFFFFF", enhance_configuration.background_color)
+        self.assertEqual(4, len(enhance_configuration.foreground_palette))
+
+        # other templates do not use a palette
+        class_under_test.execute("whiteboard", enhance_configuration)
+        self.assertIsNone(enhance_configuration.foreground_palette)
+
     # endregion
 
 
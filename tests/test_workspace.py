@@ -0,0 +1,36 @@
+import pickle
+
+import numpy as np
+
+from white_brush.workspace import Workspace
+
+
+class TestWorkspace:
+    def test_buffers_are_reused(self):
+        workspace = Workspace()
+        buffer = workspace.buffer("gray", (10, 20))
+        assert buffer.shape == (10, 20) and buffer.dtype == np.uint8
+        assert workspace.buffer("gray", (10, 20)) is buffer
+        assert workspace.buffer("gray", (10, 20), np.bool) is not buffer
+        assert workspace.buffer("mask", (10, 20)) is not buffer
+        assert workspace.nbytes == workspace.peak_nbytes == 3 * 200
+
+    def test_only_recent_shapes_are_kept(self):
+        workspace = Workspace(max_shapes=2)
+        first = workspace.buffer("rgb", (10, 20, 3))
+        workspace.buffer("rgb", (30, 40, 3))
+        workspace.buffer("rgb", (50, 60, 3))
+        assert workspace.buffer("rgb", (10, 20, 3)) is not first
+        assert workspace.nbytes == (50 * 60 + 10 * 20) * 3
+        assert workspace.peak_nbytes == (30 * 40 + 50 * 60) * 3
+
+        workspace.clear()
+        assert workspace.nbytes == 0
+
+    def test_pickled_workspace_has_no_buffers(self):
+        workspace = Workspace()
+        workspace.buffer("gray", (1000, 1000))
+        copy = pickle.loads(pickle.dumps(workspace))
+        assert copy.nbytes == 0
+        assert copy.peak_nbytes == workspace.peak_nbytes
+        assert len(pickle.dumps(workspace)) < 1000
@@ -0,0 +1,3 @@
+# version of the enhancement pipeline, increase it whenever a change
+# alters the enhanced images, so previously stored results are recomputed
+PIPELINE_VERSION = 5
@@ -0,0 +1,268 @@
+"""
+Benchmark of the enhancement and of the color functions it is built from.
+
+Runs every benchmark case over the images of a directory and over upscaled
+copies of them, reports the throughput, latency percentiles and peak memory
+usage, and compares the results with a baseline of an earlier run:
+
+    python -m white_brush.benchmark --output results.json
+    python -m white_brush.benchmark --baseline results.json
+
+The exit code is 1 if a case got slower than the baseline by more than the
+tolerance.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+from functools import partial
+
+import cv2
+import numpy as np
+
+from white_brush import discovery, io
+from white_brush.colors.calc_colors import choose_representative_colors
+from white_brush.colors.color_balance import balance_color
+from white_brush.colors.color_extraction import adaptive_threshold, background_difference_image, otsu_threshold
+from white_brush.colors.morphology import dilate, erode
+from white_brush.colors.utils import _generate_bitmask
+from white_brush.enhance import enhance
+from white_brush.entities.color_configuration import ColorConfiguration
+
+DEFAULT_IMAGE_DIRECTORY = "test_images"
+# relative slowdown of the median latency which is still accepted
+DEFAULT_TOLERANCE = 0.2
+
+
+def _foreground_mask(img):
+    return adaptive_threshold(img, 31, 10)
+
+
+def _foreground_colors(img):
+    return img[_foreground_mask(img)] & _generate_bitmask(2, 8)
+
+
+# name -> (function preparing the arguments from an image, benchmarked function)
+CASES = {
+    "enhance": (lambda img: (img, ColorConfiguration()), enhance),
+    "balance_color": (lambda img: (img,), balance_color),
+    "adaptive_threshold": (lambda img: (img, 31, 10), adaptive_threshold),
+    "background_difference_image": (lambda img: (img,), background_difference_image),
+    "otsu_threshold": (lambda img: (background_difference_image(img),), otsu_threshold),
+    "choose_representative_colors": (lambda img: (_foreground_colors(img),), choose_representative_colors),
+    "erode": (lambda img: (_foreground_mask(img), 3), erode),
+    "dilate": (lambda img: (_foreground_mask(img), 3), dilate),
+}
+# the built-in k-means is compared with scikit-learn, if it is installed
+if importlib.util.find_spec("sklearn") is not None:
+    CASES["choose_representative_colors[sklearn]"] = (
+        CASES["choose_representative_colors"][0], partial(choose_representative_colors, backend="sklearn"))
+
+
+def load_images(directory: str, scales=(1,)):
+    """
+    Loads the images of the given directory, once for every scale.
+
+    Args:
+        directory: directory containing the images
+        scales: factors the images are upscaled with, 1 keeps the original images
+
+    Returns:
+        List of (name, scale, image) tuples
+    """
+    images = []
+    for file in sorted(discovery.iter_image_files(directory)):
+        img = io.read_image(file)
+        for scale in scales:
+            scaled = img if scale == 1 else cv2.resize(img, None, fx=scale, fy=scale,
+                                                       interpolation=cv2.INTER_CUBIC)
+            images.append((os.path.basename(file), scale, scaled))
+    return images
+
+
+def run_benchmark(images, cases=None, repeat: int = 3) -> dict:
+    """
+    Runs the benchmark cases over the given images.
+
+    Every case is measured separately for each scale of the images. The enhance case additionally reports
+    the mean time of each stage of the enhancement.
+
+    Args:
+        images: list of (name, scale, image) tuples, see load_images
+        cases: names of the cases to run, by default all of CASES
+        repeat: how often each case is run on each image
+
+    Returns:
+        The results as JSON serializable dictionary
+    """
+    results = {}
+    for case in cases or CASES:
+        prepare, func = CASES[case]
+        for scale in sorted({scale for _, scale, _ in images}):
+            scaled_images = [img for _, image_scale, img in images if image_scale == scale]
+            results[f"{case}@{scale:g}x"] = _run_case(case, prepare, func, scaled_images, repeat)
+
+    return {
+        "environment": _environment(),
+        "repeat": repeat,
+        "cases": results,
+        "peak_rss": peak_rss()
+    }
+
+
+def _run_case(case, prepare, func, images, repeat):
+    arguments = [prepare(img) for img in images]
+    stage_times = {}
+
+    def collect_stage(timing):
+        stage_times.setdefault(timing.stage, []).append(timing.wall_time)
+
+    kwargs = {"stage_hook": collect_stage} if case == "enhance" else {}
+    # warm up caches and lazily initialized state, not measured
+    func(*arguments[0])
+
+    latencies = []
+    for _ in range(repeat):
+        for args in arguments:
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            latencies.append(time.perf_counter() - start)
+
+    total_time = sum(latencies)
+    megapixels = repeat * sum(img.shape[0] * img.shape[1] for img in images) / 1e6
+    result = {
+        "calls": len(latencies),
+        "throughput": len(latencies) / total_time,
+        "megapixels_per_second": megapixels / total_time,
+        "latency": {
+            "p50": float(np.percentile(latencies, 50)),
+            "p90": float(np.percentile(latencies, 90)),
+            "p99": float(np.percentile(latencies, 99))
+        }
+    }
+    if stage_times:
+        result["stages"] = {stage: float(np.mean(times)) for stage, times in stage_times.items()}
+    return result
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process in bytes, or None if it cannot be determined.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def compare(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE):
+    """
+    Compares benchmark results with the results of a baseline run.
+
+    Args:
+        results: results of run_benchmark
+        baseline: results of an earlier run_benchmark
+        tolerance: relative slowdown of the median latency and relative increase of the peak memory usage
+            which is still accepted
+
+    Returns:
+        List of messages describing the regressions, empty if there are none
+    """
+    regressions = []
+    for case, result in results["cases"].items():
+        baseline_result = baseline["cases"].get(case)
+        if baseline_result is None:
+            continue
+        latency, baseline_latency = result["latency"]["p50"], baseline_result["latency"]["p50"]
+        if latency > baseline_latency * (1 + tolerance):
+            regressions.append(f"{case}: median latency {latency * 1000:.1f} ms, "
+                               f"baseline {baseline_latency * 1000:.1f} ms")
+
+    rss, baseline_rss = results.get("peak_rss"), baseline.get("peak_rss")
+    if rss is not None and baseline_rss is not None and rss > baseline_rss * (1 + tolerance):
+        regressions.append(f"peak RSS {rss / 1024 ** 2:.0f} MB, baseline {baseline_rss / 1024 ** 2:.0f} MB")
+    return regressions
+
+
+def format_results(results: dict) -> str:
+    """
+    Formats benchmark results as a table.
+    """
+    lines = [f"{'case':<44}{'calls/s':>10}{'MP/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"]
+    for case, result in results["cases"].items():
+        latency = result["latency"]
+        lines.append(f"{case:<44}{result['throughput']:>10.2f}{result['megapixels_per_second']:>10.2f}"
+                     f"{latency['p50'] * 1000:>10.1f}{latency['p90'] * 1000:>10.1f}{latency['p99'] * 1000:>10.1f}")
+        for stage, stage_time in result.get("stages", {}).items():
+            lines.append(f"  {stage:<42}{'':>20}{stage_time * 1000:>10.1f}")
+    if results.get("peak_rss") is not None:
+        lines.append(f"peak RSS: {results['peak_rss'] / 1024 ** 2:.0f} MB")
+    return "\n".join(lines)
+
+
+def _environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def main(argv=None) -> int:
+    """
+    Runs the benchmark with the given command line arguments.
+
+    Returns:
+        The exit code, 1 if there are regressions compared to the baseline, otherwise 0
+    """
+    parser = argparse.ArgumentParser(prog="python -m white_brush.benchmark",
+                                     description="Benchmarks the enhancement of the images in a directory.")
+    parser.add_argument("--images", default=DEFAULT_IMAGE_DIRECTORY,
+                        help="Directory of the benchmarked images. Default: " + DEFAULT_IMAGE_DIRECTORY)
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 2],
+                        help="Factors the images are upscaled with. Default: 1 2")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES),
+                        help="Runs only the given cases.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="How often each case is run on each image. Default: 3")
+    parser.add_argument("--output",
+                        help="Writes the results as JSON to the given file.")
+    parser.add_argument("--baseline",
+                        help="Compares the results with the JSON results of an earlier run.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Relative slowdown compared to the baseline which is still accepted. Default: "
+                             + str(DEFAULT_TOLERANCE))
+    args = parser.parse_args(argv)
+
+    images = load_images(args.images, args.scales)
+    if len(images) == 0:
+        print("No images found in '" + args.images + "'.")
+        return 1
+
+    results = run_benchmark(images, args.cases, args.repeat)
+    print(format_results(results))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("Regression: " + regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
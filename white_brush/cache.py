@@ -0,0 +1,149 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+# default size limit of a result cache in bytes
+DEFAULT_CACHE_SIZE = 1024 ** 3
+
+
+class ResultCache:
+    def __init__(self, directory: str, max_size: int = DEFAULT_CACHE_SIZE):
+        """
+        Creates a new content addressed cache of enhanced images in the given directory.
+
+        The least recently used results are evicted as soon as the results in the cache are larger than
+        max_size bytes. Several processes may share the same cache directory.
+
+        Args:
+            directory: directory the results are stored in, it is created if it does not exist yet
+            max_size: maximum size of all results in the cache in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.__size__ = None
+
+    def key(self, input: str, fingerprint: str, extension: str) -> str:
+        """
+        Calculates the key of the result of enhancing the given input file.
+
+        Args:
+            input: path to the input file, its content is hashed
+            fingerprint: fingerprint of the configuration, see EnhanceService.fingerprint
+            extension: file extension of the result, e.g. '.png'
+
+        Returns:
+            The key of the result
+        """
+        digest = hashlib.sha256()
+        with open(input, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 ** 2), b""):
+                digest.update(chunk)
+        return self.__key__(digest, fingerprint, extension)
+
+    def data_key(self, data, fingerprint: str, extension: str) -> str:
+        """
+        Calculates the key of the result of enhancing the given content of an input file, the same key as
+        key() calculates for a file with this content.
+
+        Args:
+            data: content of the input file, any bytes-like object, e.g. a memory-mapped file
+            fingerprint: fingerprint of the configuration, see EnhanceService.fingerprint
+            extension: file extension of the result, e.g. '.png'
+
+        Returns:
+            The key of the result
+        """
+        return self.__key__(hashlib.sha256(data), fingerprint, extension)
+
+    @staticmethod
+    def __key__(digest, fingerprint: str, extension: str) -> str:
+        digest.update(fingerprint.encode())
+        return digest.hexdigest() + extension.lower()
+
+    def get(self, key: str, output: str) -> bool:
+        """
+        Copies the result with the given key to the output file, if it is in the cache.
+
+        Args:
+            key: key of the result, see key()
+            output: path to the output file
+
+        Returns:
+            True if the result was in the cache, otherwise False
+        """
+        cached_file = self.__path__(key)
+        try:
+            dirs = os.path.dirname(output)
+            if len(dirs) > 0:
+                os.makedirs(dirs, exist_ok=True)
+            shutil.copyfile(cached_file, output)
+            # the modification time marks when the result was used last
+            os.utime(cached_file)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key: str, file: str):
+        """
+        Stores the given result file in the cache and evicts the least recently used results if the cache
+        gets too large.
+
+        Args:
+            key: key of the result, see key()
+            file: path to the enhanced image
+        """
+        cached_file = self.__path__(key)
+        os.makedirs(os.path.dirname(cached_file), exist_ok=True)
+        # copy to a temporary file first, so other processes never see
+        # an incomplete result
+        fd, temporary_file = tempfile.mkstemp(prefix=".", dir=os.path.dirname(cached_file))
+        os.close(fd)
+        shutil.copyfile(file, temporary_file)
+        # the result may replace one with the same key, e.g. of another process
+        try:
+            replaced_size = os.path.getsize(cached_file)
+        except FileNotFoundError:
+            replaced_size = 0
+        os.replace(temporary_file, cached_file)
+
+        if self.__size__ is None:
+            self.__size__ = sum(size for _, _, size in self.__entries__())
+        else:
+            self.__size__ += os.path.getsize(cached_file) - replaced_size
+        if self.__size__ > self.max_size:
+            self.__evict__()
+
+    def __evict__(self):
+        entries = sorted(self.__entries__())
+        self.__size__ = sum(size for _, _, size in entries)
+        for _, cached_file, size in entries:
+            if self.__size__ <= self.max_size:
+                break
+            try:
+                os.remove(cached_file)
+            except FileNotFoundError:
+                # already evicted by another process
+                pass
+            self.__size__ -= size
+
+    def __entries__(self):
+        """
+        Returns (last used, path, size) tuples of all results in the cache.
+        """
+        for sub_directory in os.scandir(self.directory):
+            if not sub_directory.is_dir():
+                continue
+            for entry in os.scandir(sub_directory.path):
+                if entry.name.startswith("."):
+                    # result which is currently being stored
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, entry.path, stat.st_size
+
+    def __path__(self, key):
+        # spread the results over sub directories to keep them small
+        return os.path.join(self.directory, key[:2], key)
@@ -1,19 +1,108 @@
-from sklearn import cluster
 import numpy as np
 
 from white_brush.colors.color_balance import balance_color
+from white_brush.colors.kmeans import kmeans, nearest_centers
+from white_brush.colors.utils import _pack_rgb_values, _unpack_rgb_values, \
+    _pack_rgb_6bit
 
+# implementations of k-means which can be used to cluster the colors
+KMEANS_BACKENDS = ("numpy", "sklearn")
 
-def choose_representative_colors(colors: np.ndarray, n=8):
+
+class Palette:
+    def __init__(self, centers: np.ndarray, colors: np.ndarray):
+        """
+        Creates a new Palette of representative colors.
+
+        Args:
+            centers: The representative colors of shape (N, 3), in the
+                same color space as the colors which will be assigned
+                to them
+            colors: The colors of shape (N, 3) which are output for
+                each representative color, e.g. a color balanced
+                version of the centers
+        """
+        self.centers = np.asarray(centers, np.float64)
+        self.colors = np.asarray(colors, np.uint8)
+        self.__table__ = None
+
+    @staticmethod
+    def fit(colors: np.ndarray, n=8, backend: str = "numpy") -> "Palette":
+        """
+        Calculate a Palette of `n` representative colors for the given
+        colors, see `choose_representative_colors`.
+        """
+        centers, _ = _fit_representative_colors(colors, n, backend=backend)
+        return Palette(centers,
+                       balance_color(centers, separate_channels=False))
+
+    def assign(self, colors: np.ndarray) -> np.ndarray:
+        """
+        Assign each of the given colors to its nearest representative
+        color.
+
+        The nearest representative color of every color reduced to 6 bit
+        per channel is calculated once per palette, so assigning colors
+        is a single table lookup. Colors whose lowest two bits are not
+        zero are assigned like the reduced color.
+
+        Args:
+            colors: A list of rgb color values of shape (N, 3)
+
+        Returns:
+            A list with size `len(colors)` which specifies the index of
+            the representative color of each color.
+        """
+        if self.__table__ is None:
+            self.__table__ = self.__calculate_table__()
+        return self.__table__[_pack_rgb_6bit(colors)]
+
+    def __calculate_table__(self) -> np.ndarray:
+        # the values of a channel with the lowest two bits zero
+        values = np.arange(0, 256, 4, dtype=np.float64)
+        # the squared distance of a color to a center is the sum of the
+        # squared distances of its channels, which only have 64 values.
+        # The first of equally near centers is chosen, as with argmin
+        table = np.zeros((64, 64, 64), np.intp)
+        min_distances = np.full((64, 64, 64), np.inf)
+        for i, (r, g, b) in enumerate(self.centers):
+            distances = (values - r) ** 2
+            distances = distances[:, None] + ((values - g) ** 2)[None, :]
+            distances = distances[:, :, None] + ((values - b) ** 2)
+            nearer = distances < min_distances
+            table[nearer] = i
+            min_distances[nearer] = distances[nearer]
+        return table.ravel()
+
+    def __getstate__(self):
+        # the table is large, but cheap to calculate again
+        state = self.__dict__.copy()
+        state["__table__"] = None
+        return state
+
+
+def choose_representative_colors(colors: np.ndarray, n=8,
+                                 max_samples: int = 10000,
+                                 backend: str = "numpy"):
     """
     Calculates representative colors of a given array of colors.
     Furthermore it is improving the colors by rescaling the minimum
     and maximum intensity values to 0 and 255.
 
+    Instead of clustering every single color, the distinct colors are
+    clustered, weighted by how often they occur. Since the colors are
+    usually quantized, there are far less distinct colors than colors.
+
     Args:
         colors: A list of rgb color values.
         n: Specifies how many representative colors will be chosen
             from the color set
+        max_samples: Maximum number of distinct colors used to fit the
+            representative colors. If there are more distinct colors,
+            a random subsample of them is used.
+        backend: The k-means implementation which clusters the colors,
+            one of KMEANS_BACKENDS. 'numpy' is built in, 'sklearn'
+            needs scikit-learn to be installed.
 
     Returns:
         A 2-tuple. The first element is a list with `n` elements which
@@ -22,10 +111,60 @@ def choose_representative_colors(colors: np.ndarray, n=8):
         colors is used.
 
     """
-    width, depth = colors.shape
-    reshaped_raster = np.reshape(colors, (width, depth))
-    model = cluster.KMeans(n_clusters=n)
-    labels = model.fit_predict(reshaped_raster)
-    palette = model.cluster_centers_
-    balanced_palette = balance_color(palette, separate_channels=False)
+    centers, labels = _fit_representative_colors(colors, n, max_samples,
+                                                 backend)
+    balanced_palette = balance_color(centers, separate_channels=False)
     return balanced_palette, labels
+
+
+def _fit_representative_colors(colors: np.ndarray, n=8,
+                               max_samples: int = 10000,
+                               backend: str = "numpy"):
+    """
+    Cluster the given colors into `n` representative colors, see
+    `choose_representative_colors`.
+
+    Returns:
+        The unbalanced representative colors and the label of each color
+    """
+    assert backend in KMEANS_BACKENDS
+    if len(colors) == 0:
+        return np.zeros((n, 3), np.uint8), np.zeros(0, int)
+
+    # find the distinct colors and how often they occur
+    rgb = _pack_rgb_values(*[colors[:, i] for i in range(3)])
+    distinct_rgb, color_mapping, counts = np.unique(rgb, return_inverse=True,
+                                                    return_counts=True)
+    distinct_colors = np.stack(_unpack_rgb_values(distinct_rgb), axis=1)
+
+    if len(distinct_colors) <= n:
+        # every color is its own representative, fill the remaining
+        # representatives with the most frequent color
+        palette = np.concatenate([
+            distinct_colors,
+            np.repeat(distinct_colors[[counts.argmax()]],
+                      n - len(distinct_colors), axis=0)])
+        labels = color_mapping
+    else:
+        sample, weights = distinct_colors, counts
+        if len(distinct_colors) > max_samples:
+            random = np.random.RandomState(0)
+            subset = random.choice(len(distinct_colors), max_samples,
+                                   replace=False)
+            sample, weights = distinct_colors[subset], counts[subset]
+        if backend == "numpy":
+            palette, distinct_labels, _ = kmeans(sample, n, weights,
+                                                 n_init=3, random_state=0)
+            if sample is not distinct_colors:
+                distinct_labels = nearest_centers(distinct_colors, palette)
+        else:
+            # sklearn takes long to import, only load it once it is needed
+            from sklearn import cluster
+            model = cluster.KMeans(n_clusters=n, n_init=3, random_state=0)
+            model.fit(sample, sample_weight=weights)
+            distinct_labels = model.predict(distinct_colors)
+            palette = model.cluster_centers_
+        # map the labels of the distinct colors back to all colors
+        labels = distinct_labels[color_mapping]
+
+    return palette, labels.ravel()
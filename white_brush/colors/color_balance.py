@@ -1,9 +1,17 @@
 import cv2
 import numpy as np
 
+# integer arrays are balanced with a histogram, if it has at most this
+# many bins, wider ranges of values are balanced like float arrays
+_MAX_HISTOGRAM_BINS = 2 ** 16
+# numpy converts indices to intp, integer arrays are counted and looked up
+# in chunks of this many values, so the converted indices stay small
+_CHUNK_SIZE = 2 ** 16
+
 
 def balance_color(img: np.ndarray, percentile: float = 0.5,
-                  separate_channels: bool = True) -> np.ndarray:
+                  separate_channels: bool = True,
+                  dst: np.ndarray = None) -> np.ndarray:
     """
     Balance the color in an image by setting the lowest value of each
     channel to zero and the highest to 255.
@@ -21,16 +29,28 @@ def balance_color(img: np.ndarray, percentile: float = 0.5,
         separate_channels: Flag which indicates whether the color
         balancing should be performed on each channel separately or
         on all channels at once
+        dst: Optional uint8 output array of the same shape as the image,
+            the result is written to it
 
     Returns:
         The color balanced image of shape (X, Y, 3)
 
     """
-    if img.ndim == 3 and separate_channels:
-        return cv2.merge([_normalize_array(channel, percentile)
-                          for channel in cv2.split(img)])
+    if img.dtype == np.uint8:
+        return _normalize_uint8(img, percentile, separate_channels, dst)
+    if np.issubdtype(img.dtype, np.integer) and not (
+            img.ndim == 3 and separate_channels):
+        result = _normalize_integer_array(img, percentile)
+    elif img.ndim == 3 and separate_channels:
+        result = cv2.merge([_normalize_array(channel, percentile)
+                            for channel in cv2.split(img)])
     else:
-        return _normalize_array(img, percentile)
+        result = _normalize_array(img, percentile)
+
+    if dst is None:
+        return result
+    np.copyto(dst, result)
+    return dst
 
 
 def _normalize_array(arr: np.ndarray,
@@ -64,3 +84,123 @@ def _normalize_array(arr: np.ndarray,
     clipped *= 255
 
     return np.round(clipped).astype(np.uint8)
+
+
+def _normalize_uint8(img: np.ndarray, percentile: float,
+                     separate_channels: bool,
+                     dst: np.ndarray = None) -> np.ndarray:
+    """
+    Same as `_normalize_array`, but for uint8 images and without
+    any floating point copy of the image.
+
+    The percentiles are calculated from a histogram of each channel and
+    the normalization is applied with a single lookup table.
+    """
+    if img.ndim == 3 and separate_channels:
+        n_channels = img.shape[2]
+        channels = img.reshape(-1, n_channels)
+        lut = np.stack([
+            _lookup_table(np.bincount(channels[:, i], minlength=256), 0,
+                          percentile)
+            for i in range(n_channels)], axis=1)
+        return cv2.LUT(img, lut.reshape(1, 256, n_channels), dst=dst)
+
+    histogram = np.bincount(img.ravel(), minlength=256)
+    lut = _lookup_table(histogram, 0, percentile)
+    if dst is not None and img.ndim <= 2:
+        return cv2.LUT(img, lut, dst=dst)
+    result = cv2.LUT(img, lut).reshape(img.shape)
+    if dst is None:
+        return result
+    np.copyto(dst, result)
+    return dst
+
+
+def _normalize_integer_array(arr: np.ndarray,
+                             percentile: float) -> np.ndarray:
+    """
+    Same as `_normalize_array`, but for integer arrays with a small
+    range of values (e.g. the difference of two uint8 images), based
+    on a histogram of the values instead of sorting them. Arrays with
+    a wider range of values are passed on to `_normalize_array`.
+    """
+    low, high = int(arr.min()), int(arr.max())
+    if high - low >= _MAX_HISTOGRAM_BINS:
+        return _normalize_array(arr, percentile)
+    # the offsets may overflow the type of the array, e.g. int16, but
+    # they are less than 2 ** 16, so they are right as uint16
+    offsets = (arr - low).astype(np.uint16, copy=False).ravel()
+    chunks = [slice(start, start + _CHUNK_SIZE)
+              for start in range(0, len(offsets), _CHUNK_SIZE)]
+
+    histogram = np.zeros(high - low + 1, np.int64)
+    for chunk in chunks:
+        histogram += np.bincount(offsets[chunk], minlength=len(histogram))
+    lut = _lookup_table(histogram, low, percentile)
+
+    result = np.empty(len(offsets), np.uint8)
+    for chunk in chunks:
+        np.take(lut, offsets[chunk], out=result[chunk])
+    return result.reshape(arr.shape)
+
+
+def _lookup_table(histogram: np.ndarray, first_value: int,
+                  percentile: float) -> np.ndarray:
+    """
+    Calculate the lookup table for normalizing the values of the given
+    histogram.
+
+    The entries are calculated exactly like in `_normalize_array`, so
+    applying the table to the values gives the same result.
+
+    Args:
+        histogram: Number of occurrences of each value
+        first_value: The value counted in the first bin of the histogram
+        percentile: At which percentile the lowest / highest value
+            will be picked from.
+
+    Returns:
+        uint8 lookup table with an entry for each bin of the histogram
+    """
+    low = _percentile_from_histogram(histogram, first_value, percentile)
+    high = _percentile_from_histogram(histogram, first_value,
+                                      100 - percentile)
+    values = np.arange(first_value, first_value + len(histogram),
+                       dtype=np.float64)
+
+    # same operations as in _normalize_array
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = values - low
+        values /= (high - low)
+    clipped = np.clip(values, 0, 1)
+    clipped *= 255
+    return np.round(clipped).astype(np.uint8)
+
+
+def _percentile_from_histogram(histogram: np.ndarray, first_value: int,
+                               percentile: float) -> float:
+    """
+    Calculate a percentile of the values counted in a histogram.
+
+    The result is the same as `np.percentile` of the values with the
+    default linear interpolation.
+    """
+    n = histogram.sum()
+    quantile = np.true_divide(percentile, 100)
+    index = (n - 1) * quantile
+    previous_index = np.floor(index)
+    gamma = index - previous_index
+    previous_index = int(min(max(previous_index, 0), n - 1))
+    next_index = min(previous_index + 1, n - 1)
+
+    # the value of the i-th smallest element is the first bin whose
+    # cumulative count is larger than i
+    cumulative = np.cumsum(histogram)
+    a, b = np.searchsorted(cumulative, [previous_index, next_index],
+                           side="right") + first_value
+    a, b = np.float64(a), np.float64(b)
+
+    # linear interpolation exactly like numpy does it
+    if gamma >= 0.5:
+        return b - (b - a) * (1 - gamma)
+    return a + (b - a) * gamma
@@ -1,16 +1,20 @@
+from functools import lru_cache
+
 import numpy as np
 import cv2
 
 from white_brush.colors.color_balance import balance_color
-from white_brush.colors.morphology import dilate, erode
+from white_brush.colors.morphology import erode, opening, to_bool_mask
 
 from white_brush.colors.conversion import rgb_to_hsv, rgb_to_gray
+from white_brush.colors.statistics import ImageStatistics
 from white_brush.colors.utils import _color_sample, _generate_bitmask, \
-    _pack_rgb_values, _unpack_rgb_values
+    _pack_rgb_6bit, _unpack_rgb_6bit, _RGB_6BIT_SIZE
 
 
 def hsv_distance_threshold(img: np.ndarray, bg_colors=None,
-                           v_thresh=70, s_thresh=80) -> np.ndarray:
+                           v_thresh=70, s_thresh=80,
+                           exact=False) -> np.ndarray:
     """
     Calculate a foreground mask based on HSV distance.
 
@@ -24,6 +28,11 @@ def hsv_distance_threshold(img: np.ndarray, bg_colors=None,
     of the specified bg colors, it will be in the background in the
     result also. (Results of each bg_color are combined with logical or)
 
+    By default the colors are reduced to 6 bit per channel and looked
+    up in a table which contains the decision for each of the reduced
+    colors, so the runtime does not depend on the number of background
+    colors.
+
     Args:
         img: The image for which to calculate a background / foreground
             mask
@@ -37,36 +46,63 @@ def hsv_distance_threshold(img: np.ndarray, bg_colors=None,
             channel, than the pixel is marked as belonging to the
             background.
         s_thresh: Threshold for the S channel.
+        exact: If True, the HSV distance is calculated for the exact
+            color of each pixel instead of looking up its reduced color
 
     Returns:
         The calculated foreground mask. If an element in the mask is
         False, this means that the corresponding pixel is part of the
         background. If it is True, the pixel is part of the foreground.
     """
-    # convert the hsv images to integers in order to avoid
-    # uint8 overflows when calculating the difference later
-    hsv_img = rgb_to_hsv(img).astype(np.int)
-
     if bg_colors is None:
         bg_colors = extract_background_colors(img)
-    hsv_bgs = rgb_to_hsv(bg_colors).astype(np.int).reshape(*bg_colors.shape)
+    bg_colors = np.asarray(bg_colors, np.uint8).reshape(-1, 3)
 
-    def make_background_mask(hsv_img, hsv_bg):
-        # the background is everything that has a difference less than
-        # v_thresh in the v channel and less than s_thresh in the s channel
-        background_mask = np.abs(hsv_img[:, :, 2] - hsv_bg[2]) <= v_thresh
-        background_mask &= np.abs(hsv_img[:, :, 1] - hsv_bg[1]) <= s_thresh
-        return background_mask
+    if exact:
+        return ~_hsv_background_mask(img, bg_colors, v_thresh, s_thresh)
+
+    foreground_table = _hsv_foreground_table(bg_colors.tobytes(),
+                                             v_thresh, s_thresh)
+    return foreground_table[_pack_rgb_6bit(img)]
 
-    print(hsv_bgs)
-    background_masks = [make_background_mask(hsv_img, hsv_bg) for hsv_bg in
-                        hsv_bgs]
-    return ~(np.logical_or.reduce(background_masks))
+
+@lru_cache(maxsize=16)
+def _hsv_foreground_table(bg_colors: bytes, v_thresh: int,
+                          s_thresh: int) -> np.ndarray:
+    # the foreground decision for every color with 6 bit per channel
+    # the background colors are given as bytes to be hashable
+    bg_colors = np.frombuffer(bg_colors, np.uint8).reshape(-1, 3)
+    colors = _unpack_rgb_6bit(np.arange(_RGB_6BIT_SIZE, dtype=np.uint32))
+    table = ~_hsv_background_mask(colors, bg_colors, v_thresh, s_thresh)
+    # the table is shared by all callers
+    table.setflags(write=False)
+    return table
+
+
+def _hsv_background_mask(colors: np.ndarray, bg_colors: np.ndarray,
+                         v_thresh: int, s_thresh: int) -> np.ndarray:
+    # convert the hsv values to integers in order to avoid
+    # uint8 overflows when calculating the difference later
+    hsv = rgb_to_hsv(colors).reshape(*colors.shape).astype(np.int16)
+    hsv_bgs = rgb_to_hsv(bg_colors).reshape(-1, 3).astype(np.int16)
+
+    background_mask = np.zeros(colors.shape[:-1], np.bool)
+    for hsv_bg in hsv_bgs:
+        # the background is everything that has a difference less than
+        # v_thresh in the v channel and less than s_thresh in the s
+        # channel
+        close = np.abs(hsv[..., 2] - hsv_bg[2]) <= v_thresh
+        close &= np.abs(hsv[..., 1] - hsv_bg[1]) <= s_thresh
+        background_mask |= close
+    return background_mask
 
 
 def background_difference_image(img: np.ndarray,
                                 kernel_size: int = 21,
-                                blur_kernel_size: int = 7):
+                                blur_kernel_size: int = 7,
+                                downscale: int = 4,
+                                dst: np.ndarray = None,
+                                stats: ImageStatistics = None):
     """
     Calculate an Image which consits of only the difference between the
     given image and its background
@@ -77,50 +113,101 @@ def background_difference_image(img: np.ndarray,
             create the background image
         blur_kernel_size: Parameter for the gaussian blur that will
             be performed on the background
+        downscale: Factor by which the image is downsampled to estimate
+            the background, see `estimate_background`. 1 estimates the
+            background at the resolution of the image.
+        dst: Optional uint8 output array of shape (X, Y), the result is
+            written to it
+        stats: Optional `ImageStatistics` of the grayscale version of
+            the image, which are calculated if they are not given
 
     Returns:
         The background difference image
     """
     if img.ndim == 3:
         img = rgb_to_gray(img)
+    if stats is None:
+        stats = ImageStatistics.of(img)
     # we want the background black, the foreground white
     # if that is not the case, flip black and white
-    if np.median(img) > 80:
+    if stats.median > 80:
         img = 255 - img
 
-    blurred = cv2.medianBlur(img, blur_kernel_size)
+    background = estimate_background(img, kernel_size, blur_kernel_size,
+                                     downscale)
+    return _background_difference(img, background, dst)
 
-    background = erode(blurred, kernel_size)
-    # calculate difference as integer, otherwise uint8 overflow will occurr
-    diff = img.astype(np.int) - background.astype(np.int)
+
+def _background_difference(img: np.ndarray, background: np.ndarray,
+                           dst: np.ndarray = None) -> np.ndarray:
+    """
+    Calculate the background difference image of a grayscale image with
+    a black background and its estimated background, see
+    `background_difference_image`
+    """
+    # calculate the difference as int16, otherwise uint8 overflow will
+    # occurr, int16 is wide enough for the difference of two uint8 images
+    diff = cv2.subtract(img, background, dtype=cv2.CV_16S)
     diff = balance_color(diff, percentile=1, separate_channels=False)
-    diff = dilate(erode(diff, 3), 3)
-    return 255 - diff
+    opening(diff, 3, dst=diff)
+    return cv2.bitwise_not(diff, dst=dst)
 
 
-def eroded_background_difference_threshold(img: np.ndarray,
-                                           kernel_size: int = 21,
-                                           blur_kernel_size: int = 7):
-    gray_img = rgb_to_gray(img)
-    # we want the background black, the foreground white
-    # if that is not the case, flip black and white
-    if np.median(gray_img) > 80:
-        gray_img = 255 - gray_img
+def estimate_background(img: np.ndarray, kernel_size: int = 21,
+                        blur_kernel_size: int = 7,
+                        downscale: int = 4) -> np.ndarray:
+    """
+    Estimate the background of a grayscale image with a black
+    background and a white foreground
 
-    blurred = cv2.medianBlur(gray_img, blur_kernel_size)
+    The image is blurred with a median filter and then eroded, which
+    removes the foreground. Since the background is smooth, it is
+    estimated on a copy downsampled by `downscale` with accordingly
+    smaller kernels and then upsampled again with bilinear
+    interpolation. This makes the estimation cost almost independent
+    of the kernel sizes.
+
+    Args:
+        img: Grayscale image of shape (X, Y) and dtype uint8
+        kernel_size: Kernel size for the erosion
+        blur_kernel_size: Kernel size of the median blur
+        downscale: Factor by which the image is downsampled, 1 estimates
+            the background exactly at the resolution of the image
+
+    Returns:
+        The background image of the same shape as the given image
+    """
+    if downscale <= 1:
+        return erode(cv2.medianBlur(img, blur_kernel_size), kernel_size)
+
+    height, width = img.shape
+    small_size = (max(1, width // downscale), max(1, height // downscale))
+    small = cv2.resize(img, small_size, interpolation=cv2.INTER_AREA)
+    blur_kernel_size = _scale_kernel_size(blur_kernel_size, downscale)
+    if blur_kernel_size > 1:
+        small = cv2.medianBlur(small, blur_kernel_size)
+    background = erode(small, _scale_kernel_size(kernel_size, downscale))
+    return cv2.resize(background, (width, height),
+                      interpolation=cv2.INTER_LINEAR)
+
+
+def _scale_kernel_size(kernel_size: int, downscale: int) -> int:
+    # round to the nearest odd size, so the kernel stays centered
+    return int(round(kernel_size / downscale)) | 1
 
-    background = erode(blurred, kernel_size)
-    # calculate difference as integer, otherwise uint8 overflow will occurr
-    diff = gray_img.astype(np.int) - background.astype(np.int)
-    diff = balance_color(diff, percentile=1, separate_channels=False)
-    diff = dilate(erode(diff, 3), 3)
-    return diff
-    _, otsu = cv2.threshold(diff, 0, 255,
-                            cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    return otsu == 255
+
+def eroded_background_difference_threshold(img: np.ndarray,
+                                           kernel_size: int = 21,
+                                           blur_kernel_size: int = 7,
+                                           downscale: int = 4):
+    # the background difference image is the inverted difference
+    diff = background_difference_image(img, kernel_size, blur_kernel_size,
+                                        downscale)
+    return cv2.bitwise_not(diff, dst=diff)
 
 
-def adaptive_threshold(img: np.ndarray, block_size: int, min_thresh: int):
+def adaptive_threshold(img: np.ndarray, block_size: int, min_thresh: int,
+                       stats: ImageStatistics = None):
     """
     Calculate a foreground mask based on adaptive thresholding.
 
@@ -136,28 +223,59 @@ def adaptive_threshold(img: np.ndarray, block_size: int, min_thresh: int):
         img: The image for which to calculate a foreground mask
         block_size: size of the neighbourhood around each pixel
         min_thresh: minimum difference from the mean of the neighbourhood
+        stats: Optional `ImageStatistics` of the grayscale version of
+            the image, which are calculated if they are not given
 
     Returns:
         The calculated foreground mask. If an element in the mask is
         False, this means that the corresponding pixel is part of the
         background. If it is True, the pixel is part of the foreground.
 
+    """
+    return to_bool_mask(_adaptive_threshold_gray_mask(img, block_size,
+                                                      min_thresh,
+                                                      stats=stats))
+
+
+def _adaptive_threshold_gray_mask(img: np.ndarray, block_size: int,
+                                  min_thresh: int,
+                                  dst: np.ndarray = None,
+                                  stats: ImageStatistics = None
+                                  ) -> np.ndarray:
+    """
+    Same as `adaptive_threshold`, but the mask is returned as uint8
+    image with the foreground 255 and the background 0, optionally
+    written to the given output array
     """
     if img.ndim == 3:
         img = rgb_to_gray(img)
+    if stats is None:
+        stats = ImageStatistics.of(img)
 
     # we want the background white, the foreground black
     # if that is not the case, flip black and white
-    if np.median(img) < 100:
+    if stats.median < 100:
         img = 255 - img
 
-    thresh = cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
-                                   cv2.THRESH_BINARY, block_size, min_thresh)
-    thresh_mask = thresh == 0
-    return thresh_mask
+    return _adaptive_threshold_dark_foreground(img, block_size, min_thresh,
+                                               dst)
+
+
+def _adaptive_threshold_dark_foreground(img: np.ndarray, block_size: int,
+                                        min_thresh: int,
+                                        dst: np.ndarray = None
+                                        ) -> np.ndarray:
+    """
+    Adaptive thresholding of a grayscale image with a white background
+    and a black foreground, see `_adaptive_threshold_gray_mask`
+    """
+    # the inverted threshold marks the (black) foreground with 255
+    return cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                 cv2.THRESH_BINARY_INV, block_size,
+                                 min_thresh, dst=dst)
 
 
-def otsu_threshold(img: np.ndarray):
+def otsu_threshold(img: np.ndarray, stats: ImageStatistics = None):
     """
     Calculate a foreground mask based on otsu thresholding.
 
@@ -166,6 +284,9 @@ def otsu_threshold(img: np.ndarray):
 
     Args:
         img: The image for which to calculate a foreground mask
+        stats: Optional `ImageStatistics` of the grayscale version of
+            the image. If they are given, their Otsu threshold is used
+            instead of calculating it from the image.
 
     Returns:
         The calculated foreground mask. If an element in the mask is
@@ -173,14 +294,32 @@ def otsu_threshold(img: np.ndarray):
         background. If it is True, the pixel is part of the foreground.
 
     """
-    if img.ndim == 3:
-        img = rgb_to_gray(img)
-    _, otsu = cv2.threshold(img, 0, 255,
-                            cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    return otsu == 0
+    return to_bool_mask(_otsu_threshold_gray_mask(img, stats=stats))
 
 
-def extract_background_colors(img: np.ndarray, thresh=0.4) -> np.ndarray:
+def _otsu_threshold_gray_mask(img: np.ndarray,
+                              dst: np.ndarray = None,
+                              stats: ImageStatistics = None) -> np.ndarray:
+    """
+    Same as `otsu_threshold`, but the mask is returned as uint8 image
+    with the foreground 255 and the background 0, optionally written to
+    the given output array
+    """
+    if img.ndim == 3:
+        img = rgb_to_gray(img)
+    if stats is None:
+        # OpenCV calculates the histogram and the threshold itself
+        _, otsu = cv2.threshold(img, 0, 255,
+                                cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU,
+                                dst=dst)
+    else:
+        _, otsu = cv2.threshold(img, stats.otsu_threshold, 255,
+                                cv2.THRESH_BINARY_INV, dst=dst)
+    return otsu
+
+
+def extract_background_colors(img: np.ndarray, thresh=0.4,
+                              sample_fraction=0.05) -> np.ndarray:
     """
     Extract the most frequently occurring colors in an image
 
@@ -192,6 +331,10 @@ def extract_background_colors(img: np.ndarray, thresh=0.4) -> np.ndarray:
             If a color occurs at least thresh % as often as the most
             frequent color, it is considered part of the background.
             The default value is 40%.
+        sample_fraction: The fraction of the pixels which are used to
+            count the colors, e.g. 0.05 for 5% or 1 for all of them.
+            Counting takes linear time, so larger samples are only
+            proportionally slower.
 
     Returns:
         R, G, B color values of the background as numpy array of
@@ -201,22 +344,20 @@ def extract_background_colors(img: np.ndarray, thresh=0.4) -> np.ndarray:
 
     """
     assert 0 <= thresh <= 1
+    assert 0 < sample_fraction <= 1
     # only use a subset of the colors of the image
-    sample = _color_sample(img)
-    # reduce bit depth
-    mask = _generate_bitmask(2, 8)
-    reduced_colors = sample & mask
-    # combine r, g and b into one single value
-    rgb = _pack_rgb_values(*[reduced_colors[:, i] for i in range(3)])
-    # find the most frequent colors
-    colors, counts = np.unique(rgb, return_counts=True)
+    sample = _color_sample(img, sample_fraction)
+    # reduce the bit depth and combine r, g and b into one single value
+    rgb = _pack_rgb_6bit(sample)
+    # count how often each of the reduced colors occurs
+    counts = np.bincount(rgb, minlength=_RGB_6BIT_SIZE)
     # find all the colors that occur at least thresh % as often as
     # the most frequent color. Those colors are the background colors
     # of the image
     most_frequent = counts.max()
     frequent_mask = (counts / most_frequent) >= thresh
-    bg_colors = colors[frequent_mask]
-    # convert back to separate r, g and b
-    r, g, b = _unpack_rgb_values(bg_colors)
-    bg_colors = np.stack([r, g, b], axis=1).astype(np.uint8)
-    return bg_colors
+    # colors which do not occur at all are never part of the background
+    frequent_mask &= counts > 0
+    bg_colors = np.flatnonzero(frequent_mask)
+    # convert back to separate r, g and b, with the reduced bits zero
+    return _unpack_rgb_6bit(bg_colors) & _generate_bitmask(2, 8)
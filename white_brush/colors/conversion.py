@@ -3,8 +3,10 @@ from typing import Tuple
 import cv2
 import numpy as np
 
-from white_brush.colors.calc_colors import choose_representative_colors
+from white_brush.colors.calc_colors import Palette, \
+    choose_representative_colors
 from white_brush.colors.utils import _generate_bitmask
+from white_brush.entities.indexed_image import IndexedImage
 
 
 def rgb_to_hsv(color: np.ndarray) -> np.ndarray:
@@ -107,17 +109,36 @@ def mask_to_rgb(mask: np.ndarray,
     Returns:
         RGB Image of shape (X, Y, 3)
     """
-    bg_color = np.asarray(bg_color).astype(np.uint8)
-    fg_color = np.asarray(fg_color).astype(np.uint8)
-    rgb = np.empty(mask.shape + (3,), np.uint8)
-    rgb[:, :] = bg_color
-    rgb[mask] = fg_color
-    return rgb
+    return mask_to_indexed(mask, bg_color, fg_color).to_rgb()
+
+
+def mask_to_indexed(mask: np.ndarray,
+                    bg_color: Tuple[int, int, int] = (255, 255, 255),
+                    fg_color: Tuple[int, int, int] = (0, 0, 0)
+                    ) -> IndexedImage:
+    """
+    Convert a 2D boolean mask into an image of the two colors, like
+    `mask_to_rgb`, but as indices into the palette of the background
+    color (index 0) and the foreground color (index 1)
+
+    Args:
+        mask: Boolean numpy array of shape (X, Y)
+        bg_color: Color substituted for False values in the mask
+            By default this is white
+        fg_color: Color substituded for True values in the mask
+            By default this is black
+
+    Returns:
+        Indexed image of shape (X, Y)
+    """
+    return IndexedImage(mask.astype(np.uint8), [bg_color, fg_color])
 
 
 def mask_to_rgb_with_fg_colors_from_image(mask: np.ndarray,
                                           bg_color: Tuple[int, int, int],
-                                          fg_color_img: np.ndarray) -> np.ndarray:
+                                          fg_color_img: np.ndarray,
+                                          backend: str = "numpy"
+                                          ) -> np.ndarray:
     """
     Convert a 2d boolean mask into an RGB image
 
@@ -133,18 +154,84 @@ def mask_to_rgb_with_fg_colors_from_image(mask: np.ndarray,
         bg_color: Color substituted for False values in the mask
         fg_color_img: The image of shape (X, Y, 3) where the foreground
             colors are taken from
+        backend: The k-means implementation which calculates the
+            representative colors, see `choose_representative_colors`
 
     Returns:
         RGB Image of shape (X, Y, 3)
     """
+    return mask_to_indexed_with_fg_colors_from_image(
+        mask, bg_color, fg_color_img, backend).to_rgb()
+
+
+def mask_to_indexed_with_fg_colors_from_image(mask: np.ndarray,
+                                              bg_color: Tuple[int, int, int],
+                                              fg_color_img: np.ndarray,
+                                              backend: str = "numpy"
+                                              ) -> IndexedImage:
+    """
+    Like `mask_to_rgb_with_fg_colors_from_image`, but the image is
+    returned as indices into the palette of the background color
+    (index 0) and the representative colors (index 1 - 8)
+    """
+    assert mask.shape == fg_color_img.shape[:2]
+    colors = fg_color_img[mask]
+    colors &= _generate_bitmask(2, 8)
+    rep_colors, color_mapping = choose_representative_colors(
+        colors, backend=backend)
+    return _indexed_foreground(mask, bg_color, rep_colors, color_mapping)
+
+
+def mask_to_rgb_with_palette(mask: np.ndarray,
+                             bg_color: Tuple[int, int, int],
+                             fg_color_img: np.ndarray,
+                             palette: Palette) -> np.ndarray:
+    """
+    Convert a 2d boolean mask into an RGB image
+
+    Like `mask_to_rgb_with_fg_colors_from_image`, but instead of
+    calculating the representative colors from the foreground colors
+    of this image, the foreground pixels are assigned to the nearest
+    color of the given palette.
+
+    Args:
+        mask: Boolean numpy array of shape (X, Y)
+        bg_color: Color substituted for False values in the mask
+        fg_color_img: The image of shape (X, Y, 3) where the foreground
+            colors are taken from
+        palette: The representative colors for the foreground
+
+    Returns:
+        RGB Image of shape (X, Y, 3)
+    """
+    return mask_to_indexed_with_palette(mask, bg_color, fg_color_img,
+                                        palette).to_rgb()
+
+
+def mask_to_indexed_with_palette(mask: np.ndarray,
+                                 bg_color: Tuple[int, int, int],
+                                 fg_color_img: np.ndarray,
+                                 palette: Palette) -> IndexedImage:
+    """
+    Like `mask_to_rgb_with_palette`, but the image is returned as
+    indices into the palette of the background color (index 0) and
+    the colors of the given palette (index 1 - N)
+    """
     assert mask.shape == fg_color_img.shape[:2]
     colors = fg_color_img[mask]
     colors &= _generate_bitmask(2, 8)
-    rep_colors, color_mapping = choose_representative_colors(colors)
-    out_img = np.empty(fg_color_img.shape, np.uint8)
-    out_img[~mask, :] = bg_color
-    out_img[mask] = rep_colors[color_mapping]
-    return out_img
+    return _indexed_foreground(mask, bg_color, palette.colors,
+                               palette.assign(colors))
+
+
+def _indexed_foreground(mask: np.ndarray, bg_color: Tuple[int, int, int],
+                        fg_colors: np.ndarray,
+                        fg_labels: np.ndarray) -> IndexedImage:
+    # the background color is the first color of the palette, the
+    # foreground colors follow it
+    labels = np.zeros(mask.shape, np.uint8)
+    labels[mask] = fg_labels + 1
+    return IndexedImage(labels, np.concatenate([[bg_color], fg_colors]))
 
 
 def __convert_color__(color, conversion_code, n_src_channels=3,
@@ -0,0 +1,228 @@
+from typing import Tuple
+
+import numpy as np
+
+
+def kmeans(points: np.ndarray, n_clusters: int, weights: np.ndarray = None,
+           n_init: int = 3, max_iter: int = 300, tol: float = 1e-4,
+           random_state: int = 0) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    Cluster the given points into `n_clusters` clusters with k-means.
+
+    A vectorized implementation for few clusters of low dimensional
+    points like colors, with the same algorithm as
+    `sklearn.cluster.KMeans`: the centers are initialized with greedy
+    k-means++ and refined with Lloyd's algorithm until they move less
+    than the tolerance. The best of `n_init` runs is returned.
+
+    Args:
+        points: The points of shape (N, D) to cluster
+        n_clusters: The number of clusters
+        weights: Optional weight of each point of shape (N), e.g. how
+            often a color occurs. By default every point has weight 1.
+        n_init: How often the clustering is run with different initial
+            centers
+        max_iter: Maximum number of iterations of a single run
+        tol: Tolerance of the movement of the centers, relative to the
+            variance of the points, below which a run is finished
+        random_state: Seed of the random initialization
+
+    Returns:
+        A 3-tuple of the centers of shape (n_clusters, D), the label of
+        each point of shape (N) and the inertia, the weighted sum of
+        the squared distances of the points to their centers.
+    """
+    points = np.ascontiguousarray(points, np.float64)
+    assert points.ndim == 2 and len(points) >= n_clusters > 0
+    if weights is None:
+        weights = np.ones(len(points))
+    weights = np.asarray(weights, np.float64)
+    random = np.random.RandomState(random_state)
+    tol = tol * np.var(points, axis=0).mean()
+    # the points are stored per dimension, so the distances to each
+    # center are contiguous and the nearest center of all points is
+    # found with a few vectorized operations over the clusters
+    points_t = np.ascontiguousarray(points.T)
+    squared_norms = (points ** 2).sum(axis=1)
+
+    best = None
+    for _ in range(n_init):
+        centers = _init_centers(points, points_t, weights, squared_norms,
+                                n_clusters, random)
+        result = _lloyd(points, points_t, weights, squared_norms, centers,
+                        max_iter, tol)
+        if best is None or result[2] < best[2]:
+            best = result
+    return best
+
+
+def nearest_centers(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """
+    Calculate the label of the nearest center of each point, e.g. to
+    assign points which were not clustered to the clusters
+
+    Args:
+        points: The points of shape (N, D)
+        centers: The centers of shape (K, D)
+
+    Returns:
+        The label of each point of shape (N)
+    """
+    points = np.asarray(points, np.float64)
+    distances = _squared_distances(np.ascontiguousarray(points.T),
+                                   (points ** 2).sum(axis=1), centers)
+    return _nearest(distances)[0]
+
+
+def _nearest(distances: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # the label of the nearest center and the distance to it for the
+    # distances of shape (K, N). argmin over the first axis is slow, the
+    # minimum is not, the first equal center is chosen like with argmin
+    nearest = distances.min(axis=0)
+    return (distances == nearest).argmax(axis=0), nearest
+
+
+def _squared_distances(points_t: np.ndarray, squared_norms: np.ndarray,
+                       centers: np.ndarray) -> np.ndarray:
+    # |p - c|^2 = |p|^2 - 2 p.c + |c|^2, shape (..., K, N)
+    distances = _center_scores(points_t, centers)
+    distances += squared_norms
+    # rounding errors can make distances of equal points negative
+    return np.maximum(distances, 0, out=distances)
+
+
+def _center_scores(points_t: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    # the squared distances without |p|^2, which is the same for all
+    # centers and therefore not needed to find the nearest one
+    scores = (-2 * centers) @ points_t
+    scores += (centers ** 2).sum(axis=-1)[..., None]
+    return scores
+
+
+def _init_centers(points: np.ndarray, points_t: np.ndarray,
+                  weights: np.ndarray, squared_norms: np.ndarray,
+                  n_clusters: int,
+                  random: np.random.RandomState) -> np.ndarray:
+    """
+    Greedy k-means++: each center is the best of a few candidates,
+    which are chosen with a probability proportional to their weighted
+    squared distance to the nearest center chosen before.
+    """
+    n_local_trials = 2 + int(np.log(n_clusters))
+    centers = np.empty((n_clusters, points.shape[1]))
+    # the same as random.choice(len(points), p=weights / weights.sum()),
+    # without its costly validation of the probabilities
+    cumulative_weights = np.cumsum(weights)
+    first = np.searchsorted(cumulative_weights / cumulative_weights[-1],
+                            random.random_sample(), side="right")
+    centers[0] = points[first]
+    closest = _squared_distances(points_t, squared_norms, centers[[0]])[0]
+    potential = weights @ closest
+
+    for i in range(1, n_clusters):
+        thresholds = random.uniform(size=n_local_trials) * potential
+        candidates = np.searchsorted(np.cumsum(weights * closest),
+                                     thresholds)
+        candidates = np.minimum(candidates, len(points) - 1)
+        # squared distance of each point to its nearest center, if the
+        # candidate is chosen, shape (n_local_trials, N)
+        distances = _squared_distances(points_t, squared_norms,
+                                       points[candidates])
+        np.minimum(distances, closest, out=distances)
+        potentials = distances @ weights
+        best = potentials.argmin()
+        centers[i] = points[candidates[best]]
+        closest = distances[best]
+        potential = potentials[best]
+    return centers
+
+
+def _two_nearest(distances: np.ndarray):
+    """
+    The nearest center of each point, the distance to it and to the
+    second nearest center, for the squared distances of shape (K, N)
+    """
+    labels, nearest = _nearest(distances)
+    distances[labels, np.arange(distances.shape[1])] = np.inf
+    second_nearest = distances.min(axis=0)
+    return labels, np.sqrt(nearest), np.sqrt(second_nearest)
+
+
+def _cluster_sums(labels: np.ndarray, values: np.ndarray,
+                  n_clusters: int) -> np.ndarray:
+    # sum of the values of shape (N, V) of each cluster, shape (K, V)
+    one_hot = labels == np.arange(n_clusters)[:, None]
+    return one_hot @ values
+
+
+def _lloyd(points: np.ndarray, points_t: np.ndarray, weights: np.ndarray,
+           squared_norms: np.ndarray, centers: np.ndarray, max_iter: int,
+           tol: float) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    Lloyd's algorithm, accelerated like Hamerly's algorithm: for each
+    point an upper bound of the distance to its center and a lower
+    bound of the distance to all other centers is kept. Only the points
+    whose bounds overlap after the centers moved can change their
+    label, only their distances to all centers are calculated again.
+
+    The labels are reassigned after every move of the centers, so they
+    always belong to the returned centers.
+    """
+    n_clusters = len(centers)
+    # the weighted points with the weight as additional dimension, so
+    # the sums of the points and the weights of a cluster are summed
+    # together, shape (N, D + 1)
+    weighted_points = np.concatenate(
+        [points * weights[:, None], weights[:, None]], axis=1)
+    labels, upper, lower = _two_nearest(
+        _squared_distances(points_t, squared_norms, centers))
+    sums = _cluster_sums(labels, weighted_points, n_clusters)
+
+    for _ in range(max_iter):
+        counts = sums[:, -1]
+        empty = counts <= 0
+        new_centers = sums[:, :-1] / np.where(empty, 1, counts)[:, None]
+        if empty.any():
+            # move the centers without points to the points farthest
+            # from their centers, all bounds have to be calculated again
+            farthest = np.argsort(upper)[::-1][:empty.sum()]
+            new_centers[empty] = points[farthest]
+            centers = new_centers
+            labels, upper, lower = _two_nearest(
+                _squared_distances(points_t, squared_norms, centers))
+            sums = _cluster_sums(labels, weighted_points, n_clusters)
+            continue
+
+        shifts = np.sqrt(((new_centers - centers) ** 2).sum(axis=1))
+        centers = new_centers
+        upper += shifts[labels]
+        lower -= shifts.max()
+
+        # a point is nearer to its center than to all others, if it is
+        # nearer than half the distance of its center to the next one
+        center_distances = np.sqrt(_squared_distances(
+            centers.T, (centers ** 2).sum(axis=1), centers))
+        np.fill_diagonal(center_distances, np.inf)
+        bounds = np.maximum(lower, (center_distances.min(axis=0) / 2)[labels])
+        candidates = np.flatnonzero(upper > bounds)
+        # np.take gathers rows considerably faster than indexing
+        candidate_labels, upper[candidates], lower[candidates] = \
+            _two_nearest(_squared_distances(
+                np.take(points, candidates, axis=0).T,
+                squared_norms[candidates], centers))
+        moved = candidate_labels != labels[candidates]
+        if (shifts ** 2).sum() <= tol or not moved.any():
+            # the centers would not move anymore, or less than tol
+            labels[candidates] = candidate_labels
+            break
+        # only the sums of the clusters the points moved between change
+        moved_points = candidates[moved]
+        moved_sums = np.take(weighted_points, moved_points, axis=0)
+        sums -= _cluster_sums(labels[moved_points], moved_sums, n_clusters)
+        labels[moved_points] = candidate_labels[moved]
+        sums += _cluster_sums(labels[moved_points], moved_sums, n_clusters)
+
+    # the exact distances to the centers, the upper bounds are not
+    differences = points - np.take(centers, labels, axis=0)
+    inertia = weights @ np.einsum("ij,ij->i", differences, differences)
+    return centers, labels, float(inertia)
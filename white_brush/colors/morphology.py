@@ -1,9 +1,18 @@
+from functools import lru_cache
+
 import numpy as np
 import cv2
 
+_KERNEL_SHAPES = {
+    "rect": cv2.MORPH_RECT,
+    "cross": cv2.MORPH_CROSS,
+    "ellipse": cv2.MORPH_ELLIPSE
+}
+
 
 def erode(image: np.ndarray, kernel_size: int,
-          kernel_shape: str = "rect", iterations: int = 1) -> np.ndarray:
+          kernel_shape: str = "rect", iterations: int = 1,
+          dst: np.ndarray = None) -> np.ndarray:
     """
     Erode the given foreground mask or grayscale image, resulting in a
     lighter font
@@ -26,17 +35,20 @@ def erode(image: np.ndarray, kernel_size: int,
             'rect', 'ellipse' or 'cross'
         iterations: How often the erosion algorithm will be applied
             on the image
+        dst: Optional output array of the same shape and dtype as the
+            image, the result is written to it
 
     Returns:
         The eroded mask or grayscale image
     """
     return __morphological_transformation__(cv2.erode, image,
                                             kernel_size, kernel_shape,
-                                            iterations)
+                                            iterations, dst)
 
 
 def dilate(image: np.ndarray, kernel_size: int,
-           kernel_shape: str = "rect", iterations: int = 1) -> np.ndarray:
+           kernel_shape: str = "rect", iterations: int = 1,
+           dst: np.ndarray = None) -> np.ndarray:
     """
     Dilate the given foreground mask or grayscale image, resulting in a
     bolder font
@@ -59,13 +71,65 @@ def dilate(image: np.ndarray, kernel_size: int,
             'rect', 'ellipse' or 'cross'
         iterations: How often the dilation algorithm will be applied
             on the image
+        dst: Optional output array of the same shape and dtype as the
+            image, the result is written to it
 
     Returns:
         The dilated mask or grayscale image
     """
     return __morphological_transformation__(cv2.dilate, image,
                                             kernel_size, kernel_shape,
-                                            iterations)
+                                            iterations, dst)
+
+
+def opening(image: np.ndarray, kernel_size: int,
+            kernel_shape: str = "rect", dst: np.ndarray = None) -> np.ndarray:
+    """
+    Open the given foreground mask or grayscale image, which removes
+    foreground details smaller than the kernel
+
+    Opening is an erosion followed by a dilation, both are done by a
+    single call to OpenCV.
+
+    Args:
+        image: The mask or grayscale image of shape (X, Y), see `erode`
+        kernel_size: The kernel size used for the erosion and dilation
+        kernel_shape: The kernel shape used for the erosion and dilation
+            Must be one of 'rect', 'ellipse' or 'cross'
+        dst: Optional output array of the same shape and dtype as the
+            image, the result is written to it
+
+    Returns:
+        The opened mask or grayscale image
+    """
+    return __morphological_transformation__(_morphology_ex(cv2.MORPH_OPEN),
+                                            image, kernel_size,
+                                            kernel_shape, 1, dst)
+
+
+def closing(image: np.ndarray, kernel_size: int,
+            kernel_shape: str = "rect", dst: np.ndarray = None) -> np.ndarray:
+    """
+    Close the given foreground mask or grayscale image, which fills
+    background details smaller than the kernel
+
+    Closing is a dilation followed by an erosion, both are done by a
+    single call to OpenCV.
+
+    Args:
+        image: The mask or grayscale image of shape (X, Y), see `erode`
+        kernel_size: The kernel size used for the dilation and erosion
+        kernel_shape: The kernel shape used for the dilation and erosion
+            Must be one of 'rect', 'ellipse' or 'cross'
+        dst: Optional output array of the same shape and dtype as the
+            image, the result is written to it
+
+    Returns:
+        The closed mask or grayscale image
+    """
+    return __morphological_transformation__(_morphology_ex(cv2.MORPH_CLOSE),
+                                            image, kernel_size,
+                                            kernel_shape, 1, dst)
 
 
 def smooth(foreground_mask: np.ndarray, kernel_size: int,
@@ -88,48 +152,83 @@ def smooth(foreground_mask: np.ndarray, kernel_size: int,
     Returns:
         The smoothed foreground mask of shape (X, Y)
     """
+    # smoothing = opening followed by closing
+    #           = erode(dilate(dilate(erode(mask))))
+    # a boolean mask is only converted once for both of them
+    gray_img = opening(to_gray_mask(foreground_mask), kernel_size,
+                       kernel_shape)
+    closing(gray_img, kernel_size, kernel_shape, dst=gray_img)
+    if foreground_mask.dtype == np.bool:
+        return to_bool_mask(gray_img)
+    return gray_img
 
-    def opening(img):
-        # opening = erosion followed by dilation
-        return dilate(erode(img, kernel_size, kernel_shape), kernel_size,
-                      kernel_shape)
 
-    def closing(img):
-        # closing = dilation followed by erosion
-        return erode(dilate(img, kernel_size, kernel_shape), kernel_size,
-                     kernel_shape)
+def to_gray_mask(mask: np.ndarray) -> np.ndarray:
+    """
+    Convert a boolean mask to the uint8 representation used by the
+    morphological transformations
 
-    # smoothing = opening followed by closing
-    #           = erode(dilate(dilate(erode(mask))))
-    return closing(opening(foreground_mask))
+    Args:
+        mask: Boolean mask or uint8 grayscale image of shape (X, Y)
+
+    Returns:
+        A uint8 image where the foreground is 255 and the background is
+        0. uint8 images are returned as they are.
+    """
+    if mask.dtype != np.bool:
+        return mask
+    return mask.view(np.uint8) * np.uint8(255)
+
+
+def to_bool_mask(gray_img: np.ndarray, dst: np.ndarray = None) -> np.ndarray:
+    """
+    Convert a uint8 mask with the foreground 255 and the background 0
+    back to a boolean mask
+
+    Args:
+        gray_img: uint8 mask of shape (X, Y)
+        dst: Optional boolean output array of the same shape
+
+    Returns:
+        Boolean mask which is True where the gray image is 255
+    """
+    return np.equal(gray_img, 255, out=dst)
+
+
+@lru_cache(maxsize=None)
+def _structuring_element(kernel_shape: str, kernel_size: int) -> np.ndarray:
+    assert kernel_shape in _KERNEL_SHAPES
+    kernel = cv2.getStructuringElement(_KERNEL_SHAPES[kernel_shape],
+                                       (kernel_size, kernel_size))
+    # the kernel is shared by all callers
+    kernel.setflags(write=False)
+    return kernel
+
+
+def _morphology_ex(operation):
+    def morph_func(src, kernel, dst=None, iterations=1):
+        return cv2.morphologyEx(src, operation, kernel, dst=dst,
+                                iterations=iterations)
+    return morph_func
 
 
 def __morphological_transformation__(morph_func, mask: np.ndarray,
                                      kernel_size: int,
                                      kernel_shape: str = "rect",
-                                     iterations: int = 1):
+                                     iterations: int = 1,
+                                     dst: np.ndarray = None):
     bool_mask = mask.dtype == np.bool
     assert bool_mask or mask.dtype == np.uint8
     assert mask.ndim == 2
-    shape_dict = {
-        "rect": cv2.MORPH_RECT,
-        "cross": cv2.MORPH_CROSS,
-        "ellipse": cv2.MORPH_ELLIPSE
-    }
-    assert kernel_shape in shape_dict
-    # convert the boolean mask to a gray image
-    # the background needs to be black, the foreground white
-    gray_img = mask
-    if bool_mask:
-        gray_img = mask.astype(np.uint8) * 255
+    assert dst is None or (dst.dtype == mask.dtype
+                           and dst.shape == mask.shape)
+    kernel = _structuring_element(kernel_shape, kernel_size)
 
-    # construct the kernel with the given size and shape
-    kernel = cv2.getStructuringElement(shape_dict[kernel_shape],
-                                       (kernel_size, kernel_size))
+    if not bool_mask:
+        return morph_func(mask, kernel, dst=dst, iterations=iterations)
 
-    # perform the morphological transformation
-    result = morph_func(gray_img, kernel, iterations)
+    # convert the boolean mask to a gray image
+    # the background needs to be black, the foreground white
+    gray_img = morph_func(to_gray_mask(mask), kernel, iterations=iterations)
     # convert the resulting gray image back to a boolean mask
-    if bool_mask:
-        result = result == 255
-    return result
+    return to_bool_mask(gray_img, dst)
@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+
+from white_brush.colors.color_balance import _percentile_from_histogram
+
+# same epsilon as OpenCV uses in its Otsu thresholding
+_FLT_EPSILON = float(np.finfo(np.float32).eps)
+
+
+class ImageStatistics:
+    def __init__(self, histogram: np.ndarray):
+        """
+        Creates new ImageStatistics of a grayscale image, all of them
+        are derived from its histogram.
+
+        Computing the statistics from the histogram takes time
+        proportional to the 256 bins instead of the number of pixels,
+        so the histogram is calculated once per image and shared by all
+        functions which need statistics of the image.
+
+        Args:
+            histogram: Number of pixels with each of the values 0 - 255
+        """
+        self.histogram = np.asarray(histogram, np.int64)
+        self.__median__ = None
+        self.__otsu_threshold__ = None
+
+    @staticmethod
+    def of(img: np.ndarray) -> "ImageStatistics":
+        """
+        Calculate the statistics of the given grayscale image.
+
+        Args:
+            img: Grayscale image of shape (X, Y) and dtype uint8
+
+        Returns:
+            The statistics of the image
+        """
+        assert img.dtype == np.uint8
+        histogram = cv2.calcHist([img], [0], None, [256], [0, 256])
+        return ImageStatistics(histogram.ravel())
+
+    @property
+    def median(self) -> float:
+        """
+        The median value of the image, the same as `np.median(img)`.
+        """
+        if self.__median__ is None:
+            self.__median__ = self.percentile(50)
+        return self.__median__
+
+    def percentile(self, q: float) -> float:
+        """
+        Calculate the q-th percentile of the values of the image, the
+        same as `np.percentile(img, q)`.
+        """
+        return _percentile_from_histogram(self.histogram, 0, q)
+
+    @property
+    def otsu_threshold(self) -> int:
+        """
+        The threshold which Otsu's method chooses for the image, the
+        same as the threshold which `cv2.threshold` calculates with
+        `cv2.THRESH_OTSU`.
+        """
+        if self.__otsu_threshold__ is None:
+            self.__otsu_threshold__ = self.__calculate_otsu_threshold__()
+        return self.__otsu_threshold__
+
+    def __calculate_otsu_threshold__(self) -> int:
+        # the same calculation as in OpenCV, operation by operation, so
+        # exactly the same threshold is chosen
+        scale = 1. / self.histogram.sum()
+        mu = float(np.arange(256) @ self.histogram) * scale
+
+        mu1, q1 = 0., 0.
+        max_sigma, threshold = 0., 0
+        for i, count in enumerate(self.histogram.tolist()):
+            p_i = count * scale
+            mu1 *= q1
+            q1 += p_i
+            q2 = 1. - q1
+            if min(q1, q2) < _FLT_EPSILON or max(q1, q2) > 1. - _FLT_EPSILON:
+                continue
+            mu1 = (mu1 + i * p_i) / q1
+            mu2 = (mu - q1 * mu1) / q2
+            sigma = q1 * q2 * (mu1 - mu2) * (mu1 - mu2)
+            if sigma > max_sigma:
+                max_sigma = sigma
+                threshold = i
+        return threshold
@@ -1,4 +1,3 @@
-import webcolors
 import numpy as np
 
 
@@ -12,6 +11,9 @@ def parse_color(color):
     Returns:
         Returns the parsed color as rgb value or None if not parseable.
     """
+    # only load webcolors if colors are actually parsed
+    import webcolors
+
     try:
         color = webcolors.name_to_rgb(color)
         return color.red, color.green, color.blue
@@ -100,3 +102,37 @@ def _unpack_rgb_values(rgb):
     g = rgb & mask
     r = rgb >> 8
     return r, g, b
+
+
+def _pack_rgb_6bit(colors: np.ndarray) -> np.ndarray:
+    """
+    Reduce the colors to 6 bit per channel and combine r, g and b into
+    a single 18 bit value, which can be used to index a lookup table of
+    size `_RGB_6BIT_SIZE`
+
+    Args:
+        colors: uint8 colors of shape (..., 3), e.g. an image
+
+    Returns:
+        The packed colors of shape (...) as uint32
+    """
+    reduced = colors >> 2
+    packed = reduced[..., 0].astype(np.uint32) << 12
+    packed |= reduced[..., 1].astype(np.uint32) << 6
+    packed |= reduced[..., 2]
+    return packed
+
+
+def _unpack_rgb_6bit(packed: np.ndarray) -> np.ndarray:
+    """
+    Convert packed 18 bit values back to uint8 colors of shape (..., 3).
+    Each color is the center of the range of 8 bit colors which are
+    reduced to the same 6 bit value.
+    """
+    mask = _generate_bitmask(0, 6)  # 6 bit int with all bits set to 1
+    channels = [(packed >> shift) & mask for shift in (12, 6, 0)]
+    return (np.stack(channels, axis=-1) << 2 | 2).astype(np.uint8)
+
+
+# number of different colors with 6 bit per channel
+_RGB_6BIT_SIZE = 1 << 18
@@ -1,6 +1,9 @@
 import argparse
 
+from white_brush import io
+from white_brush.colors.calc_colors import KMEANS_BACKENDS
 from white_brush.entities.enhancement_configuration import EnhancementConfiguration
+from white_brush.manifest import DEFAULT_MANIFEST_FILE, default_manifest_file
 
 
 class CommandParser:
@@ -45,8 +48,53 @@ class CommandParser:
                             help="Uses the given degree to rotate the target file clockwise. Degrees have to be divisible by 90.")
         parser.add_argument("-ccw", "--counterclockwise",
                             help="Uses the given degree to rotate the target file counterclockwise. Degrees have to be divisible by 90.")
+        parser.add_argument("-p", "--palette", action="append",
+                            help="Snaps the foreground to the nearest of the given HTML Color codes. Repeat it for "
+                                 "each color of the palette, e.g. -p black -p blue -p red.")
         parser.add_argument("-t", "--template",
-                            help="Uses the chosen template color codes for conversion. Templates: whiteboard, blackboard, note.")
+                            help="Uses the chosen template color codes for conversion. Templates: whiteboard, blackboard, note, markers.")
+        parser.add_argument("--full-resolution",
+                            help="Keeps the resolution of large input files instead of downscaling them.",
+                            action="store_true")
+        parser.add_argument("-i", "--incremental",
+                            help="Skips files whose output is up to date, based on the manifest of previous runs. "
+                                 "Default manifest: " + DEFAULT_MANIFEST_FILE + " in the directory containing all "
+                                 "input files.",
+                            action="store_true")
+        parser.add_argument("--manifest",
+                            help="Uses the given file as manifest for incremental runs. Implies --incremental.")
+        parser.add_argument("--cache",
+                            help="Stores enhanced images in the given directory and reuses them for inputs with the "
+                                 "same content and configuration.")
+        parser.add_argument("--cache-size", type=int,
+                            help="Maximum size of the --cache directory in megabytes. Default: 1024")
+        parser.add_argument("-j", "--jobs", type=int,
+                            help="Enhances up to the given number of files in parallel worker processes.")
+        parser.add_argument("--timings",
+                            help="Appends the time each stage of the enhancement took to the given file, one JSON "
+                                 "line per enhanced file.")
+        parser.add_argument("--shared-palette", type=int, metavar="N",
+                            help="Fits one palette of foreground colors to the first N files and colors all files "
+                                 "with it, which is faster and keeps the colors of the pages of a batch consistent.")
+        parser.add_argument("--indexed",
+                            help="Writes PNG files with a palette of the few colors of the enhanced images, which "
+                                 "are several times smaller than RGB PNG files.",
+                            action="store_true")
+        parser.add_argument("--png-compression", type=int, metavar="LEVEL",
+                            help="Compression level 0 - 9 of PNG files. Higher levels give smaller files, but take "
+                                 "longer to write.")
+        parser.add_argument("--png-strategy", choices=list(io.PNG_STRATEGIES),
+                            help="Compression strategy of PNG files.")
+        parser.add_argument("--jpeg-quality", type=int, metavar="QUALITY",
+                            help="Quality 0 - 100 of JPEG files.")
+        parser.add_argument("--webp-quality", type=int, metavar="QUALITY",
+                            help="Quality 1 - 100 of WebP files, above 100 they are compressed lossless.")
+        parser.add_argument("--write-threads", type=int, metavar="N",
+                            help="Writes the enhanced images on N background threads while the next files are "
+                                 "enhanced. Ignored with --jobs, whose workers enhance other files meanwhile.")
+        parser.add_argument("--kmeans-backend", choices=KMEANS_BACKENDS,
+                            help="Implementation of k-means which fits the foreground colors. Default: numpy, "
+                                 "sklearn needs scikit-learn to be installed.")
 
         args, unknown_args = parser.parse_known_args()
 
@@ -60,6 +108,41 @@ class CommandParser:
             enhancement_configuration.background_color = args.background
         if args.foreground:
             enhancement_configuration.foreground_color = args.foreground
+        if args.palette:
+            enhancement_configuration.foreground_palette = args.palette
+        if args.full_resolution:
+            enhancement_configuration.full_resolution = True
+        if args.incremental and unknown_args:
+            enhancement_configuration.manifest_file = default_manifest_file(unknown_args)
+        if args.manifest:
+            enhancement_configuration.manifest_file = args.manifest
+        if args.cache:
+            enhancement_configuration.cache_directory = args.cache
+        if args.cache_size:
+            enhancement_configuration.cache_size = args.cache_size * 1024 ** 2
+        if args.jobs:
+            enhancement_configuration.jobs = args.jobs
+        if args.timings:
+            enhancement_configuration.timings_file = args.timings
+        if args.shared_palette:
+            enhancement_configuration.shared_palette = args.shared_palette
+        if args.indexed:
+            enhancement_configuration.indexed = True
+        encoder_params = {}
+        if args.png_compression is not None:
+            encoder_params["png_compression"] = args.png_compression
+        if args.png_strategy:
+            encoder_params["png_strategy"] = io.PNG_STRATEGIES[args.png_strategy]
+        if args.jpeg_quality is not None:
+            encoder_params["jpeg_quality"] = args.jpeg_quality
+        if args.webp_quality is not None:
+            encoder_params["webp_quality"] = args.webp_quality
+        if encoder_params:
+            enhancement_configuration.encoder_params = encoder_params
+        if args.write_threads:
+            enhancement_configuration.write_threads = args.write_threads
+        if args.kmeans_backend:
+            enhancement_configuration.kmeans_backend = args.kmeans_backend
         if args.clockwise:
             self.rotation_command.execute(args.clockwise, False, enhancement_configuration)
         if args.counterclockwise:
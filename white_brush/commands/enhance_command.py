@@ -1,10 +1,24 @@
 import os
 import pathlib
+import pickle
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from itertools import chain, islice
 
+from white_brush import discovery
+from white_brush.cache import ResultCache
+from white_brush.io import ImageWriter
+from white_brush.manifest import Manifest
+from white_brush.profiling import TimingLog
 from white_brush.entities.color_configuration import ColorConfiguration
 from white_brush.entities.enhancement_configuration import \
     EnhancementConfiguration
 
+# pickled enhance service of the current worker process and the service
+# unpickled from it, see _enhance_in_worker
+_worker_service = (None, None)
+
 
 class EnhanceCommand:
     def __init__(self, file_enhance_service):
@@ -15,81 +29,387 @@ class EnhanceCommand:
             file_enhance_service: dependency
         """
         self.file_enhance_service = file_enhance_service
+        self.reserved_target_files = set()
+        self.manifest = None
+        self.fingerprint = None
 
     def execute(self, list_of_files,
                 enhance_configuration=EnhancementConfiguration()):
         """
         Executes the default command for the given file and directory parameters and additional configuration details.
 
+        A file which fails to enhance is reported, the remaining files are enhanced nevertheless.
+        If a manifest file is configured, files whose outputs are up to date are skipped and every
+        enhanced file is recorded in the manifest. With write threads, the enhanced images of a sequential
+        run are written in the background while the next files are enhanced. All options of the enhance service
+        are set from the given configuration, none of them is kept from a previous execution.
+
         Args:
             list_of_files: list of files and directories
             enhance_configuration: configuration values
         """
-        for file in list_of_files:
-            self.__enhance_file_or_directory__(file, 0, enhance_configuration)
+        self.reserved_target_files = set()
+        self.file_enhance_service.full_resolution = enhance_configuration.full_resolution
+        self.file_enhance_service.shared_palette = enhance_configuration.shared_palette
+        self.file_enhance_service.palette = None
+        self.file_enhance_service.indexed = enhance_configuration.indexed
+        self.file_enhance_service.encoder_params = enhance_configuration.encoder_params
+        self.file_enhance_service.kmeans_backend = enhance_configuration.kmeans_backend
+        # parallel jobs write their images themselves, meanwhile the other jobs enhance their files
+        writer = None
+        if enhance_configuration.write_threads > 0 and enhance_configuration.jobs <= 1:
+            writer = ImageWriter(enhance_configuration.write_threads)
+        self.file_enhance_service.writer = writer
+        # the service may be executed with several configurations, so options which are not configured are
+        # reset instead of being taken over from the previous execution
+        self.file_enhance_service.cache = None
+        if enhance_configuration.cache_directory is not None:
+            self.file_enhance_service.cache = ResultCache(enhance_configuration.cache_directory,
+                                                          enhance_configuration.cache_size)
+        self.file_enhance_service.timing_log = None
+        if enhance_configuration.timings_file is not None:
+            self.file_enhance_service.timing_log = TimingLog(enhance_configuration.timings_file)
+        if enhance_configuration.manifest_file is not None:
+            self.manifest = Manifest(enhance_configuration.manifest_file)
+
+        source_files = (source_file for file in list_of_files
+                        for source_file in self.__enhance_file_or_directory__(file, enhance_configuration))
+
+        try:
+            if enhance_configuration.shared_palette > 0 and enhance_configuration.foreground_color is None \
+                    and not enhance_configuration.foreground_palette:
+                source_files = self.__fit_shared_palette__(source_files, enhance_configuration)
+            if self.manifest is not None:
+                # the shared palette changes the enhanced images, so the fingerprint is calculated once it is fitted
+                self.fingerprint = self.file_enhance_service.fingerprint(
+                    enhance_configuration.rotation, self.__color_configuration__(enhance_configuration))
+
+            tasks = ((source_file, target_file) for source_file in source_files
+                     for target_file in self.__target_file__(source_file, enhance_configuration))
+
+            if enhance_configuration.jobs > 1:
+                self.__enhance_files_in_parallel__(tasks, enhance_configuration)
+                return
+
+            for source_file, target_file in tasks:
+                print("Enhancing '" + os.path.basename(
+                    source_file) + "' to '" + os.path.basename(target_file) + "'.")
+                try:
+                    write = self.__enhance_file__(source_file, target_file, enhance_configuration)
+                except Exception as error:
+                    self.__report_failure__(source_file, target_file, error)
+                else:
+                    if write is None:
+                        self.__record__(source_file, target_file)
+                    else:
+                        write.add_done_callback(partial(self.__written__, source_file, target_file))
+        finally:
+            if writer is not None:
+                # wait for the images which are still being written
+                writer.close()
+                self.file_enhance_service.writer = None
+            if self.manifest is not None:
+                self.manifest.close()
+                self.manifest = None
 
-    def __enhance_file_or_directory__(self, file, counter,
-                                      enhance_configuration):
+    def __enhance_file_or_directory__(self, file, enhance_configuration):
         """
-        Iterates the files and folders to match correct files which should be enhanced. Also increments file names and matches optional masks.
+        Iterates the files and folders to match correct files which should be enhanced.
+
+        Directories are walked lazily and only the image files within them are enhanced. Files which were
+        given explicitly are always enhanced.
 
         Args:
             file: file or directory
-            counter: subdirectory counter
             enhance_configuration: configuration
+
+        Returns:
+            Generator over the source files to enhance
         """
         if os.path.isdir(file):
-            if enhance_configuration.recursive or counter == 0:
-                for sub_file in os.listdir(file):
-                    self.__enhance_file_or_directory__(file + "/" + sub_file,
-                                                       counter + 1,
-                                                       enhance_configuration)
+            for image_file in discovery.iter_image_files(file, enhance_configuration.recursive):
+                # skip the target files written by this or previous executions
+                if os.path.abspath(image_file) in self.reserved_target_files:
+                    continue
+                if self.manifest is not None and self.manifest.is_output(image_file):
+                    continue
+                yield from self.__enhance_file_or_directory__(image_file, enhance_configuration)
+            return
+
+        if not os.path.exists(file):
+            print(
+                "Input '" + file + "' does not exist. whitebrush --help")
+            return
+
+        yield file
+
+    def __target_file__(self, file, enhance_configuration):
+        """
+        Finds the target file of the given source file, unless its output is up to date according to the manifest.
+        Also increments file names and matches optional masks.
+
+        Args:
+            file: source file
+            enhance_configuration: configuration
+
+        Returns:
+            Generator over the target file, empty if the source file is skipped
+        """
+        if self.manifest is not None and self.manifest.is_up_to_date(file, self.fingerprint):
+            print("Skipping '" + os.path.basename(file) + "', it is up to date.")
             return
 
         if enhance_configuration.replace_files:
-            self.__enhance_file__(file, file, enhance_configuration)
+            yield file
         else:
-            filename = pathlib.Path(file).stem
-            extension = pathlib.Path(file).suffix
+            target_file = None
+            if self.manifest is not None:
+                # overwrite the outdated output instead of creating a new one
+                target_file = self.manifest.previous_target(file)
+            if target_file is None:
+                target_file = self.__reserve_target_file__(file, enhance_configuration)
+            else:
+                self.reserved_target_files.add(os.path.abspath(target_file))
+            yield target_file
+
+    def __reserve_target_file__(self, file, enhance_configuration):
+        """
+        Finds the name of the target file for the given source file and reserves it for this execution.
+
+        Target files are only reserved here, before the files are handed to the enhance service, so no two
+        enhancements (not even ones running in parallel) are written to the same target file.
 
-            directory = os.path.dirname(file)
-            outfile_format = enhance_configuration.target_file_mask
+        Args:
+            file: source file
+            enhance_configuration: configuration
+
+        Returns:
+            The reserved target file
+        """
+        filename = pathlib.Path(file).stem
+        extension = pathlib.Path(file).suffix
+
+        directory = os.path.dirname(file)
+        outfile_format = enhance_configuration.target_file_mask
+        target_file = os.path.join(directory,
+                                   outfile_format.format(
+                                       name=filename,
+                                       extension=extension
+                                   ))
+        counter = 1
+        # if the output file already exists, append a number
+        # in parenthesis, e.g. img(01).jpg
+        while os.path.exists(target_file) or \
+                os.path.abspath(target_file) in self.reserved_target_files:
             target_file = os.path.join(directory,
                                        outfile_format.format(
                                            name=filename,
-                                           extension=extension
+                                           extension=f"({counter}){extension}"
                                        ))
-            counter = 1
-            # if the output file already exists, append a number
-            # in parenthesis, e.g. img(01).jpg
-            while os.path.exists(target_file):
-                target_file = os.path.join(directory,
-                                           outfile_format.format(
-                                               name=filename,
-                                               extension=f"({counter}){extension}"
-                                           ))
-                counter += 1
-
-            self.__enhance_file__(file, target_file, enhance_configuration)
+            counter += 1
+
+        self.reserved_target_files.add(os.path.abspath(target_file))
+        return target_file
+
+    def __fit_shared_palette__(self, source_files, enhance_configuration):
+        """
+        Fits the shared palette of the enhance service to the first of the given source files. If it cannot be
+        fitted, every file gets its own palette.
+
+        The palette is fitted to the first files even if their outputs are up to date, so an incremental run
+        over the same files fits the same palette and the fingerprints of its outputs stay the same.
+
+        Args:
+            source_files: iterable of source files
+            enhance_configuration: configuration
+
+        Returns:
+            Iterable over all of the given source files, including the ones the palette was fitted to
+        """
+        source_files = iter(source_files)
+        first_files = list(islice(source_files, enhance_configuration.shared_palette))
+        try:
+            self.file_enhance_service.fit_palette(first_files, enhance_configuration.rotation,
+                                                  self.__color_configuration__(enhance_configuration))
+        except Exception as error:
+            print("Failed to fit a shared palette: " + str(error))
+        return chain(first_files, source_files)
+
+    def __enhance_files_in_parallel__(self, tasks, enhance_configuration):
+        """
+        Enhances the given files in a pool of worker processes. Results are reported as soon as they finish.
+
+        If a worker process dies, e.g. because it runs out of memory, the pool is replaced and the files which
+        were in flight are enhanced again one by one, so only the file which kills its worker is reported as
+        failed.
+
+        Args:
+            tasks: iterable of (source_file, target_file) tuples
+            enhance_configuration: configuration
+        """
+        jobs = enhance_configuration.jobs
+        # only keep a bounded number of files in flight, so the files
+        # are discovered while the first ones are already enhanced
+        max_pending = 2 * jobs
+        pending = {}
+        # the service is pickled once and sent with every file, the workers only unpickle it once
+        submit = partial(self.__submit__, pickle.dumps(self.file_enhance_service), enhance_configuration)
+
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        try:
+            for source_file, target_file in tasks:
+                if len(pending) >= max_pending:
+                    self.__retry_crashed__(self.__collect_finished__(pending), submit)
+                try:
+                    future = submit(executor, source_file, target_file)
+                except BrokenProcessPool:
+                    # a worker died, the files in flight fail and are retried once they are collected
+                    executor.shutdown()
+                    executor = ProcessPoolExecutor(max_workers=jobs)
+                    future = submit(executor, source_file, target_file)
+                pending[future] = (source_file, target_file)
+
+            while pending:
+                self.__retry_crashed__(self.__collect_finished__(pending), submit)
+        finally:
+            executor.shutdown()
+
+    def __submit__(self, service, enhance_configuration, executor, source_file, target_file):
+        """
+        Submits the enhancement of a single file to the given pool of worker processes.
+
+        Args:
+            service: the pickled enhance service
+            enhance_configuration: configuration
+            executor: the pool of worker processes
+            source_file: source file
+            target_file: target file
+
+        Returns:
+            The future of the enhancement
+        """
+        return executor.submit(_enhance_in_worker, service, source_file, target_file,
+                               enhance_configuration.rotation, self.__color_configuration__(enhance_configuration))
+
+    def __collect_finished__(self, pending):
+        """
+        Waits until at least one of the pending enhancements is finished and reports all finished ones.
+
+        Args:
+            pending: dictionary of futures to their (source_file, target_file) tuples
+
+        Returns:
+            The (source_file, target_file) tuples of the finished enhancements whose worker process died
+        """
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        crashed = []
+        for future in done:
+            source_file, target_file = pending.pop(future)
+            if isinstance(future.exception(), BrokenProcessPool):
+                crashed.append((source_file, target_file))
+            else:
+                self.__report_result__(future, source_file, target_file)
+        return crashed
+
+    def __retry_crashed__(self, crashed, submit):
+        """
+        Enhances the given files, which were in flight when a worker process died, one by one in a new worker
+        process each. Only the files which kill their worker again are reported as failed.
+
+        Args:
+            crashed: list of (source_file, target_file) tuples
+            submit: submits a file to a pool of worker processes, see __submit__
+        """
+        for source_file, target_file in crashed:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                future = submit(executor, source_file, target_file)
+                wait([future])
+            self.__report_result__(future, source_file, target_file)
+
+    def __report_result__(self, future, source_file, target_file):
+        """
+        Reports a finished enhancement of a worker process and records it in the manifest if it succeeded.
+
+        Args:
+            future: the finished future of the enhancement
+            source_file: source file
+            target_file: target file
+        """
+        error = future.exception()
+        if error is not None:
+            self.__report_failure__(source_file, target_file, error)
+        else:
+            print("Enhanced '" + os.path.basename(
+                source_file) + "' to '" + os.path.basename(target_file) + "'.")
+            self.__record__(source_file, target_file)
+
+    def __written__(self, source_file, target_file, write):
+        """
+        Reports an enhanced image which was written in the background and records it in the manifest.
+
+        Args:
+            source_file: source file
+            target_file: target file
+            write: the finished future of the write
+        """
+        error = write.exception()
+        if error is not None:
+            self.__report_failure__(source_file, target_file, error)
+        else:
+            self.__record__(source_file, target_file)
+
+    def __record__(self, source_file, target_file):
+        """
+        Records a successfully enhanced file in the manifest, if there is one.
+
+        Args:
+            source_file: source file
+            target_file: target file
+        """
+        if self.manifest is not None:
+            self.manifest.record(source_file, target_file, self.fingerprint)
+
+    def __report_failure__(self, source_file, target_file, error):
+        """
+        Reports a file which could not be enhanced.
+
+        Args:
+            source_file: source file
+            target_file: target file
+            error: the error raised while enhancing
+        """
+        print("Failed to enhance '" + os.path.basename(source_file) + "': " + str(error))
 
     def __enhance_file__(self, source_file, target_file,
                          enhance_configuration):
         """
-        Enhances the given source file to the target_file if it exists.
+        Enhances the given source file to the target_file.
 
         Args:
             source_file: source file
             target_file:  target file
             enhance_configuration:  configuration
+
+        Returns:
+            The future of the write of the target file, or None if it was written already
         """
-        if not os.path.exists(source_file):
-            print(
-                "Input '" + source_file + "' does not exist. whitebrush --help")
-            return
+        return self.file_enhance_service.enhance_file(source_file, target_file, enhance_configuration.rotation,
+                                               self.__color_configuration__(enhance_configuration))
+
+    def __color_configuration__(self, enhance_configuration):
+        return ColorConfiguration(enhance_configuration.foreground_color,
+                                  enhance_configuration.background_color,
+                                  enhance_configuration.foreground_palette)
+
+
+def _enhance_in_worker(service, source_file, target_file, rotation, color_configuration):
+    """
+    Enhances a single file inside of a worker process with the given pickled enhance service.
 
-        print("Enhancing '" + os.path.basename(
-            source_file) + "' to '" + os.path.basename(target_file) + "'.")
-        self.file_enhance_service.enhance_file(source_file, target_file, enhance_configuration.rotation,
-                                               ColorConfiguration(
-                                                   enhance_configuration.foreground_color,
-                                                   enhance_configuration.background_color))
+    The service is only unpickled for the first file of an execution, all further files of the worker are
+    enhanced with the same service, so its workspace and palette are reused.
+    """
+    global _worker_service
+    if _worker_service[0] != service:
+        _worker_service = (service, pickle.loads(service))
+    _worker_service[1].enhance_file(source_file, target_file, rotation, color_configuration)
@@ -10,13 +10,16 @@ class TemplateCommand:
         self.default_templates = {
             "blackboard": ("#FFFFFF", "#00471C"),
             "whiteboard": ("#000000", "#FFFFFF"),
-            "note": ("#040b33", "#F7EA5E")
+            "note": ("#040b33", "#F7EA5E"),
+            # the foreground is snapped to the usual whiteboard marker colors
+            "markers": (None, "#FFFFFF", ("#000000", "#1F3FB2", "#C62828", "#2E7D32"))
         }
 
         self.aliases = {
             "bw": "whiteboard",
             "blackwhite": "whiteboard",
-            "postit": "note"
+            "postit": "note",
+            "marker": "markers"
         }
 
     def execute(self, template: str,
@@ -37,3 +40,5 @@ class TemplateCommand:
             template_data = self.default_templates[template]
             enhance_configuration.foreground_color = template_data[0]
             enhance_configuration.background_color = template_data[1]
+            enhance_configuration.foreground_palette = \
+                list(template_data[2]) if len(template_data) > 2 else None
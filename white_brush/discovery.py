@@ -0,0 +1,80 @@
+import os
+from typing import Iterator
+
+# file extensions of the image formats which can be read by io.read_image
+IMAGE_EXTENSIONS = {
+    ".bmp", ".dib", ".jpeg", ".jpg", ".jpe", ".jp2", ".png", ".webp",
+    ".pbm", ".pgm", ".ppm", ".pnm", ".tiff", ".tif"
+}
+
+# leading bytes of the supported image formats
+_MAGIC_BYTES = (
+    b"\x89PNG\r\n\x1a\n",  # png
+    b"\xff\xd8\xff",  # jpeg
+    b"BM",  # bmp
+    b"II*\x00",  # tiff, little endian
+    b"MM\x00*",  # tiff, big endian
+    b"\x00\x00\x00\x0cjP  \r\n\x87\n",  # jpeg 2000
+    b"P1", b"P2", b"P3", b"P4", b"P5", b"P6"  # portable any map
+)
+_MAGIC_LENGTH = max(len(magic) for magic in _MAGIC_BYTES)
+
+
+def iter_image_files(directory: str, recursive: bool = False) -> Iterator[str]:
+    """
+    Iterate over the image files in a directory
+
+    The directory is walked lazily with `os.scandir`, so the first
+    images are returned right away, even for directories containing
+    millions of entries. Files which are not images (checked by their
+    extension and their first bytes) are skipped without reading them
+    completely.
+
+    Usage example:
+    >>> for file in iter_image_files("test_images"):
+    >>>    print(file)
+
+    Args:
+        directory: The directory to search for images
+        recursive: Flag which indicates whether images in sub
+            directories should be returned as well
+
+    Returns:
+        Generator over the paths of all images in the directory
+    """
+    directories = [directory]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if recursive:
+                        directories.append(entry.path)
+                elif is_image_file(entry.path):
+                    yield entry.path
+
+
+def is_image_file(file: str) -> bool:
+    """
+    Check whether the given file is an image which can be enhanced
+
+    Only the extension and the first few bytes of the file are checked,
+    the image is not decoded.
+
+    Args:
+        file: Path to the file to check
+
+    Returns:
+        True if the file is an image, otherwise False
+    """
+    if os.path.splitext(file)[1].lower() not in IMAGE_EXTENSIONS:
+        return False
+
+    try:
+        with open(file, "rb") as f:
+            header = f.read(_MAGIC_LENGTH)
+    except OSError:
+        return False
+
+    if header.startswith(b"RIFF") and header[8:12] == b"WEBP":
+        return True
+    return header.startswith(_MAGIC_BYTES)
@@ -1,29 +1,149 @@
+from functools import lru_cache
+
+import cv2
 import numpy as np
 
 from white_brush.colors.color_balance import balance_color
 from white_brush.colors.color_extraction import hsv_distance_threshold, \
     adaptive_threshold, eroded_background_difference_threshold, \
-    background_difference_image, otsu_threshold
-from white_brush.colors.conversion import mask_to_rgb, \
-    mask_to_rgb_with_fg_colors_from_image
+    background_difference_image, otsu_threshold, estimate_background, \
+    _adaptive_threshold_dark_foreground, _background_difference, \
+    _otsu_threshold_gray_mask
+from white_brush.colors.calc_colors import Palette
+from white_brush.colors.conversion import mask_to_indexed, \
+    mask_to_indexed_with_fg_colors_from_image, \
+    mask_to_indexed_with_palette, rgb_to_gray
 from white_brush.colors.crop_and_rotate import rotate
-from white_brush.colors.morphology import dilate, erode, smooth
-from white_brush.colors.utils import parse_color
+from white_brush.colors.statistics import ImageStatistics
+from white_brush.colors.morphology import dilate, erode, smooth, \
+    to_bool_mask, to_gray_mask
+from white_brush.colors.utils import parse_color, _generate_bitmask
 from white_brush.entities.color_configuration import ColorConfiguration
+from white_brush.entities.indexed_image import IndexedImage
+from white_brush.profiling import timed
+from white_brush.stage_graph import StageGraph
 from white_brush.transform import resize_if
+from white_brush.workspace import Workspace
+
+# images are processed with this size (the larger dimension of width /
+# height), if they are larger than MAX_WORKING_SIZE
+WORKING_SIZE = 1000
+MAX_WORKING_SIZE = 1500
+# large images may be decoded at a reduced size, as long as they are still
+# larger than MAX_WORKING_SIZE, so they are resized to WORKING_SIZE like
+# the image decoded at full size
+REDUCED_READ_SIZE = MAX_WORKING_SIZE + 1
+
+# masks which are combined to the foreground mask by default, see
+# ImageEnhancer._intermediates for all available masks
+FOREGROUND_STAGES = ("background_difference_mask", "adaptive_threshold")
 
 
 class ImageEnhancer:
-    def __init__(self, color_config: ColorConfiguration, rotation: int):
+    def __init__(self, color_config: ColorConfiguration, rotation: int,
+                 full_resolution: bool = False, stage_hook=None,
+                 workspace: Workspace = None,
+                 foreground_stages=FOREGROUND_STAGES,
+                 smooth_kernel_size: int = None, palette: Palette = None,
+                 indexed: bool = False, kmeans_backend: str = "numpy"):
+        """
+        Creates a new ImageEnhancer.
+
+        Args:
+            color_config: The colors of the enhanced images
+            rotation: Degrees by which the images are rotated
+            full_resolution: Flag which indicates whether the enhanced
+                images keep the resolution of the input images. The
+                foreground is still extracted at the working resolution
+                and only refined at the full resolution, so this costs
+                little more than enhancing at the working resolution.
+            stage_hook: Optional callable which receives a
+                `white_brush.profiling.StageTiming` for every executed
+                stage and sub step of the enhancement. Without a hook
+                the stages are not measured at all.
+            workspace: Optional pool of buffers for the intermediate
+                images. If the same workspace is used for many images of
+                the same size, the buffers are allocated only once. The
+                enhanced images are always newly allocated.
+            foreground_stages: Names of the masks which are combined to
+                the foreground mask, a pixel is part of the foreground if
+                it is part of the foreground in all of them. Available
+                are 'background_difference_mask', 'adaptive_threshold'
+                and 'hsv_distance_threshold'.
+            smooth_kernel_size: If given, the foreground mask is
+                smoothed with this kernel size, see `smooth`
+            palette: Optional palette of foreground colors, e.g. one
+                shared by all pages of a batch, see `foreground_colors`.
+                If it is given and the color configuration has neither
+                a foreground color nor a foreground palette, the
+                foreground is colored with it instead of a palette
+                calculated for each image.
+            indexed: Flag which indicates whether the enhanced images
+                are returned as `IndexedImage`, the index of the color
+                of each pixel plus the few colors of the image, instead
+                of RGB images
+            kmeans_backend: The k-means implementation which fits the
+                palette of each image, one of
+                `white_brush.colors.calc_colors.KMEANS_BACKENDS`
+        """
+        assert len(foreground_stages) > 0
         self.color_config = color_config
         self.rotation = rotation
+        self.full_resolution = full_resolution
+        self.stage_hook = stage_hook
+        self.workspace = workspace
+        self.foreground_stages = tuple(foreground_stages)
+        self.smooth_kernel_size = smooth_kernel_size
+        self.palette = palette
+        self.indexed = indexed
+        self.kmeans_backend = kmeans_backend
+
+    def enhance(self, img: np.ndarray):
+        if self.full_resolution:
+            out_img = self._enhance_full_resolution(img)
+        else:
+            img = self._timed("transform", self._transform, img)
+            preprocessed_img = self._timed("preprocess", self._preprocess,
+                                           img)
+            foreground_mask = self._timed("extract_foreground",
+                                          self._extract_foreground,
+                                          preprocessed_img)
+            out_img = self._timed("apply_colors", self._apply_colors,
+                                  foreground_mask, img, preprocessed_img)
+        if self.indexed:
+            return out_img
+        return self._timed("apply_colors.to_rgb", out_img.to_rgb)
+
+    def foreground_colors(self, img: np.ndarray) -> np.ndarray:
+        """
+        Extract the colors of the foreground of the given image, which
+        can be pooled over many images to fit a shared palette, see
+        `Palette.fit`
+
+        Args:
+            img: Input image in RGB, shape (X, Y, 3)
 
-    def enhance(self, img: np.ndarray) -> np.ndarray:
+        Returns:
+            The preprocessed foreground colors of shape (N, 3), reduced
+            to 6 bit per channel like the colors a palette is fitted to
+        """
         img = self._transform(img)
         preprocessed_img = self._preprocess(img)
-        foreground_mask = self._extract_foreground(preprocessed_img)
-        out_img = self._apply_colors(foreground_mask, img, preprocessed_img)
-        return out_img
+        colors = preprocessed_img[self._extract_foreground(preprocessed_img)]
+        colors &= _generate_bitmask(2, 8)
+        return colors
+
+    def _timed(self, stage, func, *args, **kwargs):
+        return timed(self.stage_hook, stage, func, *args, **kwargs)
+
+    def _buffer(self, name, shape, dtype=np.uint8):
+        """
+        Returns a buffer of the workspace, or None if there is no
+        workspace, so the stages allocate their results themselves
+        """
+        if self.workspace is None:
+            return None
+        return self.workspace.buffer(name, shape, dtype)
 
     def _transform(self, img: np.ndarray) -> np.ndarray:
         """
@@ -33,7 +153,95 @@ class ImageEnhancer:
         height)
         """
         img = rotate(img, self.rotation)
-        return resize_if(img, 1000, 1500)
+        return resize_if(img, WORKING_SIZE, MAX_WORKING_SIZE)
+
+    def _enhance_full_resolution(self, img: np.ndarray) -> IndexedImage:
+        """
+        Enhance the image, but output it at the resolution of the input
+
+        The foreground mask and the foreground colors are calculated at
+        the working resolution, the mask is then upsampled, refined
+        around the edges of the strokes and colored at full resolution.
+        """
+        full_img = self._timed("transform.rotate", rotate, img,
+                               self.rotation)
+        img = self._timed("transform.resize", resize_if, full_img,
+                          WORKING_SIZE, MAX_WORKING_SIZE)
+        preprocessed_img = self._timed("preprocess", self._preprocess, img)
+        intermediates = self._intermediates(preprocessed_img)
+        foreground_mask = self._timed("extract_foreground",
+                                      self._extract_foreground,
+                                      preprocessed_img, intermediates)
+        if img is full_img:
+            return self._timed("apply_colors", self._apply_colors,
+                               foreground_mask, img, preprocessed_img)
+
+        full_preprocessed_img = self._timed("preprocess.full_resolution",
+                                            self._preprocess, full_img)
+        full_foreground_mask = self._timed(
+            "upsample_foreground", self._upsample_foreground,
+            foreground_mask, intermediates, full_preprocessed_img)
+
+        if self.color_config.foreground_color is None:
+            palette = self._foreground_palette()
+            if palette is None:
+                # calculate the representative colors at working
+                # resolution
+                colors = preprocessed_img[foreground_mask]
+                colors &= _generate_bitmask(2, 8)
+                palette = self._timed("apply_colors.palette", Palette.fit,
+                                      colors, backend=self.kmeans_backend)
+            return self._timed("apply_colors.assign",
+                               mask_to_indexed_with_palette,
+                               full_foreground_mask,
+                               self._background_color(),
+                               full_preprocessed_img, palette)
+        return self._timed("apply_colors", self._apply_colors,
+                           full_foreground_mask, full_img,
+                           full_preprocessed_img)
+
+    def _upsample_foreground(self, foreground_mask: np.ndarray,
+                             intermediates: StageGraph,
+                             full_img: np.ndarray) -> np.ndarray:
+        """
+        Upsample a foreground mask to the size of the full resolution
+        image
+
+        Pixels far from the edges of the strokes keep the value of the
+        mask. In a narrow band around the edges, where the upsampled
+        mask is ambiguous, each pixel of the full resolution image is
+        compared with the local mean around it, like in the adaptive
+        thresholding of _extract_foreground.
+
+        Args:
+            foreground_mask: Foreground mask returned from
+                _extract_foreground
+            intermediates: The intermediates of the foreground
+                extraction at working resolution
+            full_img: The preprocessed image at full resolution
+
+        Returns:
+            The foreground mask at full resolution
+        """
+        size = (full_img.shape[1], full_img.shape[0])
+        # bilinear upsampling keeps 0 and 255 away from the edges, the
+        # values in between form the band around the edges
+        upsampled = cv2.resize(foreground_mask.astype(np.uint8) * 255, size,
+                               interpolation=cv2.INTER_LINEAR)
+        full_foreground_mask = upsampled >= 128
+        band = (upsampled > 0) & (upsampled < 255)
+
+        gray = intermediates["gray"]
+        full_gray = rgb_to_gray(full_img)[band].astype(np.int16)
+        local_mean = cv2.resize(cv2.blur(gray, (31, 31)), size,
+                                interpolation=cv2.INTER_LINEAR)[band]
+        # same orientation as in adaptive_threshold: if the background
+        # is dark, the foreground is brighter than its surrounding
+        if intermediates["median"] < 100:
+            full_foreground_mask[band] = full_gray >= local_mean + 10
+        else:
+            full_foreground_mask[band] = full_gray <= local_mean - 10
+        return full_foreground_mask
 
     def _preprocess(self, img: np.ndarray) -> np.ndarray:
         """
@@ -43,14 +251,17 @@ class ImageEnhancer:
 
         - Perform an automatic color balancing
         """
-        return balance_color(img)
+        return balance_color(img, dst=self._buffer("preprocessed", img.shape))
 
-    def _extract_foreground(self, img: np.ndarray) -> np.ndarray:
+    def _extract_foreground(self, img: np.ndarray,
+                            intermediates: StageGraph = None) -> np.ndarray:
         """
         Steps done to extract the foreground and background of an image
 
         Args:
             img: Input image in RGB, shape (X, Y, 3)
+            intermediates: The intermediates of the image, if they were
+                already created, see _intermediates
 
         Returns:
             The calculated foreground mask. If an element in the mask
@@ -58,17 +269,90 @@ class ImageEnhancer:
             of the background. If it is True, the pixel is part of the
             foreground.
         """
-        adaptive_thresh = adaptive_threshold(img, 31, 10)
-        bg_diff = background_difference_image(img)
-        bg_diff2 = (255 - np.clip((255 - bg_diff.astype(np.int)) * 2, 0,
-                                  255)).astype(np.uint8)
-        otsu = otsu_threshold(bg_diff2)
-        result = dilate(otsu, 3) & adaptive_thresh
-        return result
+        if intermediates is None:
+            intermediates = self._intermediates(img)
+        return intermediates["foreground_mask"]
+
+    def _intermediates(self, img: np.ndarray) -> StageGraph:
+        """
+        Creates the graph of the intermediates of the foreground
+        extraction of the given preprocessed image
+
+        Each intermediate is computed at most once, and only if the
+        foreground mask (or another intermediate which is asked for)
+        depends on it. The masks are kept as uint8 images with the
+        foreground 255, only the final foreground mask is boolean.
+
+        Args:
+            img: Preprocessed image in RGB, shape (X, Y, 3)
+
+        Returns:
+            The graph, the foreground mask is its 'foreground_mask'
+        """
+        size = img.shape[:2]
+
+        def buffer(name, dtype=np.uint8):
+            return self._buffer(name, size, dtype)
+
+        stages = {
+            "gray": lambda g: cv2.cvtColor(g["image"], cv2.COLOR_RGB2GRAY,
+                                           dst=buffer("gray")),
+            "statistics": lambda g: ImageStatistics.of(g["gray"]),
+            "median": lambda g: g["statistics"].median,
+            "inverted_gray": lambda g: cv2.bitwise_not(
+                g["gray"], dst=buffer("inverted_gray")),
+            # the background difference needs a black background, the
+            # adaptive thresholding a white one
+            "dark_background_gray": lambda g: (
+                g["inverted_gray"] if g["median"] > 80 else g["gray"]),
+            "light_background_gray": lambda g: (
+                g["inverted_gray"] if g["median"] < 100 else g["gray"]),
+            "background": lambda g: estimate_background(
+                g["dark_background_gray"]),
+            "background_difference": lambda g: _background_difference(
+                g["dark_background_gray"], g["background"],
+                dst=buffer("background_difference")),
+            "contrast": lambda g: _stretch_background_difference(
+                g["background_difference"], dst=buffer("contrast")),
+            "contrast_statistics": lambda g: ImageStatistics.of(
+                g["contrast"]),
+            "otsu_threshold": lambda g: _otsu_threshold_gray_mask(
+                g["contrast"], dst=buffer("otsu_threshold"),
+                stats=g["contrast_statistics"]),
+            "background_difference_mask": lambda g: dilate(
+                g["otsu_threshold"], 3,
+                dst=buffer("background_difference_mask")),
+            "adaptive_threshold": lambda g: (
+                _adaptive_threshold_dark_foreground(
+                    g["light_background_gray"], 31, 10,
+                    dst=buffer("adaptive_threshold"))),
+            "hsv_distance_threshold": lambda g: to_gray_mask(
+                hsv_distance_threshold(g["image"])),
+            "foreground": lambda g: self._combine_foreground_masks(
+                [g[name] for name in self.foreground_stages],
+                buffer("foreground")),
+            "foreground_mask": lambda g: to_bool_mask(
+                g["foreground"], buffer("foreground_mask", np.bool)),
+        }
+        return StageGraph(stages, {"image": img}, self.stage_hook,
+                          prefix="extract_foreground.")
+
+    def _combine_foreground_masks(self, masks, dst=None) -> np.ndarray:
+        """
+        Combine the given uint8 masks to the foreground mask, which is
+        smoothed if a smooth_kernel_size is configured
+        """
+        # a single mask combined with itself is just copied
+        foreground = cv2.bitwise_and(masks[0], masks[-1], dst=dst)
+        for mask in masks[1:-1]:
+            cv2.bitwise_and(foreground, mask, dst=foreground)
+        if self.smooth_kernel_size is not None:
+            foreground = smooth(foreground, self.smooth_kernel_size)
+        return foreground
 
     def _apply_colors(self, foreground_mask: np.ndarray,
                       orig_img: np.ndarray,
-                      preprocessed_img: np.ndarray) -> np.ndarray:
+                      preprocessed_img: np.ndarray) -> IndexedImage:
         """
         Steps done to apply colors to the extracted foreground mask
 
@@ -79,22 +363,78 @@ class ImageEnhancer:
                 where the mask was calculated from
             preprocessed_img: The preprocessed image
         Returns:
-            An RGB image with colors inserted into the given foreground
-            mask based on the color config
+            An indexed image with colors inserted into the given
+            foreground mask based on the color config
         """
-        if self.color_config.background_color is None:
-            bg_color = (255, 255, 255)
-        else:
-            bg_color = parse_color(self.color_config.background_color)
+        bg_color = self._background_color()
         if self.color_config.foreground_color is None:
-            return mask_to_rgb_with_fg_colors_from_image(foreground_mask,
-                                                         bg_color,
-                                                         preprocessed_img)
+            palette = self._foreground_palette()
+            if palette is not None:
+                return mask_to_indexed_with_palette(
+                    foreground_mask, bg_color, preprocessed_img, palette)
+            return mask_to_indexed_with_fg_colors_from_image(
+                foreground_mask, bg_color, preprocessed_img,
+                self.kmeans_backend)
         else:
             fg_color = parse_color(self.color_config.foreground_color)
-            return mask_to_rgb(foreground_mask, bg_color=bg_color,
-                               fg_color=fg_color)
+            return mask_to_indexed(foreground_mask, bg_color=bg_color,
+                                   fg_color=fg_color)
+
+    def _foreground_palette(self):
+        """
+        The palette the foreground is snapped to: the fixed palette of
+        the color configuration, or else the given (shared) palette.
+        None if a palette is fitted to each image.
+        """
+        if self.color_config.foreground_palette:
+            return _fixed_palette(tuple(self.color_config.foreground_palette))
+        return self.palette
+
+    def _background_color(self):
+        if self.color_config.background_color is None:
+            return 255, 255, 255
+        return parse_color(self.color_config.background_color)
+
+
+@lru_cache(maxsize=8)
+def _fixed_palette(colors) -> Palette:
+    """
+    Creates the palette of the given color texts, which snaps each color
+    to the nearest of them. The palette and its lookup table are kept
+    for all images with the same colors.
+    """
+    rgb_colors = []
+    for color in colors:
+        rgb = parse_color(color)
+        if rgb is None:
+            raise ValueError(f"'{color}' is not a valid palette color.")
+        rgb_colors.append(rgb)
+    return Palette(rgb_colors, rgb_colors)
+
+
+def _stretch_background_difference(bg_diff: np.ndarray,
+                                   dst: np.ndarray = None) -> np.ndarray:
+    """
+    Double the contrast of a background difference image, so small
+    differences to the background are separated better
+
+    Same as `255 - clip((255 - bg_diff) * 2, 0, 255)`, but with
+    saturating uint8 arithmetic instead of a wider integer copy. The
+    result is written to dst, which may also be bg_diff itself.
+    """
+    inverted = cv2.bitwise_not(bg_diff, dst=dst)
+    cv2.add(inverted, inverted, dst=inverted)
+    return cv2.bitwise_not(inverted, dst=inverted)
 
 
-def enhance(img: np.ndarray, config: ColorConfiguration, rotation: int = 0) -> np.ndarray:
-    return ImageEnhancer(config, rotation).enhance(img)
+def enhance(img: np.ndarray, config: ColorConfiguration, rotation: int = 0,
+            full_resolution: bool = False, stage_hook=None,
+            workspace: Workspace = None,
+            foreground_stages=FOREGROUND_STAGES,
+            smooth_kernel_size: int = None,
+            palette: Palette = None, indexed: bool = False,
+            kmeans_backend: str = "numpy"):
+    return ImageEnhancer(config, rotation, full_resolution, stage_hook,
+                         workspace, foreground_stages,
+                         smooth_kernel_size, palette, indexed,
+                         kmeans_backend).enhance(img)
@@ -1,6 +1,7 @@
 class ColorConfiguration:
 
     def __init__(self, foreground_color=None,
-                 background_color=None):
+                 background_color=None, foreground_palette=None):
         self.foreground_color = foreground_color
         self.background_color = background_color
+        self.foreground_palette = foreground_palette
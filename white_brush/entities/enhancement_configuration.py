@@ -1,10 +1,26 @@
 class EnhancementConfiguration:
 
     def __init__(self, recursive=False, replace_files=False, masked="{name}_brushed{extension}",
-                 foreground_color=None, background_color=None, rotation=0):
+                 foreground_color=None, background_color=None, rotation=0, jobs=1,
+                 manifest_file=None, cache_directory=None, cache_size=1024 ** 3,
+                 full_resolution=False, timings_file=None, shared_palette=0,
+                 foreground_palette=None, indexed=False, encoder_params=None, write_threads=0,
+                 kmeans_backend="numpy"):
         self.recursive = recursive
         self.replace_files = replace_files
         self.target_file_mask = masked
         self.rotation = rotation
         self.foreground_color = foreground_color
         self.background_color = background_color
+        self.jobs = jobs
+        self.manifest_file = manifest_file
+        self.cache_directory = cache_directory
+        self.cache_size = cache_size
+        self.full_resolution = full_resolution
+        self.timings_file = timings_file
+        self.shared_palette = shared_palette
+        self.foreground_palette = foreground_palette
+        self.indexed = indexed
+        self.encoder_params = encoder_params
+        self.write_threads = write_threads
+        self.kmeans_backend = kmeans_backend
@@ -0,0 +1,34 @@
+import numpy as np
+
+
+class IndexedImage:
+
+    def __init__(self, labels, palette):
+        """
+        Creates a new IndexedImage, an image whose pixels are indices
+        into a palette of colors.
+
+        Args:
+            labels: The index of the color of each pixel, of shape
+                (X, Y) and dtype uint8
+            palette: The RGB colors of shape (N, 3), at most 256
+        """
+        self.labels = np.asarray(labels, np.uint8)
+        self.palette = np.asarray(palette, np.uint8).reshape(-1, 3)
+        assert 0 < len(self.palette) <= 256
+
+    @property
+    def shape(self):
+        """
+        The shape of the RGB image, (X, Y, 3)
+        """
+        return self.labels.shape + (3,)
+
+    def to_rgb(self) -> np.ndarray:
+        """
+        Look up the color of each pixel.
+
+        Returns:
+            RGB Image of shape (X, Y, 3)
+        """
+        return np.take(self.palette, self.labels, axis=0)
@@ -1,22 +1,75 @@
 import cv2
+import mmap
 import numpy as np
 import os
+import struct
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 
+from white_brush.entities.indexed_image import IndexedImage
+from white_brush.profiling import timed
 
-def read_image(filename: str):
+# flags for reading an image reduced by a factor of 8, 4 or 2
+_REDUCED_READ_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                       (4, cv2.IMREAD_REDUCED_COLOR_4),
+                       (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# bit depths of palette PNGs, the smallest one with enough colors is used
+_PNG_BIT_DEPTHS = (1, 2, 4, 8)
+# zlib level of palette PNGs, higher levels are much slower for little
+# smaller files
+_PNG_COMPRESSION_LEVEL = 6
+
+# names of the encoder parameters which can be given to write_image
+ENCODER_PARAMS = {
+    # zlib level 0 - 9, higher levels give smaller files but take longer
+    "png_compression": cv2.IMWRITE_PNG_COMPRESSION,
+    # zlib strategy, one of the values of PNG_STRATEGIES
+    "png_strategy": cv2.IMWRITE_PNG_STRATEGY,
+    # quality 0 - 100
+    "jpeg_quality": cv2.IMWRITE_JPEG_QUALITY,
+    # quality 1 - 100, above 100 the image is compressed lossless
+    "webp_quality": cv2.IMWRITE_WEBP_QUALITY
+}
+
+# zlib strategies of PNG images, OpenCV uses the same values as zlib
+PNG_STRATEGIES = {
+    "default": cv2.IMWRITE_PNG_STRATEGY_DEFAULT,
+    "filtered": cv2.IMWRITE_PNG_STRATEGY_FILTERED,
+    "huffman_only": cv2.IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY,
+    "rle": cv2.IMWRITE_PNG_STRATEGY_RLE,
+    "fixed": cv2.IMWRITE_PNG_STRATEGY_FIXED
+}
+
+
+def read_image(filename: str, target_size: int = None):
     """
     Read an image from disk
 
     Read an image from disk and return it as matrix of size
     (width, height, 3) in the RGB Format.
 
+    If a target_size is given, a JPEG image may be decoded at a reduced
+    size (by a factor of 2, 4 or 8), as long as the larger dimension of
+    width / height stays at least target_size. This is a lot faster
+    than decoding the full image and resizing it later on. Other formats
+    are always decoded at full size, OpenCV would only downscale them
+    after decoding, with an interpolation which loses thin strokes.
+
     Args:
         filename: The image file to read
+        target_size: The minimum size of the image which is needed
 
     Returns: Three dimensional numpy array.
 
     """
-    img = cv2.imread(filename)
+    flags = cv2.IMREAD_COLOR
+    if target_size is not None:
+        flags = _reduced_read_flag(_image_size(filename, jpeg_only=True), target_size)
+    img = cv2.imread(filename, flags)
 
     if img is None:
         if os.path.exists(filename):
@@ -27,7 +80,69 @@ def read_image(filename: str):
     return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
 
-def write_image(file_name: str, img: np.ndarray):
+def decode_image(data, target_size: int = None):
+    """
+    Decode an image from the content of an image file
+
+    Like `read_image`, but for an image which is already in memory,
+    e.g. the body of an HTTP request. The data is decoded where it is,
+    without copying it, so memory-mapped files (see `map_file`) are
+    decoded without reading them into a bytes object first.
+
+    Args:
+        data: The encoded image, any bytes-like object, e.g. bytes,
+            memoryview or mmap
+        target_size: The minimum size of the image which is needed, see
+            `read_image`
+
+    Returns: Three dimensional numpy array.
+
+    """
+    flags = cv2.IMREAD_COLOR
+    if target_size is not None:
+        flags = _reduced_read_flag(_encoded_image_size(data, jpeg_only=True), target_size)
+    buffer = np.frombuffer(data, np.uint8)
+    try:
+        img = cv2.imdecode(buffer, flags) if buffer.size > 0 else None
+    except cv2.error as error:
+        # e.g. a header with a size larger than OpenCV accepts
+        raise ValueError("The data is not a valid image.") from error
+    finally:
+        # release the buffer, so a memory-mapped file can be closed,
+        # even if decoding failed
+        del buffer
+
+    if img is None:
+        raise ValueError("The data is not a valid image.")
+
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+@contextmanager
+def map_file(filename: str):
+    """
+    Map the content of a file into memory, read-only
+
+    The pages of the file are only read once they are accessed, e.g. by
+    `decode_image` or by hashing the content, and are shared with the
+    page cache instead of being copied into a bytes object.
+
+    Args:
+        filename: The file to map
+
+    Returns: Context manager of the mapped content, a bytes-like object.
+        Empty files are mapped to empty bytes.
+    """
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # empty files can't be mapped
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def write_image(file_name: str, img, params: dict = None):
     """
     Write an image to disk
 
@@ -37,12 +152,266 @@ def write_image(file_name: str, img: np.ndarray):
         file_name: The name of the image file that will be created
             If the specified file is within a directory which does not
             exist, that directory will be created
-        img: The image to write, in RGB Format
+        img: The image to write, in RGB Format, or an IndexedImage.
+            Indexed images are written as palette PNG with 1, 2, 4 or
+            8 bit per pixel, depending on the number of colors. For
+            other formats than PNG they are converted to RGB.
+        params: Optional encoder parameters, a dictionary of names of
+            ENCODER_PARAMS to their values, e.g.
+            `{"png_compression": 1, "jpeg_quality": 90}`. Parameters of
+            other formats than the one of the file are ignored.
     """
 
+    # encode the image before the file is created, so no incomplete
+    # file is left behind if the image can't be encoded
+    data = encode_image(img, os.path.splitext(file_name)[1], params)
+
     dirs = os.path.dirname(file_name)
     if len(dirs) > 0:
         os.makedirs(dirs, exist_ok=True)
 
+    with open(file_name, "wb") as f:
+        f.write(data)
+
+
+def encode_image(img, extension: str, params: dict = None) -> bytes:
+    """
+    Encode an image to the content of an image file
+
+    Like `write_image`, but the encoded image is returned instead of
+    written to disk.
+
+    Args:
+        img: The image to encode, in RGB Format, or an IndexedImage
+        extension: The extension of the format, e.g. '.png' or '.jpg'
+        params: Optional encoder parameters, see `write_image`
+
+    Returns:
+        The content of the image file
+    """
+    if isinstance(img, IndexedImage):
+        if extension.lower() == ".png":
+            return encode_indexed_png(img, params)
+        img = img.to_rgb()
+
     img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-    cv2.imwrite(file_name, img)
+    try:
+        success, data = cv2.imencode(extension, img, _imwrite_params(params))
+    except cv2.error:
+        # there is no encoder for the extension
+        success = False
+    if not success:
+        raise ValueError(f"The image could not be encoded as '{extension}'.")
+    return data.tobytes()
+
+
+def encode_indexed_png(img: IndexedImage, params: dict = None) -> bytes:
+    """
+    Encode an indexed image as PNG with a palette
+
+    The pixels are stored with the smallest bit depth of 1, 2, 4 or 8
+    bit which can index all colors of the palette, so images with few
+    colors are a fraction of the size of RGB PNGs.
+
+    Args:
+        img: The image to encode
+        params: Optional encoder parameters, see write_image. The PNG
+            compression and strategy are used for zlib.
+
+    Returns:
+        The content of the PNG file
+    """
+    # the parameters are validated like the ones of the other formats
+    _imwrite_params(params)
+    params = params or {}
+    height, width = img.labels.shape
+    bit_depth = next(depth for depth in _PNG_BIT_DEPTHS
+                     if len(img.palette) <= 1 << depth)
+    rows = _pack_pixels(img.labels, bit_depth)
+    # every row starts with its filter type, 0 (none)
+    scanlines = np.zeros((height, rows.shape[1] + 1), np.uint8)
+    scanlines[:, 1:] = rows
+
+    # color type 3 (palette), default compression, filter and interlace
+    header = struct.pack(">IIBBBBB", width, height, bit_depth, 3, 0, 0, 0)
+    return b"".join([
+        _PNG_SIGNATURE,
+        _png_chunk(b"IHDR", header),
+        _png_chunk(b"PLTE", img.palette.tobytes()),
+        _png_chunk(b"IDAT", _compress(scanlines.tobytes(),
+                                      params.get("png_compression", _PNG_COMPRESSION_LEVEL),
+                                      params.get("png_strategy", zlib.Z_DEFAULT_STRATEGY))),
+        _png_chunk(b"IEND", b"")
+    ])
+
+
+def _pack_pixels(labels: np.ndarray, bit_depth: int) -> np.ndarray:
+    """
+    Pack the rows of pixels into bytes, the first pixel in the highest
+    bits of a byte, rows are padded to whole bytes
+    """
+    if bit_depth == 8:
+        return labels
+    if bit_depth == 1:
+        return np.packbits(labels, axis=1)
+    pixels_per_byte = 8 // bit_depth
+    height, width = labels.shape
+    padded = np.zeros((height, -(-width // pixels_per_byte) * pixels_per_byte),
+                      np.uint8)
+    padded[:, :width] = labels
+    padded = padded.reshape(height, -1, pixels_per_byte)
+    rows = padded[:, :, 0] << (8 - bit_depth)
+    for i in range(1, pixels_per_byte):
+        rows |= padded[:, :, i] << (8 - (i + 1) * bit_depth)
+    return rows
+
+
+class ImageWriter:
+    def __init__(self, max_workers: int = 1, max_pending: int = None):
+        """
+        Creates a new ImageWriter, which encodes and writes images on a pool of background threads, so the
+        next image can be processed meanwhile. OpenCV and zlib release the GIL while encoding.
+
+        Args:
+            max_workers: number of threads writing images
+            max_pending: maximum number of images which are queued or being written, by default twice the
+                number of threads. Writing another image blocks until one of them is written, so the memory
+                of the images waiting to be written is bounded.
+        """
+        self.__executor__ = ThreadPoolExecutor(max_workers, thread_name_prefix="image_writer")
+        self.__pending__ = threading.BoundedSemaphore(max_pending or 2 * max_workers)
+
+    def write(self, file_name: str, img, params: dict = None, callback=None, stage_hook=None) -> Future:
+        """
+        Writes the image in the background, see write_image. The image must not be changed until it is
+        written.
+
+        Args:
+            file_name: the name of the image file that will be created
+            img: the image to write, in RGB format, or an IndexedImage
+            params: optional encoder parameters, see write_image
+            callback: optional callable which receives the future once the image is written or failed to be
+                written. It is usually called on the writing thread, but on the calling thread if the image
+                is written already, so it has to be thread-safe.
+            stage_hook: optional callable which receives the `StageTiming` of writing the image
+
+        Returns:
+            The future of the write, its exception is the error raised while writing the image
+        """
+        self.__pending__.acquire()
+        try:
+            future = self.__executor__.submit(timed, stage_hook, "write", write_image, file_name, img, params)
+        except BaseException:
+            self.__pending__.release()
+            raise
+        future.add_done_callback(lambda _: self.__pending__.release())
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def close(self):
+        """
+        Waits until all images are written and stops the threads.
+        """
+        self.__executor__.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _imwrite_params(params: dict = None):
+    """
+    Converts the encoder parameters to the flat list of parameter ids and values of cv2.imwrite
+    """
+    flat_params = []
+    for name, value in (params or {}).items():
+        if name not in ENCODER_PARAMS:
+            raise ValueError(f"'{name}' is not a valid encoder parameter.")
+        flat_params += [ENCODER_PARAMS[name], int(value)]
+    return flat_params
+
+
+def _compress(data: bytes, level: int, strategy: int) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, strategy)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    # length, type, data and the CRC of type and data
+    return b"".join([struct.pack(">I", len(data)), chunk_type, data,
+                     struct.pack(">I", zlib.crc32(chunk_type + data))])
+
+
+def _reduced_read_flag(size, target_size: int) -> int:
+    """
+    Find the imread flag which decodes an image of the given size at the
+    smallest size which is still at least target_size
+    """
+    if size is not None:
+        for factor, flag in _REDUCED_READ_FLAGS:
+            if max(size) / factor >= target_size:
+                return flag
+    return cv2.IMREAD_COLOR
+
+
+def _image_size(filename: str, jpeg_only: bool = False):
+    """
+    Read the (width, height) of a PNG or JPEG image from its header,
+    without decoding the image
+
+    Returns:
+        The size of the image, or None if it cannot be determined or the
+        image is no JPEG image although jpeg_only is set
+    """
+    try:
+        with map_file(filename) as data:
+            return _encoded_image_size(data, jpeg_only)
+    except (OSError, ValueError):
+        return None
+
+
+def _encoded_image_size(data, jpeg_only: bool = False):
+    """
+    Read the (width, height) of an encoded PNG or JPEG image from its
+    header, the data is not copied
+
+    Returns:
+        The size of the image, or None if it cannot be determined or the
+        image is no JPEG image although jpeg_only is set
+    """
+    with memoryview(data) as view:
+        try:
+            if not jpeg_only and view[:8] == _PNG_SIGNATURE and view[12:16] == b"IHDR":
+                return struct.unpack_from(">II", view, 16)
+            if view[:2] == b"\xff\xd8":
+                return _jpeg_size(view)
+        except struct.error:
+            pass
+    return None
+
+
+def _jpeg_size(view: memoryview):
+    """
+    Read the size of a JPEG image from its start of frame marker
+    """
+    position = 2
+    while True:
+        if position + 2 > len(view) or view[position] != 0xFF:
+            return None
+        code = view[position + 1]
+        if code == 0xFF:
+            # skip fill bytes
+            position += 1
+            continue
+        position += 2
+        if code == 0x01 or 0xD0 <= code <= 0xD9:
+            # markers without a segment
+            continue
+        length, = struct.unpack_from(">H", view, position)
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack_from(">xHH", view, position + 2)
+            return width, height
+        position += length
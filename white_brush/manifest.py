@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+
+# name of the manifest file used for incremental runs if no other file is specified, see default_manifest_file
+DEFAULT_MANIFEST_FILE = ".whitebrush_manifest.jsonl"
+
+
+def default_manifest_file(inputs) -> str:
+    """
+    Returns the manifest file used for incremental runs over the given input files and directories. It lies in
+    the directory which contains all of them, where their outputs are written as well, so the manifest is found
+    again no matter from which directory the next run is started.
+
+    Args:
+        inputs: paths to the input files and directories
+
+    Returns:
+        The path to the manifest file
+    """
+    directories = [os.path.abspath(input) if os.path.isdir(input) else os.path.dirname(os.path.abspath(input))
+                   for input in inputs]
+    try:
+        directory = os.path.commonpath(directories)
+    except ValueError:
+        # the inputs are on different drives, there is no common directory
+        directory = directories[0]
+    return os.path.join(directory, DEFAULT_MANIFEST_FILE)
+
+
+class Manifest:
+    def __init__(self, file: str):
+        """
+        Creates a new Manifest which journals the enhanced files in the given file.
+
+        Every enhanced file is appended to the journal as soon as it is finished, so an interrupted run
+        resumes where it stopped. Entries are keyed by the absolute path of the input file, later entries
+        replace earlier ones. Files may be recorded from several threads, e.g. the threads which write the
+        enhanced images in the background.
+
+        Args:
+            file: path to the manifest file, it is created if it does not exist yet
+        """
+        self.file = file
+        self.entries = {}
+        self.outputs = set()
+        self.__journal__ = None
+        self.__lock__ = threading.Lock()
+
+        if os.path.exists(file):
+            self.__load__()
+
+    def is_up_to_date(self, source_file: str, fingerprint: str) -> bool:
+        """
+        Checks whether the output of the given source file is up to date, without reading the source file.
+
+        Args:
+            source_file: source file
+            fingerprint: fingerprint of the configuration the source file would be enhanced with
+
+        Returns:
+            True if the source file was enhanced with the same fingerprint, has not changed since and its
+            output still exists.
+        """
+        entry = self.entries.get(os.path.abspath(source_file))
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return False
+
+        try:
+            stat = os.stat(source_file)
+        except OSError:
+            return False
+
+        return entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns \
+            and os.path.exists(entry["output"])
+
+    def previous_target(self, source_file: str):
+        """
+        Returns the target file the given source file was enhanced to the last time, or None.
+        """
+        entry = self.entries.get(os.path.abspath(source_file))
+        if entry is None or not os.path.exists(entry["output"]):
+            return None
+        return entry["output"]
+
+    def is_output(self, file: str) -> bool:
+        """
+        Checks whether the given file is the output of one of the enhanced files. Files which replaced their
+        input are no outputs, they are inputs which may have changed since.
+        """
+        return os.path.abspath(file) in self.outputs
+
+    def record(self, source_file: str, target_file: str, fingerprint: str):
+        """
+        Records that the given source file got enhanced to the target file and appends it to the journal.
+
+        Args:
+            source_file: source file, it is checked after it got enhanced since it may be the target file
+            target_file: target file
+            fingerprint: fingerprint of the configuration the source file was enhanced with
+        """
+        stat = os.stat(source_file)
+        entry = {
+            "input": os.path.abspath(source_file),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "fingerprint": fingerprint,
+            "output": os.path.abspath(target_file)
+        }
+        with self.__lock__:
+            self.__add_entry__(entry)
+            self.__append__(entry)
+
+    def close(self):
+        """
+        Closes the journal of the manifest.
+        """
+        with self.__lock__:
+            if self.__journal__ is not None:
+                self.__journal__.close()
+                self.__journal__ = None
+
+    def __append__(self, entry):
+        if self.__journal__ is None:
+            directory = os.path.dirname(self.file)
+            if len(directory) > 0:
+                os.makedirs(directory, exist_ok=True)
+            self.__journal__ = open(self.file, "a")
+            if self.__journal__.tell() > 0 and not self.__ends_with_newline__():
+                # terminate the incomplete last line of an interrupted run
+                self.__journal__.write("\n")
+        self.__journal__.write(json.dumps(entry) + "\n")
+        self.__journal__.flush()
+
+    def __load__(self):
+        n_lines = 0
+        with open(self.file) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line of an interrupted run may be incomplete
+                    continue
+                self.__add_entry__(entry)
+                n_lines += 1
+
+        # compact the journal once most of its lines are outdated
+        if n_lines > 2 * len(self.entries) + 100:
+            temporary_file = self.file + ".tmp"
+            with open(temporary_file, "w") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(temporary_file, self.file)
+
+    def __ends_with_newline__(self):
+        with open(self.file, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def __add_entry__(self, entry):
+        previous = self.entries.get(entry["input"])
+        if previous is not None:
+            self.outputs.discard(previous["output"])
+        self.entries[entry["input"]] = entry
+        if entry["output"] != entry["input"]:
+            self.outputs.add(entry["output"])
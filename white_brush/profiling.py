@@ -0,0 +1,94 @@
+import json
+import time
+
+import numpy as np
+
+
+class StageTiming:
+
+    def __init__(self, stage, wall_time, cpu_time, shape=None, size=None):
+        """
+        Creates a new StageTiming, describing one executed stage of the enhancement.
+
+        Args:
+            stage: name of the stage, sub steps are separated by a dot, e.g. 'extract_foreground.otsu_threshold'
+            wall_time: elapsed real time in seconds
+            cpu_time: cpu time of the process in seconds, may be larger than wall_time if several threads are used
+            shape: shape of the array returned by the stage, if it returned one
+            size: size in bytes of the array returned by the stage, if it returned one
+        """
+        self.stage = stage
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.shape = shape
+        self.size = size
+
+    def to_dict(self):
+        return {
+            "stage": self.stage,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "shape": self.shape,
+            "size": self.size
+        }
+
+
+def timed(stage_hook, stage, func, *args, **kwargs):
+    """
+    Calls func with the given arguments and reports how long it took to the stage_hook.
+
+    If stage_hook is None, func is just called, without any measurements.
+
+    Args:
+        stage_hook: callable receiving a StageTiming, or None
+        stage: name of the stage
+        func: the function executing the stage
+
+    Returns:
+        The result of func
+    """
+    if stage_hook is None:
+        return func(*args, **kwargs)
+
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    result = func(*args, **kwargs)
+    wall_time, cpu_time = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    stage_hook(stage_timing(stage, wall_time, cpu_time, result))
+    return result
+
+
+def stage_timing(stage, wall_time, cpu_time, result) -> StageTiming:
+    """
+    Creates the StageTiming of a stage, with the shape and size of its result if it is an array.
+    """
+    shape, size = None, None
+    if isinstance(result, np.ndarray):
+        shape, size = list(result.shape), result.nbytes
+    return StageTiming(stage, wall_time, cpu_time, shape, size)
+
+
+class TimingLog:
+    def __init__(self, file):
+        """
+        Creates a new TimingLog which appends the stage timings of each enhanced image as a JSON line to the
+        given file. Several processes may write to the same file.
+
+        Args:
+            file: path to the file
+        """
+        self.file = file
+
+    def write(self, image, timings):
+        """
+        Appends the timings of an image to the log.
+
+        Args:
+            image: name of the image
+            timings: list of StageTiming
+        """
+        line = json.dumps({"image": image, "stages": [timing.to_dict() for timing in timings]})
+        # a single write of the whole line, so lines of different
+        # processes are not mixed
+        with open(self.file, "a") as f:
+            f.write(line + "\n")
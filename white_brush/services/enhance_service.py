@@ -1,19 +1,203 @@
-from white_brush import io
-from white_brush.enhance import enhance
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+from white_brush import io, PIPELINE_VERSION
+from white_brush.cache import ResultCache
+from white_brush.colors.calc_colors import Palette
+from white_brush.enhance import enhance, ImageEnhancer, REDUCED_READ_SIZE
 from white_brush.entities.color_configuration import ColorConfiguration
+from white_brush.profiling import timed, TimingLog
+from white_brush.workspace import Workspace
 
 
 class EnhanceService:
+    def __init__(self, cache: ResultCache = None, full_resolution: bool = False, timing_log: TimingLog = None):
+        """
+        Creates a new EnhanceService.
+
+        Args:
+            cache: optional cache of enhanced images. If an input with the same content was enhanced
+                with the same configuration before, the result is taken from the cache.
+            full_resolution: keep the resolution of the input files instead of downscaling large ones
+            timing_log: optional log the time of every stage of the enhancement of each file is written to
+        """
+        self.cache = cache
+        self.full_resolution = full_resolution
+        self.timing_log = timing_log
+        # number of files the shared palette is fitted to, 0 if every file gets its own palette
+        self.shared_palette = 0
+        # palette of foreground colors shared by all files, see fit_palette
+        self.palette = None
+        # write the enhanced images as palette PNGs, if the output is a PNG file
+        self.indexed = False
+        # parameters of the encoder of the enhanced images, see io.write_image
+        self.encoder_params = None
+        # k-means implementation which fits the palettes, one of calc_colors.KMEANS_BACKENDS
+        self.kmeans_backend = "numpy"
+        # optional io.ImageWriter which writes the enhanced images in the background
+        self.writer = None
+        # buffers of the intermediate images, reused for all images of the same size
+        self.workspace = Workspace()
+        # guards the cache and timing log against the threads of the writer
+        self.__lock__ = threading.Lock()
+
     def enhance_file(self, input: str, output: str, rotation: int, config: ColorConfiguration):
         """
         Enhances the given input_file_name with the given color configuration to the output_file_name.
 
+        If the service has a writer, the enhanced image is written in the background and a future is returned,
+        which is done once the output file is written, cached and its timings are logged. Its exception is the
+        error raised while doing so.
+
         Args:
             input: path to the input file
             output: path to the output file
             rotation: degree the output file should be rotated
             config:  color_configuration
+
+        Returns:
+            The future of writing the output file, or None if it was written already
+        """
+        timings = [] if self.timing_log is not None else None
+        stage_hook = timings.append if timings is not None else None
+        # large images are downscaled to the working size anyway
+        target_size = None if self.full_resolution else REDUCED_READ_SIZE
+
+        if self.cache is not None:
+            # the input is mapped into memory to hash it for the key and decoded from the same pages, which
+            # are still in the page cache. It is unmapped before the result is copied, since the output may
+            # be the input itself and mapped files can't be replaced on every platform
+            with io.map_file(input) as data:
+                key = self.cache.data_key(data, self.fingerprint(rotation, config), os.path.splitext(output)[1])
+            if self.cache.get(key, output):
+                return None
+            with io.map_file(input) as data:
+                img = timed(stage_hook, "read", io.decode_image, data, target_size=target_size)
+        else:
+            key = None
+            img = timed(stage_hook, "read", io.read_image, input, target_size=target_size)
+
+        out = enhance(img, config, rotation = rotation, full_resolution=self.full_resolution,
+                      stage_hook=stage_hook, workspace=self.workspace, palette=self.palette,
+                      indexed=self.indexed, kmeans_backend=self.kmeans_backend)
+        if self.writer is not None:
+            written = Future()
+            self.writer.write(output, out, self.encoder_params, stage_hook=stage_hook,
+                              callback=lambda write: self.__written__(write, written, input, output, key, timings))
+            return written
+        timed(stage_hook, "write", io.write_image, output, out, self.encoder_params)
+        self.__log_and_cache__(input, output, key, timings)
+        return None
+
+    def enhance_bytes(self, data, config: ColorConfiguration, rotation: int = 0, format: str = ".png") -> bytes:
+        """
+        Enhances the given content of an image file with the given color configuration, without touching the
+        disk, e.g. for images which are uploaded.
+
+        The cache, writer and timing log of the service are not used. Every call uses a workspace of its own,
+        so it may be called from several threads at once, e.g. by the threads of a web server.
+
+        Args:
+            data: content of the input file, any bytes-like object, e.g. bytes, memoryview or a memory-mapped file
+            config: color_configuration
+            rotation: degree the output should be rotated
+            format: file extension of the format of the output, e.g. '.png' or '.jpg'
+
+        Returns:
+            The content of the enhanced image file
+        """
+        img = io.decode_image(data, target_size=None if self.full_resolution else REDUCED_READ_SIZE)
+        out = enhance(img, config, rotation=rotation, full_resolution=self.full_resolution,
+                      workspace=Workspace(), palette=self.palette, indexed=self.indexed,
+                      kmeans_backend=self.kmeans_backend)
+        return io.encode_image(out, format, self.encoder_params)
+
+    def __written__(self, write, written, input, output, key, timings):
+        """
+        Logs the timings and caches the output file once it is written in the background, then completes the
+        written future. Errors of writing, logging and caching are its exception, like enhance_file raises them
+        without a writer.
         """
-        img = io.read_image(input)
-        out = enhance(img, config, rotation = rotation)
-        io.write_image(output, out)
+        try:
+            write.result()
+            self.__log_and_cache__(input, output, key, timings)
+        except Exception as error:
+            written.set_exception(error)
+        else:
+            written.set_result(None)
+
+    def __log_and_cache__(self, input, output, key, timings):
+        """
+        Logs the timings and caches the output file. Several writing threads may call it at once.
+        """
+        with self.__lock__:
+            if timings is not None:
+                self.timing_log.write(input, timings)
+
+            if self.cache is not None:
+                self.cache.put(key, output)
+
+    def __getstate__(self):
+        # locks can't be pickled, the service is sent to worker processes without it
+        state = self.__dict__.copy()
+        del state["__lock__"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__lock__ = threading.Lock()
+
+    def fit_palette(self, inputs, rotation: int, config: ColorConfiguration):
+        """
+        Fits one palette of foreground colors to the pooled foreground colors of the given input files. All
+        files enhanced afterwards are colored with it instead of fitting a palette for each file, which is
+        faster and gives every page of a batch the same colors.
+
+        Args:
+            inputs: paths to the input files, e.g. the first files of the batch
+            rotation: degree the output files should be rotated
+            config: color_configuration
+
+        Returns:
+            The fitted palette, None if there were no input files
+        """
+        enhancer = ImageEnhancer(config, rotation, workspace=self.workspace)
+        colors = [enhancer.foreground_colors(io.read_image(input, target_size=REDUCED_READ_SIZE)) for input in inputs]
+        self.palette = Palette.fit(np.concatenate(colors), backend=self.kmeans_backend) if colors else None
+        return self.palette
+
+    def fingerprint(self, rotation: int, config: ColorConfiguration) -> str:
+        """
+        Calculates a fingerprint of everything which influences the enhanced images besides the input itself.
+
+        Args:
+            rotation: degree the output file should be rotated
+            config: color_configuration
+
+        Returns:
+            The fingerprint as hex string. Two enhancements with the same input and fingerprint have the same output.
+        """
+        settings = {
+            "pipeline_version": PIPELINE_VERSION,
+            "rotation": rotation,
+            "full_resolution": self.full_resolution,
+            "foreground_color": config.foreground_color,
+            "background_color": config.background_color,
+            "foreground_palette": config.foreground_palette,
+            "shared_palette": self.shared_palette,
+            "palette": None if self.palette is None else self.__palette_digest__(),
+            "indexed": self.indexed,
+            "kmeans_backend": self.kmeans_backend,
+            "encoder_params": self.encoder_params
+        }
+        return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+    def __palette_digest__(self) -> str:
+        digest = hashlib.sha1(self.palette.centers.tobytes())
+        digest.update(self.palette.colors.tobytes())
+        return digest.hexdigest()
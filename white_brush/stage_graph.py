@@ -0,0 +1,58 @@
+import time
+
+from white_brush.profiling import stage_timing
+
+
+class StageGraph:
+    def __init__(self, stages: dict, values: dict = None, stage_hook=None, prefix: str = ""):
+        """
+        Creates a new StageGraph, a lazily computed set of named intermediates of one image.
+
+        Each stage computes one intermediate from the graph, asking the graph for the intermediates it depends
+        on. An intermediate is only computed when it is asked for the first time, so every intermediate is
+        computed at most once and intermediates nobody asks for are not computed at all.
+
+        Args:
+            stages: dictionary of the name of each intermediate to the function computing it, the function
+                receives the graph as only argument
+            values: intermediates which are known from the beginning, e.g. the input image
+            stage_hook: optional callable which receives a StageTiming for every computed intermediate. The
+                timings only contain the time of the stage itself, without the intermediates it depends on.
+            prefix: prefix of the stage names passed to the stage_hook
+        """
+        self.stages = stages
+        self.values = dict(values or {})
+        self.stage_hook = stage_hook
+        self.prefix = prefix
+        # (wall time, cpu time) of the intermediates computed while
+        # computing each intermediate which is currently computed
+        self.__nested_times__ = [[0.0, 0.0]]
+
+    def __getitem__(self, name: str):
+        if name not in self.values:
+            if self.stage_hook is None:
+                self.values[name] = self.stages[name](self)
+            else:
+                self.values[name] = self.__timed__(name)
+        return self.values[name]
+
+    def __contains__(self, name: str) -> bool:
+        """
+        Checks whether the given intermediate is already computed.
+        """
+        return name in self.values
+
+    def __timed__(self, name):
+        self.__nested_times__.append([0.0, 0.0])
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            value = self.stages[name](self)
+        finally:
+            wall_time, cpu_time = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            nested_wall_time, nested_cpu_time = self.__nested_times__.pop()
+            self.__nested_times__[-1][0] += wall_time
+            self.__nested_times__[-1][1] += cpu_time
+
+        self.stage_hook(stage_timing(self.prefix + name, wall_time - nested_wall_time,
+                                     cpu_time - nested_cpu_time, value))
+        return value
@@ -31,6 +31,9 @@ def resize_if(img: np.ndarray, target_size: int,
     size = max(img.shape[:2])
     if size > thresh_size:
         f = 1 / (size / target_size)
+        # area interpolation gives the best results when shrinking, but
+        # is much slower for enlarging
+        interpolation = cv2.INTER_AREA if f < 1 else cv2.INTER_CUBIC
         img = cv2.resize(img, None, fx=f, fy=f,
-                         interpolation=cv2.INTER_CUBIC)
+                         interpolation=interpolation)
     return img
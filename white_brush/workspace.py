@@ -0,0 +1,70 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class Workspace:
+    def __init__(self, max_shapes: int = 2):
+        """
+        Creates a new Workspace, a pool of buffers for the intermediate images of the enhancement.
+
+        Enhancing many images of the same size reuses the same buffers instead of allocating new ones for every
+        image. The buffers are grouped by the size of the image they belong to, only the buffers of the
+        max_shapes most recently used image sizes are kept.
+
+        A pickled Workspace does not contain any buffers, so it is cheap to send to worker processes.
+
+        Args:
+            max_shapes: number of image sizes whose buffers are kept
+        """
+        self.max_shapes = max_shapes
+        self.peak_nbytes = 0
+        self.__buffers__ = OrderedDict()
+
+    def buffer(self, name: str, shape, dtype=np.uint8) -> np.ndarray:
+        """
+        Returns the buffer with the given name, shape and dtype. Its content is undefined, it may still contain
+        the values of the previous image.
+
+        Args:
+            name: name of the buffer, e.g. the stage it is used in
+            shape: shape of the buffer, the first two dimensions are the size of the image
+            dtype: dtype of the buffer
+
+        Returns:
+            The buffer
+        """
+        shape = tuple(shape)
+        size = shape[:2]
+        buffers = self.__buffers__.get(size)
+        if buffers is None:
+            buffers = self.__buffers__[size] = {}
+            while len(self.__buffers__) > self.max_shapes:
+                self.__buffers__.popitem(last=False)
+        else:
+            self.__buffers__.move_to_end(size)
+
+        key = (name, shape, np.dtype(dtype))
+        buffer = buffers.get(key)
+        if buffer is None:
+            buffer = buffers[key] = np.empty(shape, dtype)
+            self.peak_nbytes = max(self.peak_nbytes, self.nbytes)
+        return buffer
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Size of all buffers currently kept in the workspace in bytes.
+        """
+        return sum(buffer.nbytes for buffers in self.__buffers__.values() for buffer in buffers.values())
+
+    def clear(self):
+        """
+        Releases all buffers of the workspace.
+        """
+        self.__buffers__.clear()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["__buffers__"] = OrderedDict()
+        return state